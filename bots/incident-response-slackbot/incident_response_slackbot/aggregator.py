@@ -0,0 +1,135 @@
+import asyncio
+import time
+import typing as t
+from logging import getLogger
+
+from incident_response_slackbot.config import get_config
+from openai_slackbot.clients.slack import CreateSlackMessageResponse, SlackClient
+
+logger = getLogger(__name__)
+
+# Maximum number of distinct values listed per alert property in a rollup.
+_MAX_ROLLUP_VALUES = 5
+
+
+class _AlertGroup:
+    def __init__(self, now: float) -> None:
+        self.message_ts: t.Optional[str] = None
+        self.last_seen_at = now
+        self.pending: t.List[t.Dict[str, t.Any]] = []
+        self.total = 1
+
+
+class AlertAggregator:
+    """
+    Groups repeated alerts for the same user and rule. The first alert of a
+    group is posted as a new feed thread, and later alerts received within
+    window_seconds of the previous one are appended to that thread as a
+    compact rollup every rollup_interval seconds.
+    """
+
+    def __init__(
+        self,
+        *,
+        slack_client: SlackClient,
+        post_alert: t.Callable[[t.Dict[str, t.Any]], t.Awaitable[CreateSlackMessageResponse]],
+        window_seconds: float = 60,
+        rollup_interval: float = 10,
+    ) -> None:
+        self._slack_client = slack_client
+        self._post_alert = post_alert
+        self._window_seconds = window_seconds
+        self._rollup_interval = rollup_interval
+        self._groups: t.Dict[t.Tuple[str, str], _AlertGroup] = {}
+        self.config = get_config()
+
+    async def submit(self, alert: t.Dict[str, t.Any]) -> bool:
+        """Posts or aggregates the alert, returns True if it started a new thread."""
+        key = (alert.get("user_id"), alert.get("id") or alert.get("name"))
+        now = time.monotonic()
+
+        group = self._groups.get(key)
+        if group is not None and now - group.last_seen_at <= self._window_seconds:
+            group.pending.append(alert)
+            group.last_seen_at = now
+            group.total += 1
+            return False
+
+        # Flush the closed group's remaining alerts before its thread is forgotten.
+        # A failed rollup loses those alerts, but mustn't lose the new one.
+        if group is not None:
+            try:
+                await self._post_rollup(group)
+            except Exception:
+                logger.exception(f"Dropping {len(group.pending)} alerts aggregated for {key}")
+
+        # Register the group before posting, so that alerts arriving while the
+        # root message is posted are aggregated into it.
+        group = _AlertGroup(now)
+        self._groups[key] = group
+        try:
+            message = await self._post_alert(alert)
+        except Exception:
+            del self._groups[key]
+            if group.pending:
+                logger.warning(f"Dropping {len(group.pending)} alerts aggregated for {key}")
+            raise
+
+        group.message_ts = message.ts
+        return True
+
+    async def flush(self) -> None:
+        """Posts the pending rollups and forgets groups whose window has closed."""
+        now = time.monotonic()
+        for key, group in list(self._groups.items()):
+            await self._post_rollup(group)
+            if now - group.last_seen_at > self._window_seconds and not group.pending:
+                if self._groups.get(key) is group:
+                    del self._groups[key]
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self._rollup_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to post alert rollups")
+
+    async def _post_rollup(self, group: _AlertGroup) -> None:
+        if group.message_ts is None or not group.pending:
+            return
+
+        alerts, group.pending = group.pending, []
+        try:
+            await self._slack_client.post_message(
+                channel=self.config.feed_channel_id,
+                text=format_rollup(alerts, group.total),
+                thread_ts=group.message_ts,
+            )
+        except Exception:
+            # Put the alerts back, so that they're included in the next rollup.
+            group.pending = alerts + group.pending
+            raise
+
+
+def format_rollup(alerts: t.List[t.Dict[str, t.Any]], total: int) -> str:
+    """
+    Summarizes repeated alerts as the number of occurrences and the distinct
+    values of their properties.
+    """
+    lines = [f"Alert repeated {len(alerts)} more time(s), {total} in total."]
+
+    values: t.Dict[str, t.List[str]] = {}
+    for alert in alerts:
+        for name, value in (alert.get("properties") or {}).items():
+            distinct = values.setdefault(name, [])
+            if str(value) not in distinct:
+                distinct.append(str(value))
+
+    for name, distinct in values.items():
+        listed = ", ".join(distinct[:_MAX_ROLLUP_VALUES])
+        if len(distinct) > _MAX_ROLLUP_VALUES:
+            listed += f" (+{len(distinct) - _MAX_ROLLUP_VALUES} more)"
+        lines.append(f"• {name}: {listed}")
+
+    return "\n".join(lines)
@@ -3,6 +3,7 @@ import os
 
 from incident_response_slackbot.config import load_config, get_config
 from incident_response_slackbot.handlers import (
+    JOBS,
     InboundDirectMessageHandler,
     InboundIncidentDoNothingHandler,
     InboundIncidentEndChatHandler,
@@ -30,5 +31,6 @@ if __name__ == "__main__":
             slack_message_handler=message_handler,
             slack_action_handlers=action_handlers,
             slack_template_path=template_path,
+            on_startup=JOBS.start,
         )
     )
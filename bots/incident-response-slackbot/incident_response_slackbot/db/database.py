@@ -1,82 +1,606 @@
+import asyncio
+import json
 import os
 import pickle
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# A user can have several open incidents, one per alert thread, and chats are
+# only started for some of them. Slack timestamps are fixed width, so ordering
+# them as text orders them in time and the (user_id, message_ts) index finds a
+# user's most recent incident directly.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS incidents (
+    message_ts TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    chat_started INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS incidents_user_id_message_ts ON incidents (user_id, message_ts);
+CREATE TABLE IF NOT EXISTS greetings (
+    message_ts TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    greeting TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_ts TEXT NOT NULL,
+    role TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversations_message_ts_id ON conversations (message_ts, id);
+CREATE TABLE IF NOT EXISTS summaries (
+    message_ts TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    summarized_through INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Setting holding the name of the analyst who last started a chat, which the
+# alert feed uses to precompute greetings for new alerts.
+LAST_ANALYST_NAME_KEY = "last_analyst_name"
+
+# Bounds on an incident's conversation log. The alert entries are always
+# kept, and the oldest chat messages are dropped first.
+CONVERSATION_MAX_ENTRIES = 100
+CONVERSATION_MAX_TEXT_LENGTH = 4000
 
 
 class Database:
     """
     This class represents a database for storing user messages.
-    The data is stored in a pickle file.
+    The data is stored in a SQLite database in WAL mode, so that the bot and
+    the alert feed script can use it concurrently.
     """
 
-    def __init__(self):
+    def __init__(self, file_path=None):
         """
-        Initialize the database. Load data from the pickle file if it exists,
-        otherwise create an empty dictionary.
+        Initialize the database. The connection is opened on first use, and
+        data from the legacy pickle file is migrated if it exists.
         """
         current_dir = os.path.dirname(os.path.realpath(__file__))
-        self.file_path = os.path.join(current_dir, "data.pkl")
-        self.data = {}
+        self.file_path = file_path or os.path.join(current_dir, "data.db")
+        self.pickle_file_path = os.path.join(os.path.dirname(self.file_path), "data.pkl")
+        self._conn = None
+        self._lock = threading.Lock()
 
-    def _load_data(self):
+        # In-memory index of users with an active chat, reloaded when another
+        # connection (e.g. the alert feed script) commits to the database.
+        self._active_users = set()
+        self._data_version = None
+
+    def _connect(self):
         """
-        Load data from the pickle file if it exists,
-        otherwise return an empty dictionary.
+        Return the database connection, creating the schema and migrating
+        the pickle file on first use.
         """
-        if os.path.exists(self.file_path):
-            with open(self.file_path, "rb") as f:
-                return pickle.load(f)
-        else:
-            return {}
+        with self._lock:
+            if self._conn is None:
+                conn = sqlite3.connect(self.file_path, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA busy_timeout=5000")
+                conn.executescript(_SCHEMA)
+                self._migrate_pickle(conn)
+                self._conn = conn
+            return self._conn
 
-    def _save(self):
+    def _migrate_pickle(self, conn):
         """
-        Save the current state of the database to the pickle file.
+        Import the entries from the legacy pickle file, then rename it so
+        the migration only runs once.
         """
-        with open(self.file_path, "wb") as f:
-            pickle.dump(self.data, f)
+        if not os.path.exists(self.pickle_file_path):
+            return
+
+        with open(self.pickle_file_path, "rb") as f:
+            data = pickle.load(f)
+
+        with conn:
+            for user_id, entry in data.items():
+                conn.execute(
+                    "INSERT OR REPLACE INTO incidents (message_ts, user_id, chat_started) "
+                    "VALUES (?, ?, 1)",
+                    (entry["message_ts"], user_id),
+                )
+
+        os.replace(self.pickle_file_path, f"{self.pickle_file_path}.migrated")
+        logger.info(f"Migrated {len(data)} entries from {self.pickle_file_path}")
 
     # Add a new entry to the database
     def add(self, user_id, message_ts):
         """
-        Add a new entry to the database. If the user_id already exists,
-        update the message timestamp. Otherwise, create a new entry.
+        Add a new incident for the user, keyed by its alert thread's
+        message timestamp. The user's other open incidents are kept.
+        """
+        self.write_batch([("add", (user_id, message_ts))])
+
+    # Mark an incident's chat as started
+    def start_chat(self, user_id, message_ts):
+        """
+        Mark the chat with the user as started for the incident, so that the
+        user's direct messages are routed to it.
         """
-        self.data = self._load_data()
-        self.data.setdefault(user_id, {})["message_ts"] = message_ts
-        self._save()
+        self.write_batch([("start_chat", (user_id, message_ts))])
 
     # Delete an entry from the database
-    def delete(self, user_id):
+    def delete(self, user_id, message_ts=None):
         """
-        Delete an entry from the database using the user_id as the key.
+        Delete the user's incident with the given message timestamp, or all
+        of the user's incidents if it's not given.
         """
-        self.data = self._load_data()
-        self.data.pop(user_id, None)
-        self._save()
+        self.write_batch([("delete", (user_id, message_ts))])
 
-    # Check if user_id exists in the database
+    def write_batch(self, writes):
+        """
+        Apply a list of ("add", (user_id, message_ts)),
+        ("start_chat", (user_id, message_ts)) and ("delete", (user_id, message_ts))
+        writes in a single transaction.
+        """
+        conn = self._connect()
+        with self._lock:
+            with conn:
+                active = self._apply_writes(conn, writes)
+            # Only update the active user index once the writes are committed.
+            for user_id, is_active in active.items():
+                if is_active:
+                    self._active_users.add(user_id)
+                else:
+                    self._active_users.discard(user_id)
+
+    def _apply_writes(self, conn, writes):
+        """
+        Execute the writes, returning whether each written user has a started
+        chat.
+        """
+        active = {}
+        for operation, (user_id, message_ts) in writes:
+            if operation == "add":
+                conn.execute(
+                    "INSERT INTO incidents (message_ts, user_id) VALUES (?, ?) "
+                    "ON CONFLICT (message_ts) DO UPDATE SET user_id = excluded.user_id",
+                    (message_ts, user_id),
+                )
+            elif operation == "start_chat":
+                conn.execute(
+                    "UPDATE incidents SET chat_started = 1 WHERE user_id = ? AND message_ts = ?",
+                    (user_id, message_ts),
+                )
+            elif operation == "delete":
+                if message_ts is None:
+                    for table in ("conversations", "summaries"):
+                        conn.execute(
+                            f"DELETE FROM {table} WHERE message_ts IN "
+                            "(SELECT message_ts FROM incidents WHERE user_id = ?)",
+                            (user_id,),
+                        )
+                    conn.execute("DELETE FROM incidents WHERE user_id = ?", (user_id,))
+                else:
+                    for table in ("conversations", "summaries"):
+                        conn.execute(f"DELETE FROM {table} WHERE message_ts = ?", (message_ts,))
+                    conn.execute(
+                        "DELETE FROM incidents WHERE user_id = ? AND message_ts = ?",
+                        (user_id, message_ts),
+                    )
+
+            else:
+                raise ValueError(f"Unknown write operation: {operation}")
+
+            started = conn.execute(
+                "SELECT 1 FROM incidents WHERE user_id = ? AND chat_started = 1 LIMIT 1",
+                (user_id,),
+            ).fetchone()
+            active[user_id] = started is not None
+        return active
+
+    # Check if user_id has a started chat
     def user_exists(self, user_id):
         """
-        Check if the user_id exists in the database.
+        Check if the user has a started chat for one of their open incidents.
         """
-        self.data = self._load_data()
-        return user_id in self.data
+        conn = self._connect()
+        with self._lock:
+            self._refresh_active_users(conn)
+            return user_id in self._active_users
 
     # Return the message timestamp for a given user_id
     def get_ts(self, user_id):
         """
-        Return the message timestamp for a given user_id.
+        Return the message timestamp of the user's most recent open incident
+        with a started chat.
         """
-        self.data = self._load_data()
-        return self.data[user_id]["message_ts"]
+        row = self._fetch_one(
+            "SELECT message_ts FROM incidents WHERE user_id = ? AND chat_started = 1 "
+            "ORDER BY message_ts DESC LIMIT 1",
+            user_id,
+        )
+        if row is None:
+            raise KeyError(user_id)
+        return row[0]
+
+    # Return all message timestamps for a given user_id
+    def get_all_ts(self, user_id):
+        """
+        Return the message timestamps of the user's open incidents, most
+        recent first.
+        """
+        conn = self._connect()
+        with self._lock:
+            rows = conn.execute(
+                "SELECT message_ts FROM incidents WHERE user_id = ? ORDER BY message_ts DESC",
+                (user_id,),
+            ).fetchall()
+        return [row[0] for row in rows]
 
     # Return the user_id given a message_ts
     def get_user_id(self, message_ts):
         """
         Return the user_id given a message_ts.
         """
-        self.data = self._load_data()
-        for user_id, data in self.data.items():
-            if data["message_ts"] == message_ts:
-                return user_id
-        return None
+        row = self._fetch_one("SELECT user_id FROM incidents WHERE message_ts = ?", message_ts)
+        return row[0] if row else None
+
+    # Append messages to an incident's conversation log
+    def append_conversation(self, message_ts, entries):
+        """
+        Append {"role": ..., "text": ...} entries to the incident's
+        conversation log, then drop the oldest chat messages over the bound.
+        """
+        conn = self._connect()
+        with self._lock, conn:
+            conn.executemany(
+                "INSERT INTO conversations (message_ts, role, text) VALUES (?, ?, ?)",
+                [
+                    (message_ts, entry["role"], entry["text"][:CONVERSATION_MAX_TEXT_LENGTH])
+                    for entry in entries
+                ],
+            )
+            conn.execute(
+                "DELETE FROM conversations WHERE message_ts = ? AND role != 'alert' AND id NOT IN "
+                "(SELECT id FROM conversations WHERE message_ts = ? ORDER BY id DESC LIMIT ?)",
+                (message_ts, message_ts, CONVERSATION_MAX_ENTRIES),
+            )
+
+    # Return an incident's conversation log
+    def get_conversation(self, message_ts):
+        """
+        Return the incident's conversation log, oldest entry first.
+        """
+        conn = self._connect()
+        with self._lock:
+            rows = conn.execute(
+                "SELECT role, text FROM conversations WHERE message_ts = ? ORDER BY id",
+                (message_ts,),
+            ).fetchall()
+        return [{"role": role, "text": text} for role, text in rows]
+
+    # Return an incident's rolling summary and the messages it doesn't cover yet
+    def get_summary_delta(self, message_ts):
+        """
+        Return (summary, entries, summarized_through): the incident's rolling
+        summary or None, the conversation entries appended since it was
+        updated, and the id of the last of those entries.
+        """
+        conn = self._connect()
+        with self._lock:
+            row = conn.execute(
+                "SELECT summary, summarized_through FROM summaries WHERE message_ts = ?",
+                (message_ts,),
+            ).fetchone()
+            summary, summarized_through = row if row else (None, 0)
+            rows = conn.execute(
+                "SELECT id, role, text FROM conversations "
+                "WHERE message_ts = ? AND id > ? ORDER BY id",
+                (message_ts, summarized_through),
+            ).fetchall()
+
+        entries = [{"role": role, "text": text} for _, role, text in rows]
+        return summary, entries, rows[-1][0] if rows else summarized_through
+
+    # Store an incident's rolling summary
+    def put_summary(self, message_ts, summary, summarized_through):
+        """
+        Store the incident's rolling summary, covering the conversation up to
+        the entry with id summarized_through. A summary covering less of the
+        conversation than the stored one, or for an incident that was deleted
+        since, is ignored.
+        """
+        conn = self._connect()
+        with self._lock, conn:
+            conn.execute(
+                "INSERT INTO summaries (message_ts, summary, summarized_through) "
+                "SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM incidents WHERE message_ts = ?) "
+                "ON CONFLICT (message_ts) DO UPDATE SET "
+                "summary = excluded.summary, summarized_through = excluded.summarized_through "
+                "WHERE excluded.summarized_through > summaries.summarized_through",
+                (message_ts, summary, summarized_through, message_ts),
+            )
+
+    # Persist a background job
+    def add_job(self, kind, payload):
+        """
+        Persist a background job with a JSON-serializable payload, and return
+        its id. The job is kept until it's removed with delete_job.
+        """
+        conn = self._connect()
+        with self._lock, conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, payload, created_at) VALUES (?, ?, ?)",
+                (kind, json.dumps(payload), time.time()),
+            )
+        return cursor.lastrowid
+
+    # Return the persisted background jobs
+    def get_jobs(self):
+        """
+        Return the persisted jobs as dicts with id, kind, payload, created_at
+        and attempts, oldest first.
+        """
+        conn = self._connect()
+        with self._lock:
+            rows = conn.execute(
+                "SELECT id, kind, payload, created_at, attempts FROM jobs ORDER BY id"
+            ).fetchall()
+        return [
+            {
+                "id": job_id,
+                "kind": kind,
+                "payload": json.loads(payload),
+                "created_at": created_at,
+                "attempts": attempts,
+            }
+            for job_id, kind, payload, created_at, attempts in rows
+        ]
+
+    # Record a failed attempt at a background job
+    def increment_job_attempts(self, job_id):
+        conn = self._connect()
+        with self._lock, conn:
+            conn.execute("UPDATE jobs SET attempts = attempts + 1 WHERE id = ?", (job_id,))
+
+    # Remove a finished background job
+    def delete_job(self, job_id):
+        conn = self._connect()
+        with self._lock, conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    # Cache a greeting precomputed for an alert thread
+    def put_greeting(self, message_ts, fingerprint, greeting, ttl_seconds):
+        """
+        Cache the greeting generated for the alert thread, along with the
+        fingerprint of the prompt it was generated from.
+        """
+        conn = self._connect()
+        with self._lock, conn:
+            conn.execute("DELETE FROM greetings WHERE expires_at <= ?", (time.time(),))
+            conn.execute(
+                "INSERT OR REPLACE INTO greetings (message_ts, fingerprint, greeting, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (message_ts, fingerprint, greeting, time.time() + ttl_seconds),
+            )
+
+    # Return the cached greeting for an alert thread
+    def get_greeting(self, message_ts, fingerprint):
+        """
+        Return the cached greeting for the alert thread if it hasn't expired
+        and was generated from the same prompt, otherwise None.
+        """
+        row = self._fetch_one(
+            "SELECT greeting FROM greetings "
+            "WHERE message_ts = ? AND fingerprint = ? AND expires_at > ?",
+            message_ts,
+            fingerprint,
+            time.time(),
+        )
+        return row[0] if row else None
+
+    # Set a setting shared between the bot and the alert feed
+    def set_value(self, key, value):
+        conn = self._connect()
+        with self._lock, conn:
+            conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+
+    # Return a setting shared between the bot and the alert feed
+    def get_value(self, key):
+        row = self._fetch_one("SELECT value FROM settings WHERE key = ?", key)
+        return row[0] if row else None
+
+    def _refresh_active_users(self, conn):
+        """
+        Reload the active user index if the database was changed by another
+        connection. data_version doesn't change for this connection's own
+        commits, those update the index directly.
+        """
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            rows = conn.execute(
+                "SELECT DISTINCT user_id FROM incidents WHERE chat_started = 1"
+            ).fetchall()
+            self._active_users = {row[0] for row in rows}
+            self._data_version = data_version
+
+    def _fetch_one(self, query, *params):
+        conn = self._connect()
+        with self._lock:
+            return conn.execute(query, params).fetchone()
+
+
+class AsyncDatabase:
+    """
+    This class exposes the database to async code. Every call runs on a
+    dedicated database thread, so storage work never blocks the event loop.
+    If coalesce_writes_ms is set, writes issued within that window are
+    committed together in a single transaction.
+    """
+
+    def __init__(self, database=None, coalesce_writes_ms=0):
+        self.database = database or Database()
+        self._coalesce_writes_seconds = coalesce_writes_ms / 1000
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+        self._pending_writes = []
+        self._flush_task = None
+
+    async def add(self, user_id, message_ts):
+        """
+        Add a new incident for the user.
+        """
+        await self._write("add", user_id, message_ts)
+
+    async def start_chat(self, user_id, message_ts):
+        """
+        Mark the chat with the user as started for the incident.
+        """
+        await self._write("start_chat", user_id, message_ts)
+
+    async def delete(self, user_id, message_ts=None):
+        """
+        Delete the user's incident with the given message timestamp, or all
+        of the user's incidents if it's not given.
+        """
+        await self._write("delete", user_id, message_ts)
+
+    async def user_exists(self, user_id):
+        """
+        Check if the user has a started chat.
+        """
+        return await self._run(self.database.user_exists, user_id)
+
+    async def lookup_by_user(self, user_id):
+        """
+        Return the message timestamp of the user's most recent open incident
+        with a started chat, or None.
+        """
+        try:
+            return await self._run(self.database.get_ts, user_id)
+        except KeyError:
+            return None
+
+    async def list_by_user(self, user_id):
+        """
+        Return the message timestamps of the user's open incidents, most
+        recent first.
+        """
+        return await self._run(self.database.get_all_ts, user_id)
+
+    async def lookup_by_ts(self, message_ts):
+        """
+        Return the user_id for the message timestamp, or None.
+        """
+        return await self._run(self.database.get_user_id, message_ts)
+
+    async def append_conversation(self, message_ts, entries):
+        """
+        Append entries to the incident's conversation log.
+        """
+        await self._run(self.database.append_conversation, message_ts, entries)
+
+    async def get_conversation(self, message_ts):
+        """
+        Return the incident's conversation log, oldest entry first.
+        """
+        return await self._run(self.database.get_conversation, message_ts)
+
+    async def get_summary_delta(self, message_ts):
+        """
+        Return the incident's rolling summary, the entries it doesn't cover
+        yet, and the id of the last of those entries.
+        """
+        return await self._run(self.database.get_summary_delta, message_ts)
+
+    async def put_summary(self, message_ts, summary, summarized_through):
+        """
+        Store the incident's rolling summary.
+        """
+        await self._run(self.database.put_summary, message_ts, summary, summarized_through)
+
+    async def add_job(self, kind, payload):
+        """
+        Persist a background job, and return its id.
+        """
+        return await self._run(self.database.add_job, kind, payload)
+
+    async def get_jobs(self):
+        """
+        Return the persisted background jobs, oldest first.
+        """
+        return await self._run(self.database.get_jobs)
+
+    async def increment_job_attempts(self, job_id):
+        await self._run(self.database.increment_job_attempts, job_id)
+
+    async def delete_job(self, job_id):
+        await self._run(self.database.delete_job, job_id)
+
+    async def put_greeting(self, message_ts, fingerprint, greeting, ttl_seconds):
+        """
+        Cache the greeting precomputed for the alert thread.
+        """
+        await self._run(self.database.put_greeting, message_ts, fingerprint, greeting, ttl_seconds)
+
+    async def get_greeting(self, message_ts, fingerprint):
+        """
+        Return the cached greeting for the alert thread and prompt, or None.
+        """
+        return await self._run(self.database.get_greeting, message_ts, fingerprint)
+
+    async def set_value(self, key, value):
+        await self._run(self.database.set_value, key, value)
+
+    async def get_value(self, key):
+        return await self._run(self.database.get_value, key)
+
+    async def flush(self):
+        """
+        Commit the pending coalesced writes.
+        """
+        writes, self._pending_writes = self._pending_writes, []
+        if not writes:
+            return
+
+        try:
+            await self._run(self.database.write_batch, [write for write, _ in writes])
+        except Exception as e:
+            for _, future in writes:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for _, future in writes:
+                if not future.done():
+                    future.set_result(None)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    async def _write(self, operation, *args):
+        if not self._coalesce_writes_seconds:
+            await self._run(self.database.write_batch, [(operation, args)])
+            return
+
+        loop = asyncio.get_running_loop()
+        if not self._pending_writes:
+            loop.call_later(self._coalesce_writes_seconds, self._start_flush)
+
+        future = loop.create_future()
+        self._pending_writes.append(((operation, args), future))
+        await future
+
+    def _start_flush(self):
+        self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
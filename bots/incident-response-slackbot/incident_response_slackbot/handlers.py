@@ -5,19 +5,73 @@ from enum import Enum
 from logging import getLogger
 
 from incident_response_slackbot.config import load_config, get_config
-from incident_response_slackbot.db.database import Database
+from incident_response_slackbot.db.database import LAST_ANALYST_NAME_KEY, AsyncDatabase
+from incident_response_slackbot.jobs import JobRunner
 from incident_response_slackbot.openai_utils import (
     create_greeting,
     generate_awareness_question,
     get_thread_summary,
     get_user_awareness,
+    greeting_fingerprint,
     messages_to_string,
+    update_summary,
 )
 from openai_slackbot.handlers import BaseActionHandler, BaseMessageHandler
 
 logger = getLogger(__name__)
 
-DATABASE = Database()
+DATABASE = AsyncDatabase()
+
+# Runs the rolling and end-of-chat summaries outside of event handling, start
+# it with the bot's Slack client on startup.
+JOBS = JobRunner(DATABASE)
+
+
+async def get_summary_delta(slack_client, channel, message_ts):
+    """
+    Returns the incident's rolling summary and the messages it doesn't cover
+    yet, falling back to the thread's messages for chats started before the
+    conversation log was kept.
+    """
+    summary, conversation, _ = await DATABASE.get_summary_delta(message_ts)
+    if summary is None and not conversation:
+        messages = await slack_client.get_thread_messages(channel=channel, thread_ts=message_ts)
+        conversation = [{"text": message["text"]} for message in messages if "text" in message]
+    return summary, conversation
+
+
+async def roll_summary(slack_client, *, message_ts):
+    """
+    Folds the messages exchanged since the last update into the incident's
+    rolling summary, so that ending the chat only has a small delta left.
+    Runs as a background job while the user replies.
+    """
+    summary, conversation, summarized_through = await DATABASE.get_summary_delta(message_ts)
+    if not conversation:
+        return
+    summary = await update_summary(summary, conversation)
+    await DATABASE.put_summary(message_ts, summary, summarized_through)
+
+
+async def post_chat_summary(slack_client, *, message_ts, summary, conversation):
+    """
+    Summarizes an ended chat and posts the summary to the alert thread. Runs
+    as a background job, with the summary and conversation read when the
+    chat ended.
+    """
+    summary = await get_thread_summary(conversation, summary)
+
+    # Send message to the channel
+    await slack_client.post_message(
+        channel=get_config().feed_channel_id,
+        text=f"Here is the summary of the chat:\n> {summary}",
+        thread_ts=message_ts,
+    )
+
+
+JOBS.register("roll_summary", roll_summary)
+JOBS.register("post_chat_summary", post_chat_summary)
+
 
 class InboundDirectMessageHandler(BaseMessageHandler):
     """
@@ -29,20 +83,31 @@ class InboundDirectMessageHandler(BaseMessageHandler):
         self.config = get_config()
 
     async def should_handle(self, args):
-        return True
+        # Only direct messages from users with an active chat are handled,
+        # checked against the in-memory index of active users.
+        event = args.event
+        if event.get("channel_type") != "im":
+            return False
+        return await DATABASE.user_exists(event.get("user"))
 
     async def handle(self, args):
         event = args.event
         user_id = event.get("user")
 
-        if not DATABASE.user_exists(user_id):
+        # Messages are routed to the user's most recent incident with a started chat
+        message_ts = await DATABASE.lookup_by_user(user_id)
+        if message_ts is None:
             # If the user_id does not exist, they're not part of an active chat
             return
 
-        message_ts = DATABASE.get_ts(user_id)
         await self.send_message_to_channel(event, message_ts)
 
-        user_awareness = await get_user_awareness(event["text"])
+        # The chat so far is kept in the database, so the thread isn't re-read
+        # for every message.
+        conversation = await DATABASE.get_conversation(message_ts)
+        await DATABASE.append_conversation(message_ts, [{"role": "user", "text": event["text"]}])
+
+        user_awareness = await get_user_awareness(event["text"], conversation)
         logger.info(f"User awareness decision: {user_awareness}")
 
         if user_awareness["has_answered"]:
@@ -60,9 +125,8 @@ class InboundDirectMessageHandler(BaseMessageHandler):
 
     async def handle_user_response(self, user_id, message_ts):
         # User has answered the question
-        messages = await self._slack_client.get_thread_messages(
-            channel=self.config.feed_channel_id,
-            thread_ts=message_ts,
+        summary, conversation = await get_summary_delta(
+            self._slack_client, self.config.feed_channel_id, message_ts
         )
 
         # Send the end message to the user
@@ -79,18 +143,15 @@ class InboundDirectMessageHandler(BaseMessageHandler):
             thread_ts=message_ts,
         )
 
-        summary = await get_thread_summary(messages)
+        await self.end_chat(message_ts)
 
-        # Send message to the channel
-        await self._slack_client.post_message(
-            channel=self.config.feed_channel_id,
-            text=f"Here is the summary of the chat:\n> {summary}",
-            thread_ts=message_ts,
+        # Summarize in the background, the chat has ended for the user and the analyst
+        await JOBS.submit(
+            "post_chat_summary",
+            {"message_ts": message_ts, "summary": summary, "conversation": conversation},
         )
 
-        DATABASE.delete(user_id)
-
-        await self.end_chat(message_ts)
+        await DATABASE.delete(user_id, message_ts)
 
     async def end_chat(self, message_ts):
         original_blocks = await self._slack_client.get_original_blocks(
@@ -137,6 +198,13 @@ class InboundDirectMessageHandler(BaseMessageHandler):
             thread_ts=message_ts,
         )
 
+        await DATABASE.append_conversation(
+            message_ts, [{"role": "assistant", "text": nudge_message}]
+        )
+
+        # The user has been answered, update the rolling summary while they reply
+        await JOBS.submit("roll_summary", {"message_ts": message_ts})
+
 
 class InboundIncidentStartChatHandler(BaseActionHandler):
     def __init__(self, slack_client):
@@ -151,11 +219,12 @@ class InboundIncidentStartChatHandler(BaseActionHandler):
         body = args.body
         original_message = body["container"]
         original_message_ts = original_message["message_ts"]
-        alert_user_id = DATABASE.get_user_id(original_message_ts)
+        alert_user_id = await DATABASE.lookup_by_ts(original_message_ts)
         user = body["user"]
 
         name = user["name"]
-        first_name = name.split(".")[1]
+        name_parts = name.split(".")
+        first_name = name_parts[1] if len(name_parts) > 1 else name_parts[0]
 
         logger.info(f"Handling inbound incident start chat action from {user['name']}")
 
@@ -182,16 +251,37 @@ class InboundIncidentStartChatHandler(BaseActionHandler):
 
         username = await self._slack_client.get_user_display_name(alert_user_id)
 
-        greeting_message = await create_greeting(first_name, text_messages)
+        greeting_message = await self.get_greeting(original_message_ts, first_name, text_messages)
         logger.info(f"generated greeting message: {greeting_message}")
 
+        # Route the user's direct messages to this incident from now on
+        await DATABASE.start_chat(alert_user_id, original_message_ts)
+
         # Send the greeting message to the user and to the channel
         await self.send_greeting_message(alert_user_id, greeting_message, original_message_ts)
 
+        # Start the conversation log with the alert and the greeting
+        await DATABASE.append_conversation(
+            original_message_ts,
+            [{"role": "alert", "text": m["text"]} for m in messages if m.get("text")]
+            + [{"role": "assistant", "text": greeting_message}],
+        )
+
         logger.info(f"Succesfully started chat with user: {username}")
 
         return message
 
+    async def get_greeting(self, original_message_ts, first_name, text_messages):
+        # Use the greeting precomputed by the alert feed if it was generated
+        # from the same prompt, otherwise generate it now.
+        fingerprint = greeting_fingerprint(first_name, text_messages)
+        greeting_message = await DATABASE.get_greeting(original_message_ts, fingerprint)
+        if greeting_message is None:
+            greeting_message = await create_greeting(first_name, text_messages)
+
+        await DATABASE.set_value(LAST_ANALYST_NAME_KEY, first_name)
+        return greeting_message
+
     def update_blocks(self, body, alert_user_id):
         body_copy = body.copy()
         new_elements = []
@@ -278,6 +368,11 @@ class InboundIncidentDoNothingHandler(BaseActionHandler):
             text="Do Nothing action selected",
         )
 
+        # Close the incident, so that the user's messages aren't routed to it
+        alert_user_id = await DATABASE.lookup_by_ts(original_message_ts)
+        if alert_user_id:
+            await DATABASE.delete(alert_user_id, original_message_ts)
+
 
 class InboundIncidentEndChatHandler(BaseActionHandler):
     """
@@ -297,11 +392,17 @@ class InboundIncidentEndChatHandler(BaseActionHandler):
         user_id = body["user"]["id"]
         message_ts = body["message"]["ts"]
 
-        alert_user_id = DATABASE.get_user_id(message_ts)
+        alert_user_id = await DATABASE.lookup_by_ts(message_ts)
 
+        # Read the conversation before updating the thread, so that if it has
+        # to fall back to the thread, both reads are served by the same
+        # conversations.replies call.
         original_blocks = await self._slack_client.get_original_blocks(
             message_ts, self.config.feed_channel_id
         )
+        summary, conversation = await get_summary_delta(
+            self._slack_client, self.config.feed_channel_id, message_ts
+        )
 
         # Remove action buttons and add "Chat has ended" text
         new_blocks = [block for block in original_blocks if block.get("type") != "actions"]
@@ -326,12 +427,6 @@ class InboundIncidentEndChatHandler(BaseActionHandler):
             text="Ended chat automatically",
         )
 
-        # User has answered the question
-        messages = await self._slack_client.get_thread_messages(
-            channel=self.config.feed_channel_id,
-            thread_ts=message_ts,
-        )
-
         thank_you = "Thanks for your time!"
         await self._slack_client.post_message(
             channel=alert_user_id,
@@ -345,13 +440,11 @@ class InboundIncidentEndChatHandler(BaseActionHandler):
             thread_ts=message_ts,
         )
 
-        summary = await get_thread_summary(messages)
-
-        # Send message to the channel
-        await self._slack_client.post_message(
-            channel=self.config.feed_channel_id,
-            text=f"Here is the summary of the chat:\n> {summary}",
-            thread_ts=message_ts,
+        # Summarize in the background, the chat has ended for the user and the analyst
+        await JOBS.submit(
+            "post_chat_summary",
+            {"message_ts": message_ts, "summary": summary, "conversation": conversation},
         )
 
-        DATABASE.delete(user_id)
+        # Close the alert user's incident, user_id is the analyst who ended the chat
+        await DATABASE.delete(alert_user_id, message_ts)
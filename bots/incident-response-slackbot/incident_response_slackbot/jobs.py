@@ -0,0 +1,164 @@
+import asyncio
+import time
+import typing as t
+from logging import getLogger
+
+from incident_response_slackbot.db.database import AsyncDatabase
+from openai_slackbot.clients.slack import SlackClient
+from openai_slackbot.metrics import REGISTRY
+
+logger = getLogger(__name__)
+
+JobFunc = t.Callable[..., t.Awaitable[None]]
+
+JOB_LATENCY = REGISTRY.histogram(
+    "incident_slackbot_job_latency_seconds",
+    "Time from a background job being submitted to it finishing.",
+    ["kind"],
+)
+JOB_DURATION = REGISTRY.histogram(
+    "incident_slackbot_job_duration_seconds", "Time spent running a background job.", ["kind"]
+)
+JOB_EVENTS = REGISTRY.counter(
+    "incident_slackbot_job_events_total",
+    "Background job attempts, by outcome (succeeded, retried or failed).",
+    ["kind", "outcome"],
+)
+JOBS_PENDING = REGISTRY.gauge(
+    "incident_slackbot_jobs_pending", "Background jobs submitted but not finished."
+)
+
+
+class JobRunner:
+    """
+    Runs work that doesn't need to finish before a Slack event is handled,
+    e.g. summarizing an ended chat. Jobs are persisted to the database when
+    they're submitted and removed once they succeed or run out of attempts,
+    so that jobs pending when the bot stops are picked up again on start.
+
+    Job functions are registered per kind and called with the Slack client
+    and the job's payload as keyword arguments.
+    """
+
+    def __init__(
+        self,
+        database: AsyncDatabase,
+        *,
+        workers: int = 2,
+        max_attempts: int = 3,
+        retry_delay: float = 5,
+    ) -> None:
+        self._database = database
+        self._num_workers = workers
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._funcs: t.Dict[str, JobFunc] = {}
+        self._queue: t.Optional[asyncio.Queue] = None
+        self._slack_client: t.Optional[SlackClient] = None
+        self._workers: t.Set[asyncio.Task] = set()
+        self._retries: t.Set[asyncio.Task] = set()
+
+    def register(self, kind: str, func: JobFunc) -> None:
+        self._funcs[kind] = func
+
+    async def start(self, slack_client: SlackClient) -> None:
+        """Starts the workers, and queues the jobs left pending by a previous run."""
+        self._slack_client = slack_client
+        self._queue = asyncio.Queue()
+
+        pending = await self._database.get_jobs()
+        if pending:
+            logger.info(f"Resuming {len(pending)} pending background jobs")
+        for job in pending:
+            self._queue.put_nowait(job)
+        JOBS_PENDING.set(len(pending))
+
+        for _ in range(self._num_workers):
+            self._spawn(self._workers, self._worker())
+
+    async def submit(self, kind: str, payload: t.Dict[str, t.Any]) -> None:
+        """Persists the job and queues it, the payload must be JSON-serializable."""
+        if kind not in self._funcs:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        job_id = await self._database.add_job(kind, payload)
+        JOBS_PENDING.set(JOBS_PENDING.get() + 1)
+        if self._queue is None:
+            # Not started, the job runs once the runner starts.
+            return
+        self._queue.put_nowait(
+            {
+                "id": job_id,
+                "kind": kind,
+                "payload": payload,
+                "created_at": time.time(),
+                "attempts": 0,
+            }
+        )
+
+    async def join(self) -> None:
+        """Waits for the queued jobs, and the retries scheduled for them, to finish."""
+        if self._queue is None:
+            return
+        while True:
+            await self._queue.join()
+            if not self._retries:
+                return
+            await asyncio.gather(*self._retries)
+
+    async def stop(self) -> None:
+        """Stops the workers, unfinished jobs stay persisted for the next start."""
+        tasks = self._workers | self._retries
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: t.Dict[str, t.Any]) -> None:
+        kind = job["kind"]
+        func = self._funcs.get(kind)
+        if func is None:
+            logger.error(f"Dropping job {job['id']} of unknown kind: {kind}")
+            await self._finish(job)
+            return
+
+        try:
+            with JOB_DURATION.time(kind=kind):
+                await func(self._slack_client, **job["payload"])
+        except Exception:
+            job["attempts"] += 1
+            await self._database.increment_job_attempts(job["id"])
+            if job["attempts"] < self._max_attempts:
+                logger.exception(f"Background job {job['id']} failed, retrying")
+                JOB_EVENTS.inc(kind=kind, outcome="retried")
+                self._spawn(self._retries, self._retry(job))
+                return
+
+            logger.exception(f"Background job {job['id']} failed {job['attempts']} times")
+            JOB_EVENTS.inc(kind=kind, outcome="failed")
+            await self._finish(job)
+            return
+
+        JOB_EVENTS.inc(kind=kind, outcome="succeeded")
+        JOB_LATENCY.observe(time.time() - job["created_at"], kind=kind)
+        await self._finish(job)
+
+    async def _retry(self, job: t.Dict[str, t.Any]) -> None:
+        await asyncio.sleep(self._retry_delay * 2 ** (job["attempts"] - 1))
+        self._queue.put_nowait(job)
+
+    async def _finish(self, job: t.Dict[str, t.Any]) -> None:
+        await self._database.delete_job(job["id"])
+        JOBS_PENDING.set(max(JOBS_PENDING.get() - 1, 0))
+
+    def _spawn(self, tasks: t.Set[asyncio.Task], coro: t.Coroutine) -> None:
+        task = asyncio.create_task(coro)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
@@ -1,7 +1,8 @@
+import hashlib
 import json
 
-import openai
 from incident_response_slackbot.config import load_config, get_config
+from openai_slackbot.clients.llm import get_llm_client
 
 load_config()
 config = get_config()
@@ -12,14 +13,28 @@ def messages_to_string(messages):
     return text_messages
 
 
+# Convert a conversation log to string, one "role: text" line per entry
+def conversation_to_string(conversation):
+    return "\n".join(
+        f"{entry['role']}: {entry['text']}" if entry.get("role") else entry["text"]
+        for entry in conversation
+        if entry.get("text")
+    )
+
+
 async def get_clean_output(completion: str) -> str:
     return completion.choices[0].message.content
 
 
-async def create_greeting(username, details):
-    if not openai.api_key:
-        raise Exception("OpenAI API key not found.")
+def greeting_fingerprint(username, details):
+    """
+    Identifies the prompt create_greeting builds from its inputs, so that a
+    precomputed greeting is only used for the same prompt.
+    """
+    return hashlib.sha256(f"{username}\0{details}".encode()).hexdigest()
+
 
+async def create_greeting(username, details):
     prompt = f"""
     You are a helpful cybersecurity AI analyst assistant to the security team that wants to keep
     your company secure. You just received an alert with the following details:
@@ -35,7 +50,8 @@ async def create_greeting(username, details):
         {"role": "user", "content": ""},
     ]
 
-    completion = openai.chat.completions.create(
+    completion = await get_llm_client().chat_completion(
+        call_site="create_greeting",
         model="gpt-4-32k",
         messages=messages,
         temperature=0.3,
@@ -67,9 +83,10 @@ aware_decision_function = [
 ]
 
 
-async def get_user_awareness(inbound_direct_message: str) -> str:
+async def get_user_awareness(inbound_direct_message: str, conversation=None) -> str:
     """
     This function uses the OpenAI Chat Completion API to determine whether user was aware.
+    The conversation so far, if given, is included as context for the user's message.
     """
     # Define the prompt
     prompt = f"""
@@ -79,6 +96,11 @@ async def get_user_awareness(inbound_direct_message: str) -> str:
     the user has answered the question of whether they were aware of the alert details, and whether
     they were aware or not.
     """
+    if conversation:
+        prompt += f"""
+    The chat so far:
+    {conversation_to_string(conversation)}
+    """
 
     messages = [
         {"role": "system", "content": prompt},
@@ -86,7 +108,8 @@ async def get_user_awareness(inbound_direct_message: str) -> str:
     ]
 
     # Call the API
-    response = openai.chat.completions.create(
+    response = await get_llm_client().chat_completion(
+        call_site="get_user_awareness",
         model="gpt-4-32k",
         messages=messages,
         temperature=0,
@@ -99,11 +122,56 @@ async def get_user_awareness(inbound_direct_message: str) -> str:
     return function_args
 
 
-async def get_thread_summary(messages):
-    if not openai.api_key:
-        raise Exception("OpenAI API key not found.")
+# Upper bound on the length of an incident's rolling summary, which keeps
+# every summary update and the final summary small however long the chat is.
+ROLLING_SUMMARY_MAX_TOKENS = 500
 
-    text_messages = messages_to_string(messages)
+
+async def update_summary(summary, conversation):
+    """
+    Folds the messages exchanged since the rolling summary was last updated
+    into it, and returns the updated summary.
+    """
+    prompt = f"""
+    You are a helpful cybersecurity AI analyst assistant to the security team that wants to keep
+    your company secure. You are keeping a running summary of a conversation that you are having
+    with the user about an alert. Update the summary so far with the new messages. Keep the alert
+    details, whether the user said they were aware of the alert, and anything suspicious about
+    their answers. Keep it concise.
+    Summary so far:
+    {summary or "The conversation has just started."}
+    New messages:
+    {conversation_to_string(conversation)}
+    """
+
+    messages = [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": ""},
+    ]
+
+    completion = await get_llm_client().chat_completion(
+        call_site="update_summary",
+        model="gpt-4-32k",
+        messages=messages,
+        temperature=0,
+        max_tokens=ROLLING_SUMMARY_MAX_TOKENS,
+        stream=False,
+    )
+    response = await get_clean_output(completion)
+    return response
+
+
+async def get_thread_summary(conversation, summary=None):
+    """
+    Summarizes the conversation. If the rolling summary is given, the
+    conversation only holds the messages it doesn't cover yet.
+    """
+    text_messages = conversation_to_string(conversation)
+    if summary:
+        text_messages = f"""Summary of the conversation so far:
+    {summary}
+    Messages since then:
+    {text_messages}"""
 
     prompt = f"""
     You are a helpful cybersecurity AI analyst assistant to the security team that wants to keep
@@ -118,7 +186,8 @@ async def get_thread_summary(messages):
         {"role": "user", "content": ""},
     ]
 
-    completion = openai.chat.completions.create(
+    completion = await get_llm_client().chat_completion(
+        call_site="get_thread_summary",
         model="gpt-4-32k",
         messages=messages,
         temperature=0.3,
@@ -129,9 +198,6 @@ async def get_thread_summary(messages):
 
 
 async def generate_awareness_question():
-    if not openai.api_key:
-        raise Exception("OpenAI API key not found.")
-
     prompt = f"""
     You are a helpful cybersecurity AI analyst assistant to the security team that wants to keep
     your company secure. You have received an alert regarding the user you're chatting with, and
@@ -145,7 +211,8 @@ async def generate_awareness_question():
         {"role": "user", "content": ""},
     ]
 
-    completion = openai.chat.completions.create(
+    completion = await get_llm_client().chat_completion(
+        call_site="generate_awareness_question",
         model="gpt-4-32k",
         messages=messages,
         temperature=0.5,
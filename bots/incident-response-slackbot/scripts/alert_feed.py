@@ -1,50 +1,145 @@
+import asyncio
 import os
 from logging import getLogger
 
 from incident_response_slackbot.config import load_config, get_config
-from incident_response_slackbot.db.database import Database
+from incident_response_slackbot.db.database import LAST_ANALYST_NAME_KEY, AsyncDatabase
+from incident_response_slackbot.openai_utils import (
+    create_greeting,
+    greeting_fingerprint,
+    messages_to_string,
+)
+from openai_slackbot.clients.llm import init_llm_client
 from openai_slackbot.clients.slack import CreateSlackMessageResponse, SlackClient
 from openai_slackbot.utils.envvars import string
 from slack_bolt.app.async_app import AsyncApp
 
 logger = getLogger(__name__)
 
-DATABASE = Database()
+DATABASE = AsyncDatabase()
 
 load_config()
 config = get_config()
 
-async def post_alert(alert):
+# How long a precomputed greeting can be used after the alert is posted.
+GREETING_TTL_SECONDS = 6 * 60 * 60
+
+_SLACK_CLIENT = None
+_LLM_CLIENT_INITIALIZED = False
+_BACKGROUND_TASKS = set()
+
+
+def get_slack_client() -> SlackClient:
+    """
+    This function returns the Slack client shared by all alerts, creating
+    it and compiling the message templates on first use.
+    """
+    global _SLACK_CLIENT
+    if _SLACK_CLIENT is None:
+        slack_bot_token = string("SLACK_BOT_TOKEN")
+        app = AsyncApp(token=slack_bot_token)
+        slack_template_path = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "../incident_response_slackbot/templates",
+        )
+        _SLACK_CLIENT = SlackClient(app.client, slack_template_path)
+        _SLACK_CLIENT.load_templates()
+    return _SLACK_CLIENT
+
+
+def init_greeting_llm_client() -> bool:
+    """
+    This function initializes the LLM client used to precompute greetings.
+    Returns False if no OpenAI API key is configured.
+    """
+    global _LLM_CLIENT_INITIALIZED
+    if not _LLM_CLIENT_INITIALIZED:
+        openai_api_key = os.environ.get("OPENAI_API_KEY")
+        if not openai_api_key:
+            return False
+        init_llm_client(api_key=openai_api_key, organization=config.openai_organization_id)
+        _LLM_CLIENT_INITIALIZED = True
+    return True
+
+
+async def precompute_greeting(message_ts: str, messages) -> None:
+    """
+    This function generates the greeting the Start Chat action will send,
+    and caches it for the alert thread. It is addressed with the name of
+    the analyst who last started a chat. If a different analyst starts the
+    chat, or the thread changes, the greeting is generated again then.
+
+    Args:
+        message_ts (str): The alert thread's timestamp.
+        messages (list): The messages in the alert thread.
+    """
+    first_name = await DATABASE.get_value(LAST_ANALYST_NAME_KEY)
+    if first_name is None or not init_greeting_llm_client():
+        return
+
+    text_messages = messages_to_string(messages)
+    try:
+        greeting = await create_greeting(first_name, text_messages)
+        await DATABASE.put_greeting(
+            message_ts,
+            greeting_fingerprint(first_name, text_messages),
+            greeting,
+            GREETING_TTL_SECONDS,
+        )
+    except Exception:
+        logger.exception(f"Failed to precompute greeting for {message_ts}")
+
+
+async def wait_for_background_tasks() -> None:
+    """
+    This function waits for the greetings being precomputed in the background.
+    """
+    await asyncio.gather(*_BACKGROUND_TASKS, return_exceptions=True)
+
+
+async def post_alert(alert, slack_client: SlackClient = None):
     """
     This function posts an alert to the Slack channel.
-    It first initializes the Slack client with the bot token and template path.
-    Then, it extracts the user_id, alert_name, and properties from the alert.
-    Finally, it posts the alert to the Slack channel and sends the initial details.
+    It extracts the user_id, alert_name, and properties from the alert,
+    posts the alert to the Slack channel, then records the incident and
+    sends the initial details concurrently.
 
     Args:
         alert (dict): The alert to be posted. It should contain 'user_id', 'name', and 'properties'.
-    """
+        slack_client (SlackClient): The Slack client, defaults to the shared client.
 
-    slack_bot_token = string("SLACK_BOT_TOKEN")
-    app = AsyncApp(token=slack_bot_token)
-    slack_template_path = os.path.join(
-        os.path.dirname(os.path.abspath(__file__)),
-        "../incident_response_slackbot/templates",
-    )
-    slack_client = SlackClient(app.client, slack_template_path)
+    Returns:
+        CreateSlackMessageResponse: The alert's root message in the feed channel.
+    """
+    slack_client = slack_client or get_slack_client()
 
     # Extracting the user_id, alert_name, and properties from the alert
     user_id = alert.get("user_id")
     alert_name = alert.get("name")
-    properties = alert.get("properties")
+    properties = alert.get("properties") or {}
 
     message = await incident_feed_begin(
         slack_client=slack_client, user_id=user_id, alert_name=alert_name
     )
+    if message is None:
+        raise Exception(f"Failed to post alert {alert_name} for {user_id}")
 
-    DATABASE.add(user_id, message.ts)
+    _, details_message = await asyncio.gather(
+        DATABASE.add(user_id, message.ts),
+        initial_details(slack_client=slack_client, message=message, properties=properties),
+    )
 
-    await initial_details(slack_client=slack_client, message=message, properties=properties)
+    # Precompute the greeting in the background, so that it's ready when an
+    # analyst starts a chat
+    task = asyncio.create_task(
+        precompute_greeting(
+            message.ts, [{"text": message.message.text}, {"text": details_message.message.text}]
+        )
+    )
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+    return message
 
 
 async def incident_feed_begin(
@@ -108,10 +203,13 @@ async def initial_details(*, slack_client: SlackClient, message, properties):
         slack_client (SlackClient): The Slack client.
         message: The initial alert message.
         properties: The properties of the alert.
+
+    Returns:
+        CreateSlackMessageResponse: The details message.
     """
     thread_ts = message.ts
     details = get_alert_details(**properties)
 
-    await slack_client.post_message(
+    return await slack_client.post_message(
         channel=config.feed_channel_id, text=f"{details}", thread_ts=thread_ts
     )
@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from logging import getLogger
+
+from aiohttp import web
+from alert_feed import get_slack_client, post_alert, wait_for_background_tasks
+from incident_response_slackbot.aggregator import AlertAggregator
+
+logger = getLogger(__name__)
+
+
+class IngestStats:
+    """
+    This class counts ingested alerts and reports throughput.
+    """
+
+    def __init__(self):
+        self.received = 0
+        self.posted = 0
+        self.aggregated = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+
+    def report(self, queue_depth):
+        elapsed = time.monotonic() - self.started_at
+        rate = (self.posted + self.aggregated) / elapsed if elapsed else 0
+        logger.info(
+            f"Alerts received: {self.received}, posted: {self.posted}, "
+            f"aggregated: {self.aggregated}, failed: {self.failed}, queued: {queue_depth}, "
+            f"throughput: {rate:.2f} alerts/s"
+        )
+
+
+# Fields an alert needs to be posted.
+REQUIRED_FIELDS = ("user_id", "name")
+
+
+def parse_alert(line):
+    """
+    This function parses one NDJSON line into an alert, or returns None if
+    the line is blank. Raises ValueError if the line isn't a valid alert.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        alert = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"invalid JSON: {e}")
+    if not isinstance(alert, dict):
+        raise ValueError("alert is not a JSON object")
+    missing = [field for field in REQUIRED_FIELDS if not alert.get(field)]
+    if missing:
+        raise ValueError(f"alert is missing {', '.join(missing)}")
+    return alert
+
+
+async def enqueue_alert(queue, stats, alert):
+    stats.received += 1
+    # Blocks when the queue is full, which slows down the reader.
+    await queue.put(alert)
+
+
+async def enqueue_line(queue, stats, line):
+    try:
+        alert = parse_alert(line)
+    except ValueError as e:
+        logger.warning(f"Skipping invalid alert ({e}): {line.strip()[:200]}")
+        return
+    if alert is not None:
+        await enqueue_alert(queue, stats, alert)
+
+
+async def read_stdin(queue, stats):
+    """
+    This function reads NDJSON alerts from stdin until EOF.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            return
+        await enqueue_line(queue, stats, line)
+
+
+async def tail_file(queue, stats, path, from_start=False, poll_interval=0.5):
+    """
+    This function follows a file of NDJSON alerts like `tail -f`.
+
+    Args:
+        path (str): The file to follow.
+        from_start (bool): Whether to ingest the alerts already in the file.
+        poll_interval (float): How long to wait for new alerts at the end of the file.
+    """
+    with open(path, "r") as f:
+        if not from_start:
+            f.seek(0, os.SEEK_END)
+
+        partial = ""
+        while True:
+            line = f.readline()
+            if not line:
+                await asyncio.sleep(poll_interval)
+                continue
+
+            # Wait for the writer to finish the line
+            partial += line
+            if not partial.endswith("\n"):
+                continue
+
+            await enqueue_line(queue, stats, partial)
+            partial = ""
+
+
+def make_app(queue, stats):
+    """
+    This function creates the HTTP app accepting NDJSON alerts POSTed to
+    /alerts. A request with an invalid alert is rejected as a whole with a
+    400 response, so that the sender can fix and resend it.
+    """
+
+    async def alerts(request):
+        batch = []
+        line_number = 0
+        async for line in request.content:
+            line_number += 1
+            try:
+                alert = parse_alert(line.decode())
+            except (UnicodeDecodeError, ValueError) as e:
+                return web.json_response({"error": f"line {line_number}: {e}"}, status=400)
+            if alert is not None:
+                batch.append(alert)
+
+        for alert in batch:
+            await enqueue_alert(queue, stats, alert)
+        return web.json_response({"accepted": len(batch)}, status=202)
+
+    app = web.Application()
+    app.router.add_post("/alerts", alerts)
+    return app
+
+
+async def serve_http(queue, stats, host, port):
+    """
+    This function accepts NDJSON alerts POSTed to /alerts.
+    """
+    runner = web.AppRunner(make_app(queue, stats))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Accepting alerts on http://{host}:{port}/alerts")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def worker(queue, stats, submit):
+    while True:
+        alert = await queue.get()
+        try:
+            if await submit(alert):
+                stats.posted += 1
+            else:
+                stats.aggregated += 1
+        except Exception:
+            stats.failed += 1
+            logger.exception(f"Failed to post alert: {alert.get('name')}")
+        finally:
+            queue.task_done()
+
+
+async def report_throughput(queue, stats, interval):
+    while True:
+        await asyncio.sleep(interval)
+        stats.report(queue.qsize())
+
+
+async def main(args):
+    queue = asyncio.Queue(maxsize=args.queue_size)
+    stats = IngestStats()
+    slack_client = get_slack_client()
+
+    async def post(alert):
+        await post_alert(alert, slack_client)
+        return True
+
+    # Repeated alerts for the same user and rule are rolled up into one thread
+    aggregator = None
+    tasks = []
+    submit = post
+    if args.window > 0:
+        aggregator = AlertAggregator(
+            slack_client=slack_client,
+            post_alert=lambda alert: post_alert(alert, slack_client),
+            window_seconds=args.window,
+            rollup_interval=args.rollup_interval,
+        )
+        submit = aggregator.submit
+        tasks.append(asyncio.create_task(aggregator.run()))
+
+    tasks += [asyncio.create_task(worker(queue, stats, submit)) for _ in range(args.workers)]
+    tasks.append(asyncio.create_task(report_throughput(queue, stats, args.report_interval)))
+
+    if args.source == "stdin":
+        await read_stdin(queue, stats)
+    elif args.source == "file":
+        await tail_file(queue, stats, args.path, from_start=args.from_start)
+    else:
+        await serve_http(queue, stats, args.host, args.port)
+
+    # Drain the queue once the source is exhausted
+    await queue.join()
+    for task in tasks:
+        task.cancel()
+    if aggregator is not None:
+        await aggregator.flush()
+    await wait_for_background_tasks()
+    stats.report(queue.qsize())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ingest a stream of NDJSON alerts.")
+    parser.add_argument("--source", choices=["stdin", "file", "http"], default="stdin")
+    parser.add_argument("--path", help="File to follow, for --source file")
+    parser.add_argument(
+        "--from-start", action="store_true", help="Ingest alerts already in the file"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Host to bind, for --source http")
+    parser.add_argument("--port", type=int, default=8089, help="Port to bind, for --source http")
+    parser.add_argument("--workers", type=int, default=8, help="Number of concurrent posters")
+    parser.add_argument("--queue-size", type=int, default=100, help="Maximum queued alerts")
+    parser.add_argument(
+        "--window",
+        type=float,
+        default=60,
+        help="Seconds within which repeated alerts for a user and rule are aggregated, 0 disables",
+    )
+    parser.add_argument(
+        "--rollup-interval", type=float, default=10, help="Seconds between aggregated rollups"
+    )
+    parser.add_argument(
+        "--report-interval", type=float, default=10, help="Seconds between throughput reports"
+    )
+    args = parser.parse_args()
+    if args.source == "file" and not args.path:
+        parser.error("--path is required for --source file")
+    return args
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parse_args()))
@@ -1,10 +1,14 @@
+import argparse
 import asyncio
+import itertools
+import json
 import os
 import random
+import sys
 import time
 
+import aiohttp
 import toml
-from alert_feed import post_alert
 
 
 def load_alerts():
@@ -20,12 +24,85 @@ def generate_random_alert(alerts):
     return alerts["alerts"][random_alert]
 
 
-async def main():
+async def generate_load(alerts, rate, count, url=None):
+    """
+    This function replays the alerts at a fixed rate, either as NDJSON on
+    stdout (to pipe into alert_ingest.py) or POSTed to alert_ingest.py's
+    HTTP endpoint.
+
+    Args:
+        alerts (dict): The alerts loaded from alerts.toml.
+        rate (float): Alerts per second.
+        count (int): Number of alerts to send, or 0 to send forever.
+        url (str): The alert_ingest.py endpoint, or None to write to stdout.
+    """
+    replay = itertools.cycle(alerts["alerts"])
+    if count:
+        replay = itertools.islice(replay, count)
+
+    session = aiohttp.ClientSession() if url else None
+    started_at = time.monotonic()
+    sent = 0
+    try:
+        for alert in replay:
+            line = json.dumps(alert) + "\n"
+            if session is not None:
+                async with session.post(url, data=line) as response:
+                    response.raise_for_status()
+            else:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+            sent += 1
+
+            # Schedule against the start time, so that slow sends don't lower the rate
+            delay = started_at + sent / rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+    finally:
+        if session is not None:
+            await session.close()
+
+    elapsed = time.monotonic() - started_at
+    print(f"Sent {sent} alerts in {elapsed:.2f}s", file=sys.stderr)
+
+
+async def main(args):
     alerts = load_alerts()
 
-    alert = generate_random_alert(alerts)
-    await post_alert(alert)
+    if args.rate is None:
+        # Import here, so that generating load doesn't need the bot's config
+        from alert_feed import post_alert, wait_for_background_tasks
+
+        alert = generate_random_alert(alerts)
+        await post_alert(alert)
+        await wait_for_background_tasks()
+        return
+
+    await generate_load(alerts, args.rate, args.count, args.url)
+
+
+def positive_float(value):
+    rate = float(value)
+    if rate <= 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got {value}")
+    return rate
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Send a random example alert, or replay alerts.toml as load."
+    )
+    parser.add_argument(
+        "--rate", type=positive_float, help="Replay alerts at this many alerts per second"
+    )
+    parser.add_argument(
+        "--count", type=int, default=0, help="Number of alerts to replay, 0 replays forever"
+    )
+    parser.add_argument(
+        "--url", help="alert_ingest.py endpoint to POST alerts to, defaults to NDJSON on stdout"
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(main(parse_args()))
@@ -4,6 +4,9 @@ from unittest.mock import AsyncMock, MagicMock, patch
 import pytest
 import toml
 from incident_response_slackbot.config import load_config
+from incident_response_slackbot.db.database import AsyncDatabase, Database
+from incident_response_slackbot.handlers import post_chat_summary, roll_summary
+from incident_response_slackbot.jobs import JobRunner
 from pydantic import ValidationError
 
 ####################
@@ -24,6 +27,26 @@ def mock_config():
     return config
 
 
+@pytest.fixture(autouse=True)
+def mock_database(tmp_path):
+    # Keep the handlers' database out of the package directory
+    database = AsyncDatabase(Database(str(tmp_path / "data.db")))
+    with patch("incident_response_slackbot.handlers.DATABASE", database):
+        yield database
+    database.close()
+
+
+@pytest.fixture(autouse=True)
+async def mock_jobs(mock_database):
+    # Run the handlers' background jobs against the test database
+    jobs = JobRunner(mock_database, retry_delay=0)
+    jobs.register("roll_summary", roll_summary)
+    jobs.register("post_chat_summary", post_chat_summary)
+    with patch("incident_response_slackbot.handlers.JOBS", jobs):
+        yield jobs
+    await jobs.stop()
+
+
 @pytest.fixture()
 def mock_slack_client():
     # Mock the Slack client
@@ -37,26 +60,13 @@ def mock_slack_client():
 
 
 @pytest.fixture(autouse=True)
-@patch("openai.ChatCompletion.create")
-def mock_chat_completion(mock_create):
-    mock_create.return_value = {
-        "id": "chatcmpl-1234567890",
-        "object": "chat.completion",
-        "created": 1640995200,
-        "model": "gpt-4-32k",
-        "usage": {"prompt_tokens": 10, "completion_tokens": 20, "total_tokens": 30},
-        "choices": [
-            {
-                "message": {
-                    "role": "assistant",
-                    "content": "This is a mock response from the OpenAI API.",
-                },
-                "finish_reason": "stop",
-                "index": 0,
-            }
-        ],
-    }
-    yield
+def mock_llm_client():
+    with patch("incident_response_slackbot.openai_utils.get_llm_client") as mock_get_llm_client:
+        completion = MagicMock()
+        completion.choices[0].message.content = "This is a mock response from the OpenAI API."
+        llm_client = mock_get_llm_client.return_value
+        llm_client.chat_completion = AsyncMock(return_value=completion)
+        yield llm_client
 
 
 @pytest.fixture
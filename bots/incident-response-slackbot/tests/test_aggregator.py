@@ -0,0 +1,86 @@
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from incident_response_slackbot.aggregator import AlertAggregator, format_rollup
+
+
+def make_alert(user_id="user1", source_host="host1"):
+    return {
+        "id": "pivot",
+        "name": "Pivoting",
+        "user_id": user_id,
+        "properties": {"source_host": source_host},
+    }
+
+
+@pytest.fixture
+def mock_post_alert():
+    return AsyncMock(return_value=MagicMock(ts="root_ts"))
+
+
+@pytest.fixture
+def aggregator(mock_slack_client, mock_post_alert):
+    return AlertAggregator(
+        slack_client=mock_slack_client, post_alert=mock_post_alert, window_seconds=60
+    )
+
+
+async def test_repeated_alerts_are_rolled_up(
+    aggregator, mock_slack_client, mock_post_alert, mock_config
+):
+    assert await aggregator.submit(make_alert())
+    assert not await aggregator.submit(make_alert(source_host="host2"))
+    assert not await aggregator.submit(make_alert(source_host="host2"))
+
+    # Other users get their own thread
+    assert await aggregator.submit(make_alert(user_id="user2"))
+    assert mock_post_alert.await_count == 2
+
+    await aggregator.flush()
+    mock_slack_client.post_message.assert_awaited_once_with(
+        channel=mock_config.feed_channel_id,
+        text="Alert repeated 2 more time(s), 3 in total.\n• source_host: host2",
+        thread_ts="root_ts",
+    )
+
+    # Nothing new to roll up
+    await aggregator.flush()
+    mock_slack_client.post_message.assert_awaited_once()
+
+
+async def test_window_closes(aggregator, mock_post_alert):
+    assert await aggregator.submit(make_alert())
+    with patch(
+        "incident_response_slackbot.aggregator.time.monotonic", return_value=time.monotonic() + 61
+    ):
+        assert await aggregator.submit(make_alert())
+    assert mock_post_alert.await_count == 2
+
+
+async def test_failed_rollup_still_posts_alert(aggregator, mock_slack_client, mock_post_alert):
+    assert await aggregator.submit(make_alert())
+    assert not await aggregator.submit(make_alert())
+
+    mock_slack_client.post_message.side_effect = Exception("failed")
+    with patch(
+        "incident_response_slackbot.aggregator.time.monotonic", return_value=time.monotonic() + 61
+    ):
+        assert await aggregator.submit(make_alert())
+    mock_slack_client.post_message.assert_awaited_once()
+    assert mock_post_alert.await_count == 2
+
+
+async def test_failed_root_is_not_aggregated(aggregator, mock_post_alert):
+    mock_post_alert.side_effect = [Exception("failed"), MagicMock(ts="root_ts")]
+    with pytest.raises(Exception):
+        await aggregator.submit(make_alert())
+    assert await aggregator.submit(make_alert())
+
+
+def test_format_rollup():
+    alerts = [make_alert(source_host=f"host{i}") for i in range(7)]
+    assert format_rollup(alerts, 8) == (
+        "Alert repeated 7 more time(s), 8 in total.\n"
+        "• source_host: host0, host1, host2, host3, host4 (+2 more)"
+    )
@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from incident_response_slackbot.aggregator import AlertAggregator
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from alert_ingest import IngestStats, make_app, parse_alert, worker  # noqa: E402
+from send_alert import generate_load, load_alerts, positive_float  # noqa: E402
+
+
+def make_alert(user_id="user1", alert_id="pivot"):
+    return {"id": alert_id, "name": alert_id.title(), "user_id": user_id, "properties": {}}
+
+
+@pytest.fixture
+async def ingest():
+    queue = asyncio.Queue()
+    stats = IngestStats()
+    client = TestClient(TestServer(make_app(queue, stats)))
+    await client.start_server()
+    yield queue, stats, client
+    await client.close()
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        (json.dumps(make_alert()) + "\n", make_alert()),
+        ("  \n", None),
+    ],
+)
+def test_parse_alert(line, expected):
+    assert parse_alert(line) == expected
+
+
+@pytest.mark.parametrize("line", ["not json", "[]", json.dumps({"name": "Pivoting"})])
+def test_parse_alert_invalid(line):
+    with pytest.raises(ValueError):
+        parse_alert(line)
+
+
+async def test_ingest_batch_is_aggregated(ingest, mock_slack_client):
+    queue, stats, client = ingest
+    alerts = [make_alert(), make_alert(), make_alert(alert_id="privesc")]
+
+    response = await client.post("/alerts", data="".join(json.dumps(a) + "\n" for a in alerts))
+    assert response.status == 202
+    assert await response.json() == {"accepted": 3}
+
+    mock_post_alert = AsyncMock(return_value=MagicMock(ts="root_ts"))
+    aggregator = AlertAggregator(
+        slack_client=mock_slack_client, post_alert=mock_post_alert, window_seconds=60
+    )
+    task = asyncio.create_task(worker(queue, stats, aggregator.submit))
+    await queue.join()
+    task.cancel()
+
+    # The repeated alert is held for the first one's thread
+    assert mock_post_alert.await_count == 2
+    assert (stats.received, stats.posted, stats.aggregated, stats.failed) == (3, 2, 1, 0)
+
+
+@pytest.mark.parametrize(
+    "body", ["not json\n", json.dumps(make_alert()) + "\n" + json.dumps({"name": "Pivoting"})]
+)
+async def test_ingest_rejects_invalid_batch(ingest, body):
+    queue, stats, client = ingest
+
+    response = await client.post("/alerts", data=body)
+    assert response.status == 400
+    assert "error" in await response.json()
+
+    # Nothing from a rejected batch is queued
+    assert queue.empty()
+    assert stats.received == 0
+
+
+async def test_generate_load_posts_to_ingest(ingest, capsys):
+    queue, stats, client = ingest
+    alerts = {"alerts": [make_alert(), make_alert(alert_id="privesc")]}
+
+    await generate_load(alerts, rate=1000, count=3, url=str(client.make_url("/alerts")))
+
+    assert [queue.get_nowait()["id"] for _ in range(queue.qsize())] == [
+        "pivot",
+        "privesc",
+        "pivot",
+    ]
+    assert "Sent 3 alerts" in capsys.readouterr().err
+
+
+async def test_generate_load_example_alerts_are_valid(capsys):
+    await generate_load(load_alerts(), rate=1000, count=2)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+    assert all(parse_alert(line) for line in lines)
+
+
+@pytest.mark.parametrize("value", ["0", "-1", "abc"])
+def test_rate_must_be_positive(value):
+    with pytest.raises((argparse.ArgumentTypeError, ValueError)):
+        positive_float(value)
+    assert positive_float("0.5") == 0.5
@@ -0,0 +1,246 @@
+import asyncio
+import os
+import pickle
+import time
+from unittest.mock import patch
+
+import pytest
+from incident_response_slackbot.db.database import (
+    CONVERSATION_MAX_ENTRIES,
+    CONVERSATION_MAX_TEXT_LENGTH,
+    AsyncDatabase,
+    Database,
+)
+
+
+@pytest.fixture
+def database(tmp_path):
+    return Database(str(tmp_path / "data.db"))
+
+
+def test_add_and_lookup(database):
+    database.add("user1", "ts1")
+    database.start_chat("user1", "ts1")
+    database.add("user2", "ts2")
+
+    assert database.user_exists("user1")
+    assert not database.user_exists("user3")
+    assert database.get_ts("user1") == "ts1"
+    assert database.get_user_id("ts2") == "user2"
+    assert database.get_user_id("ts3") is None
+
+    # No chat was started for user2's incident.
+    assert not database.user_exists("user2")
+    with pytest.raises(KeyError):
+        database.get_ts("user2")
+    with pytest.raises(KeyError):
+        database.get_ts("user3")
+
+
+def test_multiple_incidents_per_user(database):
+    database.add("user1", "1700000002.000100")
+    database.add("user1", "1700000010.000200")
+    database.add("user1", "1700000005.000300")
+    database.start_chat("user1", "1700000002.000100")
+    database.start_chat("user1", "1700000005.000300")
+
+    # Messages go to the most recent incident with a started chat.
+    assert database.get_ts("user1") == "1700000005.000300"
+    assert database.get_all_ts("user1") == [
+        "1700000010.000200",
+        "1700000005.000300",
+        "1700000002.000100",
+    ]
+    assert database.get_user_id("1700000002.000100") == "user1"
+
+    database.delete("user1", "1700000005.000300")
+    assert database.get_ts("user1") == "1700000002.000100"
+    assert database.user_exists("user1")
+
+    # Re-adding an incident doesn't reset its chat.
+    database.add("user1", "1700000002.000100")
+    assert database.get_ts("user1") == "1700000002.000100"
+
+    database.delete("user1", "1700000002.000100")
+    assert not database.user_exists("user1")
+    assert database.get_all_ts("user1") == ["1700000010.000200"]
+
+
+def test_delete(database):
+    database.add("user1", "ts1")
+    database.delete("user1")
+    database.delete("user2")
+
+    assert not database.user_exists("user1")
+    assert database.get_user_id("ts1") is None
+
+
+def test_failed_batch_is_rolled_back(database):
+    database.add("user1", "ts1")
+    database.start_chat("user1", "ts1")
+    # Load the active user index, so that it isn't reloaded from the table below.
+    database.user_exists("user1")
+
+    with pytest.raises(ValueError):
+        database.write_batch(
+            [
+                ("add", ("user2", "ts2")),
+                ("start_chat", ("user2", "ts2")),
+                ("delete", ("user1", "ts1")),
+                ("x", ("", "")),
+            ]
+        )
+
+    # Neither the rows nor the active user index reflect the failed batch.
+    assert database.user_exists("user1")
+    assert not database.user_exists("user2")
+    assert database.get_ts("user1") == "ts1"
+
+
+def test_persisted_across_connections(tmp_path):
+    Database(str(tmp_path / "data.db")).add("user1", "ts1")
+    Database(str(tmp_path / "data.db")).start_chat("user1", "ts1")
+    assert Database(str(tmp_path / "data.db")).get_ts("user1") == "ts1"
+
+
+def test_migrate_pickle(tmp_path):
+    pickle_file_path = tmp_path / "data.pkl"
+    with open(pickle_file_path, "wb") as f:
+        pickle.dump({"user1": {"message_ts": "ts1"}, "user2": {"message_ts": "ts2"}}, f)
+
+    database = Database(str(tmp_path / "data.db"))
+    assert database.get_ts("user1") == "ts1"
+    assert database.get_user_id("ts2") == "user2"
+
+    assert not os.path.exists(pickle_file_path)
+    assert os.path.exists(f"{pickle_file_path}.migrated")
+
+
+def test_user_exists_sees_other_connections(tmp_path):
+    database = Database(str(tmp_path / "data.db"))
+    assert not database.user_exists("user1")
+
+    # E.g. the alert feed script adds an entry from another process.
+    other_database = Database(str(tmp_path / "data.db"))
+    other_database.add("user1", "ts1")
+    assert not database.user_exists("user1")
+    other_database.start_chat("user1", "ts1")
+    assert database.user_exists("user1")
+
+    other_database.delete("user1")
+    assert not database.user_exists("user1")
+
+
+async def test_async_database(database):
+    async_database = AsyncDatabase(database)
+    await async_database.add("user1", "ts1")
+    await async_database.start_chat("user1", "ts1")
+
+    assert await async_database.user_exists("user1")
+    assert await async_database.lookup_by_user("user1") == "ts1"
+    assert await async_database.lookup_by_ts("ts1") == "user1"
+
+    await async_database.delete("user1")
+    assert await async_database.lookup_by_user("user1") is None
+    assert await async_database.lookup_by_ts("ts1") is None
+    async_database.close()
+
+
+async def test_async_database_coalesces_writes(database):
+    async_database = AsyncDatabase(database, coalesce_writes_ms=5)
+    with patch.object(database, "write_batch", wraps=database.write_batch) as mock_write_batch:
+        await asyncio.gather(
+            async_database.add("user1", "ts1"),
+            async_database.add("user2", "ts2"),
+            async_database.start_chat("user2", "ts2"),
+            async_database.delete("user1", "ts1"),
+        )
+
+    mock_write_batch.assert_called_once_with(
+        [
+            ("add", ("user1", "ts1")),
+            ("add", ("user2", "ts2")),
+            ("start_chat", ("user2", "ts2")),
+            ("delete", ("user1", "ts1")),
+        ]
+    )
+    assert await async_database.lookup_by_user("user1") is None
+    assert await async_database.lookup_by_user("user2") == "ts2"
+    async_database.close()
+
+
+def test_greeting_cache(database):
+    database.put_greeting("ts1", "fingerprint", "hello", ttl_seconds=60)
+
+    assert database.get_greeting("ts1", "fingerprint") == "hello"
+    assert database.get_greeting("ts1", "other_fingerprint") is None
+    assert database.get_greeting("ts2", "fingerprint") is None
+
+    with patch("incident_response_slackbot.db.database.time.time", return_value=time.time() + 61):
+        assert database.get_greeting("ts1", "fingerprint") is None
+
+
+def test_settings(database):
+    assert database.get_value("key") is None
+    database.set_value("key", "value")
+    assert database.get_value("key") == "value"
+
+
+def test_conversation_log(database):
+    database.add("user1", "ts1")
+    database.append_conversation("ts1", [{"role": "alert", "text": "alert details"}])
+    database.append_conversation(
+        "ts1", [{"role": "assistant", "text": "hello"}, {"role": "user", "text": "hi"}]
+    )
+
+    assert database.get_conversation("ts1") == [
+        {"role": "alert", "text": "alert details"},
+        {"role": "assistant", "text": "hello"},
+        {"role": "user", "text": "hi"},
+    ]
+    assert database.get_conversation("ts2") == []
+
+    # Closing the incident drops its conversation
+    database.delete("user1", "ts1")
+    assert database.get_conversation("ts1") == []
+
+
+def test_conversation_log_is_bounded(database):
+    database.append_conversation("ts1", [{"role": "alert", "text": "alert details"}])
+    database.append_conversation(
+        "ts1", [{"role": "user", "text": str(i)} for i in range(CONVERSATION_MAX_ENTRIES + 10)]
+    )
+    database.append_conversation("ts1", [{"role": "user", "text": "x" * 10_000}])
+
+    conversation = database.get_conversation("ts1")
+    assert len(conversation) == CONVERSATION_MAX_ENTRIES + 1
+    # The alert is kept, and the oldest chat messages are dropped
+    assert conversation[0] == {"role": "alert", "text": "alert details"}
+    assert conversation[1] == {"role": "user", "text": "11"}
+    assert len(conversation[-1]["text"]) == CONVERSATION_MAX_TEXT_LENGTH
+
+
+def test_summary_delta(database):
+    database.add("user1", "ts1")
+    database.append_conversation("ts1", [{"role": "alert", "text": "alert details"}])
+    summary, entries, summarized_through = database.get_summary_delta("ts1")
+    assert summary is None
+    assert entries == [{"role": "alert", "text": "alert details"}]
+
+    database.put_summary("ts1", "summary", summarized_through)
+    database.append_conversation("ts1", [{"role": "user", "text": "hi"}])
+    summary, entries, newer_through = database.get_summary_delta("ts1")
+    assert summary == "summary"
+    assert entries == [{"role": "user", "text": "hi"}]
+
+    # A summary of less of the conversation doesn't overwrite a newer one
+    database.put_summary("ts1", "newer summary", newer_through)
+    database.put_summary("ts1", "stale summary", summarized_through)
+    assert database.get_summary_delta("ts1") == ("newer summary", [], newer_through)
+
+    database.delete("user1", "ts1")
+    assert database.get_summary_delta("ts1") == (None, [], 0)
+
+    # A summary finished after the incident was deleted isn't stored
+    database.put_summary("ts1", "late summary", newer_through)
+    assert database.get_summary_delta("ts1") == (None, [], 0)
@@ -3,12 +3,14 @@ from unittest.mock import AsyncMock, MagicMock, patch
 from collections import namedtuple
 
 import pytest
+from incident_response_slackbot.db.database import LAST_ANALYST_NAME_KEY
 from incident_response_slackbot.handlers import (
     InboundDirectMessageHandler,
     InboundIncidentStartChatHandler,
     InboundIncidentDoNothingHandler,
     InboundIncidentEndChatHandler,
 )
+from incident_response_slackbot.openai_utils import greeting_fingerprint
 
 
 @pytest.mark.asyncio
@@ -29,6 +31,29 @@ async def test_send_message_to_channel(mock_slack_client, mock_config):
     )
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "channel_type, user, should_handle",
+    [
+        ("im", "alert_user", True),
+        ("im", "other_user", False),
+        ("im", "alerted_user", False),
+        ("channel", "alert_user", False),
+    ],
+)
+async def test_direct_message_should_handle(
+    mock_slack_client, mock_database, channel_type, user, should_handle
+):
+    await mock_database.add("alert_user", "12345")
+    await mock_database.start_chat("alert_user", "12345")
+    # No chat was started for this user's alert yet
+    await mock_database.add("alerted_user", "12346")
+    handler = InboundDirectMessageHandler(slack_client=mock_slack_client)
+
+    args = MagicMock(event={"channel_type": channel_type, "user": user})
+    assert await handler.should_handle(args) == should_handle
+
+
 @pytest.mark.asyncio
 async def test_end_chat(mock_slack_client, mock_config):
     # Define the return value for get_original_blocks
@@ -67,7 +92,9 @@ async def test_end_chat(mock_slack_client, mock_config):
 
 
 @pytest.mark.asyncio
-async def test_nudge_user(mock_slack_client, mock_config, mock_generate_awareness_question):
+async def test_nudge_user(
+    mock_slack_client, mock_config, mock_database, mock_generate_awareness_question
+):
     # Create an instance of the handler
     handler = InboundDirectMessageHandler(slack_client=mock_slack_client)
 
@@ -83,6 +110,9 @@ async def test_nudge_user(mock_slack_client, mock_config, mock_generate_awarenes
         thread_ts="12345",
     )
 
+    # The rolling summary is updated in the background
+    assert [job["kind"] for job in await mock_database.get_jobs()] == ["roll_summary"]
+
 
 @pytest.mark.asyncio
 async def test_incident_start_chat_handle(mock_slack_client, mock_config):
@@ -96,10 +126,12 @@ async def test_incident_start_chat_handle(mock_slack_client, mock_config):
         "user": {"name": "test_user", "id": "user123"},
     }
 
-    # Mock the DATABASE.get_user_id method
+    # Mock the DATABASE.lookup_by_ts method
     with patch(
-        "incident_response_slackbot.handlers.DATABASE.get_user_id", return_value="alert_user123"
-    ) as mock_get_user_id, patch(
+        "incident_response_slackbot.handlers.DATABASE.lookup_by_ts",
+        new_callable=AsyncMock,
+        return_value="alert_user123",
+    ) as mock_lookup_by_ts, patch(
         "incident_response_slackbot.handlers.create_greeting",
         new_callable=AsyncMock,
         return_value="greeting message",
@@ -170,11 +202,16 @@ async def test_do_nothing_handle(mock_slack_client, mock_config):
 
 
 @pytest.mark.asyncio
-async def test_end_chat_handle(mock_slack_client, mock_config, mock_get_thread_summary):
+async def test_end_chat_handle(
+    mock_slack_client, mock_config, mock_get_thread_summary, mock_database
+):
+    await mock_database.add("alert_user_id", "message_ts")
+    await mock_database.add("alert_user_id", "other_message_ts")
+
     # Mock the Slack client and the database
     with patch(
-        "incident_response_slackbot.handlers.Database", new_callable=AsyncMock
-    ) as MockDatabase:
+        "incident_response_slackbot.handlers.DATABASE.lookup_by_ts", new_callable=AsyncMock
+    ) as mock_lookup_by_ts:
         # Instantiate the handler
         handler = InboundIncidentEndChatHandler(slack_client=mock_slack_client)
 
@@ -184,8 +221,8 @@ async def test_end_chat_handle(mock_slack_client, mock_config, mock_get_thread_s
         # Instantiate the args object
         args = Args(body={"user": {"id": "user_id"}, "message": {"ts": "message_ts"}})
 
-        # Mock the get_user_id method of the database to return a user id
-        MockDatabase.get_user_id.return_value = "alert_user_id"
+        # Mock the lookup_by_ts method of the database to return a user id
+        mock_lookup_by_ts.return_value = "alert_user_id"
 
         # Call the handle method
         await handler.handle(args)
@@ -196,3 +233,152 @@ async def test_end_chat_handle(mock_slack_client, mock_config, mock_get_thread_s
         )
         mock_slack_client.update_message.assert_called()
         mock_slack_client.post_message.assert_called()
+
+    # Only the alert user's incident for this thread is closed
+    assert await mock_database.list_by_user("alert_user_id") == ["other_message_ts"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("first_name, cached", [("user", True), ("other", False)])
+async def test_start_chat_precomputed_greeting(
+    mock_slack_client, mock_database, first_name, cached
+):
+    await mock_database.put_greeting(
+        "12345", greeting_fingerprint("user", "alert details"), "precomputed greeting", 60
+    )
+    handler = InboundIncidentStartChatHandler(slack_client=mock_slack_client)
+
+    with patch(
+        "incident_response_slackbot.handlers.create_greeting",
+        new_callable=AsyncMock,
+        return_value="live greeting",
+    ) as mock_create_greeting:
+        greeting = await handler.get_greeting("12345", first_name, "alert details")
+
+    if cached:
+        assert greeting == "precomputed greeting"
+        mock_create_greeting.assert_not_awaited()
+    else:
+        assert greeting == "live greeting"
+        mock_create_greeting.assert_awaited_once_with(first_name, "alert details")
+
+    # The analyst's name is used to precompute greetings for new alerts
+    assert await mock_database.get_value(LAST_ANALYST_NAME_KEY) == first_name
+
+
+@pytest.mark.asyncio
+async def test_direct_message_uses_conversation_log(
+    mock_slack_client, mock_config, mock_database, mock_jobs, mock_get_thread_summary
+):
+    await mock_jobs.start(mock_slack_client)
+    await mock_database.add("alert_user", "12345")
+    await mock_database.start_chat("alert_user", "12345")
+    await mock_database.append_conversation(
+        "12345",
+        [{"role": "alert", "text": "alert details"}, {"role": "assistant", "text": "greeting"}],
+    )
+    handler = InboundDirectMessageHandler(slack_client=mock_slack_client)
+    args = MagicMock(event={"channel_type": "im", "user": "alert_user", "text": "yes it was me"})
+
+    with patch(
+        "incident_response_slackbot.handlers.get_user_awareness",
+        new_callable=AsyncMock,
+        return_value={"has_answered": True, "is_aware": True},
+    ) as mock_get_user_awareness:
+        await handler.handle(args)
+    await mock_jobs.join()
+
+    # The prior chat is passed as context, and the thread isn't re-read
+    mock_get_user_awareness.assert_awaited_once_with(
+        "yes it was me",
+        [{"role": "alert", "text": "alert details"}, {"role": "assistant", "text": "greeting"}],
+    )
+    mock_get_thread_summary.assert_awaited_once_with(
+        [
+            {"role": "alert", "text": "alert details"},
+            {"role": "assistant", "text": "greeting"},
+            {"role": "user", "text": "yes it was me"},
+        ],
+        None,
+    )
+    mock_slack_client.get_thread_messages.assert_not_called()
+    assert await mock_database.get_conversation("12345") == []
+
+
+@pytest.mark.asyncio
+async def test_direct_message_routed_to_started_chat(
+    mock_slack_client, mock_config, mock_database, mock_generate_awareness_question
+):
+    await mock_database.add("alert_user", "1700000001.000100")
+    await mock_database.start_chat("alert_user", "1700000001.000100")
+    # A newer alert for the same user, posted while the chat is ongoing
+    await mock_database.add("alert_user", "1700000002.000100")
+    handler = InboundDirectMessageHandler(slack_client=mock_slack_client)
+    args = MagicMock(event={"channel_type": "im", "user": "alert_user", "text": "what alert?"})
+
+    with patch(
+        "incident_response_slackbot.handlers.get_user_awareness",
+        new_callable=AsyncMock,
+        return_value={"has_answered": False, "is_aware": False},
+    ):
+        await handler.handle(args)
+
+    mock_slack_client.post_message.assert_any_call(
+        channel=mock_config.feed_channel_id,
+        text="Received message from <@alert_user>:\n> what alert?",
+        thread_ts="1700000001.000100",
+    )
+    assert await mock_database.get_conversation("1700000002.000100") == []
+
+    # Once a chat is started for the newer alert, messages are routed to it
+    await mock_database.start_chat("alert_user", "1700000002.000100")
+    assert await mock_database.lookup_by_user("alert_user") == "1700000002.000100"
+
+
+@pytest.mark.asyncio
+async def test_rolling_summary(
+    mock_slack_client, mock_config, mock_database, mock_jobs, mock_generate_awareness_question
+):
+    await mock_jobs.start(mock_slack_client)
+    await mock_database.add("alert_user", "12345")
+    await mock_database.start_chat("alert_user", "12345")
+    await mock_database.append_conversation("12345", [{"role": "alert", "text": "alert details"}])
+    handler = InboundDirectMessageHandler(slack_client=mock_slack_client)
+    args = MagicMock(event={"channel_type": "im", "user": "alert_user", "text": "what alert?"})
+
+    with patch(
+        "incident_response_slackbot.handlers.get_user_awareness",
+        new_callable=AsyncMock,
+        return_value={"has_answered": False, "is_aware": False},
+    ), patch(
+        "incident_response_slackbot.handlers.update_summary",
+        new_callable=AsyncMock,
+        return_value="rolling summary",
+    ) as mock_update_summary:
+        await handler.handle(args)
+        await mock_jobs.join()
+
+    # The nudged chat is folded into the rolling summary
+    mock_update_summary.assert_awaited_once_with(
+        None,
+        [
+            {"role": "alert", "text": "alert details"},
+            {"role": "user", "text": "what alert?"},
+            {"role": "assistant", "text": "Mock question"},
+        ],
+    )
+
+    # Ending the chat only summarizes the messages since the last update
+    await mock_database.append_conversation("12345", [{"role": "user", "text": "it was me"}])
+    with patch(
+        "incident_response_slackbot.handlers.get_thread_summary",
+        new_callable=AsyncMock,
+        return_value="final summary",
+    ) as mock_get_thread_summary:
+        await handler.handle_user_response("alert_user", "12345")
+        await mock_jobs.join()
+
+    mock_get_thread_summary.assert_awaited_once_with(
+        [{"role": "user", "text": "it was me"}], "rolling summary"
+    )
+    mock_slack_client.get_thread_messages.assert_not_called()
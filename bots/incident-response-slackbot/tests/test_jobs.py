@@ -0,0 +1,64 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from incident_response_slackbot.jobs import JOB_EVENTS, JobRunner
+
+
+async def test_jobs_run_in_background(mock_database):
+    slack_client = MagicMock()
+    func = AsyncMock()
+    jobs = JobRunner(mock_database)
+    jobs.register("kind", func)
+    await jobs.start(slack_client)
+
+    await jobs.submit("kind", {"value": 1})
+    await jobs.join()
+
+    func.assert_awaited_once_with(slack_client, value=1)
+    assert await mock_database.get_jobs() == []
+    await jobs.stop()
+
+
+async def test_jobs_resume_after_restart(mock_database):
+    # Submitted before the bot stopped, but never run
+    jobs = JobRunner(mock_database)
+    jobs.register("kind", AsyncMock())
+    await jobs.submit("kind", {"value": 1})
+    assert len(await mock_database.get_jobs()) == 1
+
+    func = AsyncMock()
+    restarted_jobs = JobRunner(mock_database)
+    restarted_jobs.register("kind", func)
+    await restarted_jobs.start(MagicMock())
+    await restarted_jobs.join()
+
+    func.assert_awaited_once()
+    assert await mock_database.get_jobs() == []
+    await restarted_jobs.stop()
+
+
+async def test_jobs_retry_then_fail(mock_database):
+    func = AsyncMock(side_effect=[Exception("error"), None])
+    jobs = JobRunner(mock_database, retry_delay=0)
+    jobs.register("retried", func)
+    jobs.register("failed", AsyncMock(side_effect=Exception("error")))
+    await jobs.start(MagicMock())
+    retried = JOB_EVENTS.get(kind="retried", outcome="retried")
+    failed = JOB_EVENTS.get(kind="failed", outcome="failed")
+
+    await jobs.submit("retried", {})
+    await jobs.submit("failed", {})
+    await jobs.join()
+
+    assert func.await_count == 2
+    assert JOB_EVENTS.get(kind="retried", outcome="retried") == retried + 1
+    assert JOB_EVENTS.get(kind="failed", outcome="failed") == failed + 1
+    # Failed jobs are dropped once they run out of attempts
+    assert await mock_database.get_jobs() == []
+    await jobs.stop()
+
+
+async def test_submit_unknown_kind(mock_database):
+    jobs = JobRunner(mock_database)
+    with pytest.raises(ValueError):
+        await jobs.submit("unknown", {})
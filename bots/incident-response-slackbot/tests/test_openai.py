@@ -1,23 +1,17 @@
 # in tests/test_openai_utils.py
-from unittest.mock import patch
+from unittest.mock import MagicMock
 
 import pytest
 from incident_response_slackbot.openai_utils import get_user_awareness
 
 
 @pytest.mark.asyncio
-@patch("openai.ChatCompletion.create")
-async def test_get_user_awareness(mock_create):
+async def test_get_user_awareness(mock_llm_client):
     # Arrange
-    mock_create.return_value = {
-        "choices": [
-            {
-                "message": {
-                    "function_call": {"arguments": '{"has_answered": true, "is_aware": false}'}
-                }
-            }
-        ]
-    }
+    response = MagicMock()
+    arguments = '{"has_answered": true, "is_aware": false}'
+    response.choices[0].message.function_call.arguments = arguments
+    mock_llm_client.chat_completion.return_value = response
     inbound_direct_message = "mock_inbound_direct_message"
 
     # Act
@@ -3,16 +3,16 @@ import hashlib
 import json
 import os
 import re
-import threading
-import time
-import traceback
 from logging import getLogger
+from urllib.parse import urlparse
 
 import validate
 import validators
 from database import *
-from gdoc import gdoc_get
+from gdoc import gdoc_get_many, gdoc_revisions, is_gdoc_url
+from monitor import CONTENT_FETCHES, BatchFetcher, ResourceMonitor
 from openai_slackbot.bot import init_bot, start_app
+from openai_slackbot.metrics import start_metrics_server
 from openai_slackbot.utils.envvars import string
 from peewee import *
 from playhouse.db_url import *
@@ -21,6 +21,7 @@ from sdlc_slackbot.config import get_config, load_config
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from slack_sdk import WebClient
+from summarize import allocate_budget, map_reduce_summarize
 from utils import *
 
 
@@ -67,22 +68,77 @@ async def async_fetch_slack(url):
     return " ".join(message.get("text", "") for message in result.data.get("messages", []))
 
 
+# Concurrent Google Docs fetches, e.g. of a submission's resources or by the
+# monitor's checks, share batch requests.
 content_fetchers = [
-    (
-        lambda u: u.startswith(("https://docs.google.com/document", "docs.google.com/document")),
-        gdoc_get,
-    ),
+    (is_gdoc_url, BatchFetcher(gdoc_get_many).fetch),
     (lambda u: "slack.com/archives" in u, async_fetch_slack),
 ]
 
+# Fetchers of a cheap revision identifier, for the resources that have one.
+revision_fetchers = [
+    (is_gdoc_url, BatchFetcher(gdoc_revisions).fetch),
+]
+
+
+async def fetch_revision(url):
+    return await fetch_with(revision_fetchers, url)
+
 
 async def fetch_content(url):
-    for condition, fetcher in content_fetchers:
+    return await fetch_with(content_fetchers, url)
+
+
+async def fetch_with(fetchers, url):
+    for condition, fetcher in fetchers:
         if condition(url):
             if asyncio.iscoroutinefunction(fetcher):
                 return await fetcher(url)  # Await the result if it's a coroutine function
             else:
-                return fetcher(url)  # Call it directly if it's not a coroutine function
+                # Run blocking fetchers in a thread, so that they don't block the event loop
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(None, fetcher, url)
+
+
+# Limits the number of concurrent fetches per host, across submissions
+host_semaphores = {}
+
+
+async def fetch_all(urls):
+    """
+    Fetches the urls concurrently, at most config.fetch_per_host_concurrency
+    at a time per host. A fetch is abandoned after config.fetch_timeout_seconds,
+    and the fetches still running after config.fetch_deadline_seconds are
+    abandoned too. Returns {url: content} for the fetches that succeeded.
+
+    Abandoned blocking fetchers can't be interrupted, they finish in the
+    background and their result is dropped.
+    """
+
+    async def fetch_one(url):
+        host = urlparse(url).netloc
+        if host not in host_semaphores:
+            host_semaphores[host] = asyncio.Semaphore(config.fetch_per_host_concurrency)
+        async with host_semaphores[host]:
+            return await asyncio.wait_for(fetch_content(url), config.fetch_timeout_seconds)
+
+    tasks = {url: asyncio.ensure_future(fetch_one(url)) for url in dict.fromkeys(urls)}
+    if not tasks:
+        return {}
+
+    _, pending = await asyncio.wait(tasks.values(), timeout=config.fetch_deadline_seconds)
+    for task in pending:
+        task.cancel()
+
+    contents = {}
+    for url, task in tasks.items():
+        if task in pending:
+            logger.warning(f"fetching {url} didn't finish before the deadline")
+        elif task.exception() is not None:
+            logger.error(f"failed to fetch {url}: {task.exception()!r}")
+        else:
+            contents[url] = task.result()
+    return contents
 
 
 form = [
@@ -171,16 +227,48 @@ def model_params_to_str(params):
     return re.sub(multiple_whitespace_pat, " ", "\n".join(map(str, ss))).strip()
 
 
-def summarize_params(params):
-    summary = {}
-    for k, v in params.items():
-        if k not in skip_params:
-            summary[k] = ask_ai(
-                config.base_prompt + config.summary_prompt, v[: config.context_limit]
+async def summarize_params(params):
+    """
+    Summarizes the fields that don't fit in their share of the context limit.
+    Long fields are summarized in chunks, and the chunk summaries are then
+    combined until they fit, with at most config.summary_max_concurrency
+    summaries generated at once across all fields.
+    """
+    fields = {k: str(v) for k, v in params.items() if k not in skip_params}
+    # Leave room for the separators model_params_to_str adds between fields
+    budgets = allocate_budget(
+        {k: len(v) for k, v in fields.items()}, config.context_limit - len(fields)
+    )
+    semaphore = asyncio.Semaphore(config.summary_max_concurrency)
+
+    async def summarize_chunk(chunk):
+        async with semaphore:
+            return await ask_gpt(config.summary_prompt, chunk)
+
+    async def combine_summaries(summaries, budget):
+        async with semaphore:
+            return await ask_gpt(
+                config.summary_prompt,
+                "The following are summaries of consecutive parts of the project document. "
+                f"Combine them into a single summary of at most {budget} characters.\n\n"
+                + summaries,
             )
-        else:
-            summary[k] = v
 
+    summaries = await asyncio.gather(
+        *(
+            map_reduce_summarize(
+                v,
+                budgets[k],
+                summarize_chunk=summarize_chunk,
+                combine_summaries=combine_summaries,
+                chunk_size=config.summary_chunk_size,
+            )
+            for k, v in fields.items()
+        )
+    )
+
+    summary = dict(params)
+    summary.update(zip(fields, summaries))
     return summary
 
 
@@ -195,12 +283,12 @@ async def handle_message_events(say, message):
         await say(blocks=form, thread_ts=message["ts"])
 
 
-def get_response_with_retry(prompt, context, max_retries=1):
+async def get_response_with_retry(prompt, context, max_retries=1):
     prompt = prompt.strip().replace("\n", " ")
     retries = 0
     while retries <= max_retries:
         try:
-            response = ask_ai(prompt, context)
+            response = await ask_ai(prompt, context)
             return response
         except json.JSONDecodeError as e:
             logger.error(f"JSON error on attempt {retries + 1}: {e}")
@@ -260,9 +348,12 @@ async def submit_form(ack, body, say):
         except IntegrityError as e:
             raise validate.ValidationError("project_name", "must be unique")
 
+        urls = extract_urls(params.get("links_to_resources", ""))
+        contents = await fetch_all(urls)
+
         resources = []
-        for url in extract_urls(params.get("links_to_resources", "")):
-            content = await fetch_content(url)
+        for url in dict.fromkeys(urls):
+            content = contents.get(url)
             if content:
                 params[url] = content
                 resources.append(
@@ -277,15 +368,16 @@ async def submit_form(ack, body, say):
         context = model_params_to_str(params)
         if len(context) > config.context_limit:
             logger.info(f"context too long: {len(context)}. Summarizing...")
-            summarized_context = summarize_params(params)
+            summarized_context = await summarize_params(params)
             context = model_params_to_str(summarized_context)
-            # FIXME: is there a better way to handle this? currently, if the summary is still too long
-            # we just give up and cut it off
+            # The summaries are asked to fit the budget, but if they still don't, cut them off
             if len(context) > config.context_limit:
                 logger.info(f"Summarized context too long: {len(context)}. Cutting off...")
                 context = context[: config.context_limit]
 
-        response = get_response_with_retry(config.base_prompt + config.initial_prompt, context)
+        response = await get_response_with_retry(
+            config.base_prompt + config.initial_prompt, context
+        )
         if not response:
             return
 
@@ -348,7 +440,7 @@ async def submit_followup_questions(ack, body, say):
 
         context = model_params_to_str(params)
 
-        response = ask_ai(config.base_prompt, context)
+        response = await ask_ai(config.base_prompt, context)
         text_to_update = response
         if (
             isinstance(response, dict)
@@ -372,89 +464,108 @@ async def submit_followup_questions(ack, body, say):
         await say(text=config.irrecoverable_error_message, thread_ts=ts)
 
 
-def update_resources():
-    while True:
-        time.sleep(monitor_thread_sleep_seconds)
-        try:
-            for assessment in Assessment.select():
-                logger.info(f"checking {assessment.project_name} for updates")
-
-                assessment_params = model_to_dict(assessment)
-                new_params = assessment_params.copy()
-
-                changed = False
-
-                previous_content = ""
-
-                for resource in assessment.resources:
-                    new_content = asyncio.run(fetch_content(resource.url))
+def select_resource_ids():
+    return [resource.id for resource in Resource.select(Resource.id)]
 
-                    if resource.content_hash != hash_content(new_content):
-                        # just save previous content in memory temporarily
-                        previous_content = resource.content
-                        resource.content = new_content
-                        new_params[resource.url] = new_content
-                        changed = True
 
-                    if not changed:
-                        continue
+def select_resource(resource_id):
+    # Join the assessment, so that it isn't lazily queried later
+    return (
+        Resource.select(Resource, Assessment)
+        .join(Assessment)
+        .where(Resource.id == resource_id)
+        .get()
+    )
 
-                    old_context = model_params_to_str(assessment_params)
-                    new_context = model_params_to_str(new_params)
 
-                    context = {
-                        "previous_context": previous_content,
-                        "previous_decision": {
-                            "risk": assessment.risk,
-                            "confidence": assessment.confidence,
-                            "justification": assessment.justification,
-                        },
-                        "new_context": new_content,
-                    }
+def save_reassessment(resource, assessment, clean_response):
+    with db.atomic():
+        resource.save()
+        for item in clean_response:
+            assessment.update(**item).execute()
 
-                    context_json = json.dumps(context, indent=2)
 
-                    new_response = ask_ai(config.base_prompt + config.update_prompt, context_json)
+async def load_resource_ids():
+    # Query the database in a thread, so that it doesn't block the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, select_resource_ids)
 
-                    resource.content_hash = hash_content(new_content)
-                    resource.save()
 
-                    if new_response["outcome"] == "unchanged":
-                        continue
+async def check_resource(resource_id):
+    """
+    Fetches the resource and re-assesses its project if the content has
+    changed since it was last checked. Returns whether it changed.
+    """
+    loop = asyncio.get_running_loop()
+    resource = await loop.run_in_executor(None, select_resource, resource_id)
+
+    # Only download the content if the revision has moved
+    revision_id = await fetch_revision(resource.url)
+    if revision_id is not None and revision_id == resource.revision_id:
+        CONTENT_FETCHES.inc(result="skipped")
+        return False
+
+    new_content = await fetch_content(resource.url)
+    CONTENT_FETCHES.inc(result="fetched")
+    if new_content is None:
+        raise ValueError(f"failed to fetch {resource.url}")
+
+    new_content_hash = hash_content(new_content)
+    if resource.content_hash == new_content_hash:
+        # The revision can move without the text changing, e.g. for formatting changes
+        if revision_id != resource.revision_id:
+            resource.revision_id = revision_id
+            await loop.run_in_executor(None, resource.save)
+        return False
+
+    assessment = resource.assessment
+    logger.info(f"{resource.url} of {assessment.project_name} has changed")
+    assessment_params = model_to_dict(assessment)
+
+    context = {
+        "previous_context": resource.content,
+        "previous_decision": {
+            "risk": assessment.risk,
+            "confidence": assessment.confidence,
+            "justification": assessment.justification,
+        },
+        "new_context": new_content,
+    }
 
-                    normalized_response = normalize_response(new_response)
-                    clean_response = clean_normalized_response(normalized_response)
+    context_json = json.dumps(context, indent=2)
 
-                    for item in clean_response:
-                        assessment.update(**item).execute()
+    new_response = await ask_ai(config.base_prompt + config.update_prompt, context_json)
+    if new_response is None:
+        raise ValueError(f"failed to re-assess {assessment.project_name}")
 
-                    asyncio.run(send_update_notification(assessment_params, new_response))
-        except Exception as e:
-            logger.error(f"error: {e} updating resources")
-            traceback.print_exc()
+    resource.content = new_content
+    resource.content_hash = new_content_hash
+    resource.revision_id = revision_id
 
+    if new_response["outcome"] == "unchanged":
+        await loop.run_in_executor(None, resource.save)
+        return True
 
-monitor_thread_sleep_seconds = 6
+    normalized_response = normalize_response(new_response)
+    clean_response = clean_normalized_response(normalized_response)
+    await loop.run_in_executor(None, save_reassessment, resource, assessment, clean_response)
 
-if __name__ == "__main__":
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    load_config(os.path.join(current_dir, "config.toml"))
+    await send_update_notification(assessment_params, new_response)
+    return True
 
-    template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
 
-    config = get_config()
+async def main(template_path):
+    global app
 
     message_handler = []
     action_handlers = []
     view_submission_handlers = []
 
-    app = asyncio.run(
-        init_bot(
-            openai_organization_id=config.openai_organization_id,
-            slack_message_handler=message_handler,
-            slack_action_handlers=action_handlers,
-            slack_template_path=template_path,
-        )
+    app = await init_bot(
+        openai_organization_id=config.openai_organization_id,
+        slack_message_handler=message_handler,
+        slack_action_handlers=action_handlers,
+        slack_template_path=template_path,
     )
 
     # Register your custom event handlers
@@ -464,8 +575,30 @@ if __name__ == "__main__":
     app.action("submit_form")(submit_form)
     app.action(re.compile("submit_followup_questions.*"))(submit_followup_questions)
 
-    t = threading.Thread(target=update_resources)
-    t.start()
+    # Check the assessments' resources for changes in the background
+    monitor = ResourceMonitor(
+        load_resource_ids=load_resource_ids,
+        check_resource=check_resource,
+        min_interval=config.monitor_min_interval_seconds,
+        max_interval=config.monitor_max_interval_seconds,
+        backoff=config.monitor_backoff,
+        max_concurrent_checks=config.monitor_max_concurrent_checks,
+    )
+    monitor_task = asyncio.create_task(monitor.run())
+
+    # Serve Prometheus metrics, including the monitor's, as start_bot does
+    await start_metrics_server()
 
     # Start the app
-    asyncio.run(start_app(app))
+    await start_app(app)
+
+
+if __name__ == "__main__":
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    load_config(os.path.join(current_dir, "config.toml"))
+
+    template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+    config = get_config()
+
+    asyncio.run(main(template_path))
@@ -34,6 +34,28 @@ class Config(BaseModel):
     # Slack channel for notifications
     notification_channel_id: t.Annotated[str, AfterValidator(validate_channel)]
 
+    # Resource change monitor. A resource is checked every min interval at
+    # first, and the interval grows by the backoff factor, up to the max
+    # interval, for every check that finds it unchanged. Failed checks are
+    # retried with the same backoff.
+    monitor_min_interval_seconds: int = 60
+    monitor_max_interval_seconds: int = 24 * 60 * 60
+    monitor_backoff: float = 2.0
+    monitor_max_concurrent_checks: int = 16
+
+    # Fetching the resources linked in a submission. Fetches run concurrently,
+    # up to the per host limit, and are abandoned after the per fetch timeout,
+    # or when they're still running at the deadline for all of them.
+    fetch_per_host_concurrency: int = 4
+    fetch_timeout_seconds: float = 30
+    fetch_deadline_seconds: float = 60
+
+    # Summarizing submissions over the context limit. Long fields are split
+    # into chunks of this many characters, and at most this many summaries
+    # are generated at once.
+    summary_chunk_size: int = 12_000
+    summary_max_concurrency: int = 4
+
 
 def load_config(path: str):
     load_dotenv()
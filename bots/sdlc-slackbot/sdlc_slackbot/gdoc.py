@@ -1,11 +1,15 @@
 from __future__ import print_function
 
+import datetime
 import os.path
 import re
+import threading
 from logging import getLogger
 
+import httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
@@ -13,6 +17,13 @@ from googleapiclient.errors import HttpError
 # If modifying these scopes, delete the file token.json.
 SCOPES = ["https://www.googleapis.com/auth/documents.readonly"]
 
+# Refresh the access token this long before it expires, so that requests
+# don't have to wait for it.
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# Maximum number of requests sent in one batch HTTP request.
+BATCH_SIZE = 50
+
 logger = getLogger(__name__)
 
 
@@ -75,23 +86,118 @@ def gdoc_creds():
                 creds_path + "credentials.json", SCOPES
             )
             creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open(creds_path + "token.json", "w") as token:
-            token.write(creds.to_json())
+        save_gdoc_creds(creds)
 
     return creds
 
 
-def gdoc_get(gdoc_url):
+def save_gdoc_creds(creds):
+    # Save the credentials for the next run
+    creds_path = "./bots/sdlc-slackbot/sdlc_slackbot/"
+    with open(creds_path + "token.json", "w") as token:
+        token.write(creds.to_json())
+
+
+class DocsClient:
+    """
+    Process-wide Google Docs API client. The credentials are loaded once and
+    refreshed ahead of their expiry, and the discovery-based service is built
+    once. httplib2 isn't thread-safe, so every thread sends its requests
+    through its own authorized HTTP transport.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._creds = None
+        self._service = None
+        self._local = threading.local()
+
+    def credentials(self):
+        with self._lock:
+            if self._creds is None:
+                self._creds = gdoc_creds()
+            elif self._creds.refresh_token and (
+                not self._creds.valid
+                or (
+                    self._creds.expiry
+                    and self._creds.expiry - REFRESH_MARGIN <= datetime.datetime.utcnow()
+                )
+            ):
+                self._creds.refresh(Request())
+                save_gdoc_creds(self._creds)
+            return self._creds
+
+    def service(self):
+        creds = self.credentials()
+        with self._lock:
+            if self._service is None:
+                self._service = build("docs", "v1", credentials=creds, cache_discovery=False)
+            return self._service
+
+    def get_document(self, document_id, fields=None):
+        """Returns the document, or only the given fields of it."""
+        request = self.service().documents().get(documentId=document_id, fields=fields)
+        return request.execute(http=self._http())
+
+    def get_documents(self, document_ids, fields=None):
+        """Returns {document_id: document} for many documents, fetched with batch
+        requests of up to BATCH_SIZE documents. Documents that failed to be
+        fetched are logged, and map to the HttpError they failed with.
+        """
+        service = self.service()
+        documents = {}
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                logger.error(f"Failed to get document {request_id}: {exception}")
+                documents[request_id] = exception
+            else:
+                documents[request_id] = response
+
+        document_ids = list(dict.fromkeys(document_ids))
+        for i in range(0, len(document_ids), BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=callback)
+            for document_id in document_ids[i : i + BATCH_SIZE]:
+                batch.add(
+                    service.documents().get(documentId=document_id, fields=fields),
+                    request_id=document_id,
+                )
+            batch.execute(http=self._http())
+
+        return documents
+
+    def _http(self):
+        # Make sure the shared credentials are fresh before they're used.
+        creds = self.credentials()
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = AuthorizedHttp(creds, http=httplib2.Http())
+            self._local.http = http
+        return http
+
+
+_DOCS_CLIENT = None
+_DOCS_CLIENT_LOCK = threading.Lock()
+
+
+def get_docs_client():
+    global _DOCS_CLIENT
+    with _DOCS_CLIENT_LOCK:
+        if _DOCS_CLIENT is None:
+            _DOCS_CLIENT = DocsClient()
+        return _DOCS_CLIENT
+
+
+def is_gdoc_url(url):
+    return url.startswith(("https://docs.google.com/document", "docs.google.com/document"))
+
+
+def gdoc_document_id(gdoc_url):
     # https://docs.google.com/document/d/<ID>/edit
 
-    result = None
-    logger.info(gdoc_url)
-    if not gdoc_url.startswith("https://docs.google.com/document") and not gdoc_url.startswith(
-        "docs.google.com/document"
-    ):
+    if not is_gdoc_url(gdoc_url):
         logger.error("Invalid google doc url")
-        return result
+        return None
 
     # This regex captures the ID after "/d/" and before an optional "/edit", "/" or the end of the string.
     pattern = r"/d/([^/]+)"
@@ -100,16 +206,22 @@ def gdoc_get(gdoc_url):
     if match:
         document_id = match.group(1)
         logger.info(document_id)
-    else:
-        logger.error("No ID found in the URL")
+        return document_id
+
+    logger.error("No ID found in the URL")
+    return None
+
+
+def gdoc_get(gdoc_url):
+    result = None
+    logger.info(gdoc_url)
+    document_id = gdoc_document_id(gdoc_url)
+    if document_id is None:
         return result
 
-    creds = gdoc_creds()
     try:
-        service = build("docs", "v1", credentials=creds)
-
         # Retrieve the documents contents from the Docs service.
-        document = service.documents().get(documentId=document_id).execute()
+        document = get_docs_client().get_document(document_id)
 
         logger.info("The title of the document is: {}".format(document.get("title")))
 
@@ -120,3 +232,54 @@ def gdoc_get(gdoc_url):
         logger.error(err)
 
     return result
+
+
+def gdoc_get_many(gdoc_urls):
+    """Returns {url: text} for many documents, fetched with batch requests.
+    Documents that failed to be fetched map to their HttpError, so that a
+    BatchFetcher only fails the fetches of those documents.
+    """
+    return {
+        url: (
+            document
+            if isinstance(document, HttpError)
+            else read_structural_elements(document.get("body").get("content"))
+        )
+        for url, document in _get_documents(gdoc_urls).items()
+    }
+
+
+def gdoc_revisions(gdoc_urls):
+    """Returns {url: revision ID} for many documents, fetched with batch requests
+    that don't download their content. Documents that failed to be fetched map
+    to their HttpError, so that a BatchFetcher only fails the fetches of those
+    documents.
+
+    An unchanged revision ID means the document hasn't changed. A changed one
+    usually means it has, but can also be due to internal changes to the ID,
+    so callers should still compare the content. Drive's modifiedTime or
+    version would need a Drive scope on top of the Docs one, and also change
+    for changes that aren't to the content.
+    """
+    return {
+        url: document if isinstance(document, HttpError) else document.get("revisionId")
+        for url, document in _get_documents(gdoc_urls, fields="revisionId").items()
+    }
+
+
+def _get_documents(gdoc_urls, fields=None):
+    document_ids = {url: gdoc_document_id(url) for url in gdoc_urls}
+    try:
+        documents = get_docs_client().get_documents(
+            [document_id for document_id in document_ids.values() if document_id],
+            fields=fields,
+        )
+    except HttpError as err:
+        logger.error(err)
+        documents = {document_id: err for document_id in document_ids.values() if document_id}
+
+    return {
+        url: documents[document_id]
+        for url, document_id in document_ids.items()
+        if document_id in documents
+    }
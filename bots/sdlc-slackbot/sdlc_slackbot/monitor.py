@@ -0,0 +1,234 @@
+import asyncio
+import heapq
+import random
+import time
+import typing as t
+from logging import getLogger
+
+from openai_slackbot.metrics import REGISTRY
+
+logger = getLogger(__name__)
+
+POLL_LAG = REGISTRY.histogram(
+    "sdlc_slackbot_resource_poll_lag_seconds",
+    "Time from a resource check being due to it starting.",
+    buckets=(0.1, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0),
+)
+RESOURCE_CHECKS = REGISTRY.counter(
+    "sdlc_slackbot_resource_checks_total",
+    "Resource change checks, by outcome (unchanged, changed or error).",
+    ["outcome"],
+)
+RESOURCE_CHECK_LATENCY = REGISTRY.histogram(
+    "sdlc_slackbot_resource_check_duration_seconds", "Time spent checking a resource for changes."
+)
+CONTENT_FETCHES = REGISTRY.counter(
+    "sdlc_slackbot_resource_content_fetches_total",
+    "Resource checks, by whether the content was downloaded (fetched) or the revision was "
+    "unchanged (skipped).",
+    ["result"],
+)
+RESOURCES_MONITORED = REGISTRY.gauge(
+    "sdlc_slackbot_resources_monitored", "Resources scheduled for change checks."
+)
+
+
+class ResourceMonitor:
+    """
+    Checks resources for changes on the event loop. Each resource has its own
+    next check time: the interval between checks grows by backoff (up to
+    max_interval) every time the resource is unchanged, and drops back to
+    min_interval when it changes, so that docs that are rarely edited are
+    rarely fetched. Failed checks are retried with the same backoff on top of
+    the resource's interval. At most max_concurrent_checks checks run at once.
+
+    The set of resources is reloaded every refresh_interval seconds, to pick
+    up resources added by new assessments.
+    """
+
+    def __init__(
+        self,
+        *,
+        load_resource_ids: t.Callable[[], t.Awaitable[t.Iterable[int]]],
+        check_resource: t.Callable[[int], t.Awaitable[bool]],
+        min_interval: float = 60,
+        max_interval: float = 24 * 60 * 60,
+        backoff: float = 2,
+        max_concurrent_checks: int = 4,
+        refresh_interval: float = 60,
+    ) -> None:
+        self._load_resource_ids = load_resource_ids
+        self._check_resource = check_resource
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._backoff = backoff
+        self._refresh_interval = refresh_interval
+        self._semaphore = asyncio.Semaphore(max_concurrent_checks)
+
+        # Check interval and consecutive failed checks per monitored resource, and a
+        # heap of (due time, resource id) holding one entry per resource that isn't
+        # being checked.
+        self._intervals: t.Dict[int, float] = {}
+        self._failures: t.Dict[int, int] = {}
+        self._schedule: t.List[t.Tuple[float, int]] = []
+        self._next_refresh = 0.0
+        self._tasks: t.Set[asyncio.Task] = set()
+        self._rescheduled = asyncio.Event()
+
+    async def run(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now >= self._next_refresh:
+                try:
+                    await self._refresh()
+                except Exception:
+                    logger.exception("Failed to load resources to monitor")
+                self._next_refresh = now + self._refresh_interval
+
+            if not self._schedule or self._schedule[0][0] > now:
+                next_due = self._schedule[0][0] if self._schedule else self._next_refresh
+                await self._sleep(min(next_due, self._next_refresh) - now)
+                continue
+
+            due, resource_id = heapq.heappop(self._schedule)
+            if resource_id not in self._intervals:
+                # The resource was removed since it was scheduled.
+                continue
+
+            # Wait for a free slot before starting the check, so that a backlog
+            # of due checks shows up as poll lag.
+            await self._semaphore.acquire()
+            POLL_LAG.observe(time.monotonic() - due)
+            task = asyncio.create_task(self._check(resource_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _sleep(self, seconds: float) -> None:
+        # Wake up early when a finished check reschedules its resource, its
+        # next check may be due before the one being waited for.
+        self._rescheduled.clear()
+        try:
+            await asyncio.wait_for(self._rescheduled.wait(), timeout=max(seconds, 0))
+        except asyncio.TimeoutError:
+            pass
+
+    async def _refresh(self) -> None:
+        resource_ids = set(await self._load_resource_ids())
+        now = time.monotonic()
+
+        for resource_id in resource_ids - set(self._intervals):
+            # Spread the first checks out, instead of fetching everything at once on start.
+            self._intervals[resource_id] = self._min_interval
+            heapq.heappush(
+                self._schedule, (now + random.uniform(0, self._min_interval), resource_id)
+            )
+
+        for resource_id in set(self._intervals) - resource_ids:
+            del self._intervals[resource_id]
+            self._failures.pop(resource_id, None)
+
+        RESOURCES_MONITORED.set(len(self._intervals))
+
+    async def _check(self, resource_id: int) -> None:
+        try:
+            with RESOURCE_CHECK_LATENCY.time():
+                changed = await self._check_resource(resource_id)
+        except Exception:
+            logger.exception(f"Failed to check resource {resource_id} for updates")
+            RESOURCE_CHECKS.inc(outcome="error")
+            changed = None
+        finally:
+            self._semaphore.release()
+
+        if resource_id not in self._intervals:
+            return
+
+        if changed is None:
+            # Back off from a failing resource, without changing its interval.
+            failures = self._failures.get(resource_id, 0) + 1
+            self._failures[resource_id] = failures
+            interval = self._intervals[resource_id]
+            delay = min(interval * self._backoff**failures, self._max_interval)
+        else:
+            self._failures.pop(resource_id, None)
+            if changed:
+                RESOURCE_CHECKS.inc(outcome="changed")
+                interval = self._min_interval
+            else:
+                RESOURCE_CHECKS.inc(outcome="unchanged")
+                interval = min(self._intervals[resource_id] * self._backoff, self._max_interval)
+            self._intervals[resource_id] = interval
+            delay = interval
+
+        # Jitter the next check, so that resources added together drift apart.
+        due = time.monotonic() + delay * random.uniform(0.9, 1.1)
+        heapq.heappush(self._schedule, (due, resource_id))
+        self._rescheduled.set()
+
+
+class BatchFetcher:
+    """
+    Coalesces fetches made concurrently, e.g. by the monitor's checks, into
+    batch fetches. fetch_many is a blocking function taking a list of keys
+    and returning {key: value}; it runs in the default executor. Keys it
+    leaves out resolve to None, and keys it maps to an exception raise it.
+    If fetch_many raises, all the fetches in the batch raise.
+    """
+
+    def __init__(
+        self,
+        fetch_many: t.Callable[[t.List[str]], t.Dict[str, t.Any]],
+        *,
+        max_batch_size: int = 50,
+        max_delay: float = 0.05,
+    ) -> None:
+        self._fetch_many = fetch_many
+        self._max_batch_size = max_batch_size
+        self._max_delay = max_delay
+        self._pending: t.Dict[str, t.List[asyncio.Future]] = {}
+        self._flush_handle: t.Optional[asyncio.TimerHandle] = None
+        self._tasks: t.Set[asyncio.Task] = set()
+
+    async def fetch(self, key: str) -> t.Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(key, []).append(future)
+
+        if len(self._pending) >= self._max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            # Wait briefly for other fetches to join the batch.
+            self._flush_handle = loop.call_later(self._max_delay, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        pending, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._run(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, pending: t.Dict[str, t.List[asyncio.Future]]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(None, self._fetch_many, list(pending))
+        except Exception as e:
+            for futures in pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        for key, futures in pending.items():
+            result = results.get(key)
+            for future in futures:
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
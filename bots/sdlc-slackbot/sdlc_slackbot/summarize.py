@@ -0,0 +1,104 @@
+import asyncio
+import typing as t
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# Boundaries to split text at, from the coarsest (paragraphs) to the finest (words).
+_SEPARATORS = ("\n\n", "\n", ". ", " ")
+
+
+def split_into_chunks(text: str, chunk_size: int) -> t.List[str]:
+    """
+    Splits the text into chunks of at most chunk_size characters, at the
+    coarsest boundary that fits: paragraphs first, then lines, sentences and
+    words. Consecutive pieces are packed into the same chunk, and joining the
+    chunks gives back the text.
+    """
+    chunks = []
+    current = ""
+    for piece in _split(text, chunk_size, 0):
+        if current and len(current) + len(piece) > chunk_size:
+            chunks.append(current)
+            current = ""
+        current += piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _split(text: str, chunk_size: int, level: int) -> t.List[str]:
+    if len(text) <= chunk_size:
+        return [text]
+    if level == len(_SEPARATORS):
+        return [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+    separator = _SEPARATORS[level]
+    parts = text.split(separator)
+    pieces = []
+    for i, part in enumerate(parts):
+        if i < len(parts) - 1:
+            part += separator
+        pieces.extend(_split(part, chunk_size, level + 1))
+    return pieces
+
+
+def allocate_budget(lengths: t.Dict[str, int], total: int) -> t.Dict[str, int]:
+    """
+    Splits the total budget between fields: fields shorter than an even share
+    keep their length, and what they leave unused is shared evenly by the
+    longer fields.
+    """
+    budgets = {}
+    remaining = dict(lengths)
+    while remaining:
+        share = max(total, 0) // len(remaining)
+        fitting = {name: length for name, length in remaining.items() if length <= share}
+        if not fitting:
+            budgets.update({name: share for name in remaining})
+            break
+        for name, length in fitting.items():
+            budgets[name] = length
+            total -= length
+            del remaining[name]
+    return budgets
+
+
+async def map_reduce_summarize(
+    text: str,
+    budget: int,
+    *,
+    summarize_chunk: t.Callable[[str], t.Awaitable[str]],
+    combine_summaries: t.Callable[[str, int], t.Awaitable[str]],
+    chunk_size: int,
+    max_levels: int = 4,
+) -> str:
+    """
+    Summarizes the text to fit in budget characters. The text is split into
+    chunks that are summarized concurrently, then consecutive summaries are
+    combined, level by level, until they fit. The callables are responsible
+    for capping their own concurrency.
+
+    Text that already fits is returned as is. If the summaries still don't
+    fit after max_levels combining rounds, they're returned as they are.
+    """
+    if len(text) <= budget:
+        return text
+
+    chunks = split_into_chunks(text, chunk_size)
+    logger.info(f"summarizing {len(text)} characters in {len(chunks)} chunks")
+    summaries = await asyncio.gather(*(summarize_chunk(chunk) for chunk in chunks))
+    summary = "\n\n".join(summaries)
+
+    for _ in range(max_levels):
+        if len(summary) <= budget:
+            break
+        groups = split_into_chunks(summary, chunk_size)
+        logger.info(f"combining {len(summary)} characters of summaries in {len(groups)} groups")
+        group_budget = max(budget // len(groups), 1)
+        summaries = await asyncio.gather(
+            *(combine_summaries(group, group_budget) for group in groups)
+        )
+        summary = "\n\n".join(summaries)
+
+    return summary
@@ -3,7 +3,7 @@ import os
 from logging import getLogger
 
 # import anthropic
-import openai
+from openai_slackbot.clients.llm import get_llm_client
 
 logger = getLogger(__name__)
 
@@ -57,9 +57,9 @@ def submit_block(action_id):
     )
 
 
-def ask_ai(prompt, context):
+async def ask_ai(prompt, context):
     # return ask_claude(prompt, context) # YOU CAN USE CLAUDE HERE
-    response = ask_gpt(prompt, context)
+    response = await ask_gpt(prompt, context)
 
     # Removing leading and trailing backticks and whitespace
     clean_response = response.strip("`\n ")
@@ -82,8 +82,9 @@ def ask_ai(prompt, context):
         return None
 
 
-def ask_gpt(prompt, context):
-    response = openai.chat.completions.create(
+async def ask_gpt(prompt, context):
+    response = await get_llm_client().chat_completion(
+        call_site="ask_gpt",
         model="gpt-4-32k",
         messages=[
             {"role": "system", "content": prompt},
@@ -0,0 +1,209 @@
+import asyncio
+import json
+from collections import Counter
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import bot
+import pytest
+from database import Assessment, Question, Resource
+from monitor import CONTENT_FETCHES
+from openai_slackbot.metrics import REGISTRY
+from peewee import SqliteDatabase
+
+
+@pytest.fixture
+def mock_config():
+    config = SimpleNamespace(
+        fetch_per_host_concurrency=2, fetch_timeout_seconds=1, fetch_deadline_seconds=1
+    )
+    # The config is loaded when the bot is run, and semaphores are kept per host across fetches
+    with patch("bot.config", config, create=True), patch.dict("bot.host_semaphores", clear=True):
+        yield config
+
+
+def mock_fetcher(delays=None, errors=()):
+    """
+    Returns a fetcher that fetches a url in delays[url] seconds, or raises for
+    the urls in errors, and the per-host peak of concurrent fetches.
+    """
+    delays = delays or {}
+    running = Counter()
+    peak = Counter()
+
+    async def fetch(url):
+        host = url.split("/")[2]
+        running[host] += 1
+        peak[host] = max(peak[host], running[host])
+        try:
+            await asyncio.sleep(delays.get(url, 0.01))
+            if url in errors:
+                raise ValueError(url)
+            return f"content of {url}"
+        finally:
+            running[host] -= 1
+
+    return fetch, peak
+
+
+async def test_fetch_all_per_host_concurrency(mock_config):
+    fetch, peak = mock_fetcher()
+    urls = [f"https://a.com/{i}" for i in range(5)] + [f"https://b.com/{i}" for i in range(3)]
+
+    with patch("bot.content_fetchers", [(lambda url: True, fetch)]):
+        contents = await bot.fetch_all(urls + urls[:2])
+
+    assert contents == {url: f"content of {url}" for url in urls}
+    assert peak == {"a.com": 2, "b.com": 2}
+
+
+async def test_fetch_all_drops_failed_and_timed_out_fetches(mock_config):
+    mock_config.fetch_timeout_seconds = 0.05
+    fetch, _ = mock_fetcher(delays={"https://a.com/slow": 1}, errors={"https://b.com/error"})
+
+    with patch("bot.content_fetchers", [(lambda url: True, fetch)]):
+        contents = await bot.fetch_all(
+            ["https://a.com/slow", "https://a.com/ok", "https://b.com/error", "https://b.com/ok"]
+        )
+
+    assert contents == {
+        "https://a.com/ok": "content of https://a.com/ok",
+        "https://b.com/ok": "content of https://b.com/ok",
+    }
+
+
+async def test_fetch_all_deadline(mock_config):
+    mock_config.fetch_per_host_concurrency = 1
+    mock_config.fetch_deadline_seconds = 0.1
+    fetch, _ = mock_fetcher(delays={f"https://a.com/{i}": 0.06 for i in range(3)})
+
+    with patch("bot.content_fetchers", [(lambda url: True, fetch)]):
+        contents = await bot.fetch_all([f"https://a.com/{i}" for i in range(3)])
+
+    # The second fetch is still running at the deadline, and the third one still waiting
+    assert contents == {"https://a.com/0": "content of https://a.com/0"}
+
+
+async def test_fetch_all_no_urls(mock_config):
+    assert await bot.fetch_all([]) == {}
+
+
+@pytest.fixture
+def resource(tmp_path):
+    # A database file rather than the in-memory one, since the bot queries it from
+    # executor threads, which each have their own connection.
+    database = SqliteDatabase(str(tmp_path / "sdlc.db"))
+    models = [Assessment, Question, Resource]
+    with database.bind_ctx(models):
+        database.create_tables(models)
+        assessment = Assessment.create(
+            project_name="project",
+            project_description="description",
+            point_of_contact="user",
+            risk=3,
+            confidence=8,
+            justification="justification",
+        )
+        yield Resource.create(
+            url="https://docs.google.com/document/d/doc1/edit",
+            content_hash=bot.hash_content("content"),
+            content="content",
+            revision_id="rev1",
+            assessment=assessment,
+        )
+    database.close()
+
+
+async def test_check_resource_unchanged_revision(resource):
+    skipped = CONTENT_FETCHES.get(result="skipped")
+
+    with patch("bot.fetch_revision", AsyncMock(return_value="rev1")), patch(
+        "bot.fetch_content", AsyncMock()
+    ) as mock_fetch_content:
+        assert not await bot.check_resource(resource.id)
+
+    # The content isn't downloaded when the revision hasn't moved
+    mock_fetch_content.assert_not_awaited()
+    assert CONTENT_FETCHES.get(result="skipped") == skipped + 1
+
+
+async def test_check_resource_changed_revision_same_content(resource):
+    fetched = CONTENT_FETCHES.get(result="fetched")
+
+    with patch("bot.fetch_revision", AsyncMock(return_value="rev2")), patch(
+        "bot.fetch_content", AsyncMock(return_value="content")
+    ) as mock_fetch_content, patch("bot.ask_ai", AsyncMock()) as mock_ask_ai:
+        assert not await bot.check_resource(resource.id)
+
+    # The revision moved without the content changing, e.g. a formatting change
+    mock_fetch_content.assert_awaited_once_with(resource.url)
+    mock_ask_ai.assert_not_awaited()
+    assert CONTENT_FETCHES.get(result="fetched") == fetched + 1
+    assert Resource.get_by_id(resource.id).revision_id == "rev2"
+
+
+async def test_check_resource_changed_content(resource):
+    config = SimpleNamespace(base_prompt="base ", update_prompt="update")
+    new_response = {
+        "outcome": "decision",
+        "risk": 8,
+        "confidence": 7,
+        "justification": "new justification",
+    }
+
+    with patch("bot.config", config, create=True), patch(
+        "bot.fetch_revision", AsyncMock(return_value="rev2")
+    ), patch("bot.fetch_content", AsyncMock(return_value="new content")), patch(
+        "bot.ask_ai", AsyncMock(return_value=new_response)
+    ) as mock_ask_ai, patch(
+        "bot.send_update_notification", AsyncMock()
+    ) as mock_send_update_notification:
+        assert await bot.check_resource(resource.id)
+
+    # The project is re-assessed from the previous and the new content
+    prompt, context = mock_ask_ai.await_args.args
+    assert prompt == "base update"
+    assert json.loads(context) == {
+        "previous_context": "content",
+        "previous_decision": {"risk": 3, "confidence": 8, "justification": "justification"},
+        "new_context": "new content",
+    }
+
+    resource = Resource.get_by_id(resource.id)
+    assert (resource.content, resource.revision_id) == ("new content", "rev2")
+    assert resource.content_hash == bot.hash_content("new content")
+    assessment = Assessment.get_by_id(resource.assessment_id)
+    assert (assessment.risk, assessment.confidence) == (8, 7)
+
+    project, response = mock_send_update_notification.await_args.args
+    assert project["project_name"] == "project"
+    assert response == new_response
+
+
+async def test_main_serves_monitor_metrics():
+    config = SimpleNamespace(
+        openai_organization_id="org",
+        monitor_min_interval_seconds=60,
+        monitor_max_interval_seconds=3600,
+        monitor_backoff=2,
+        monitor_max_concurrent_checks=4,
+    )
+
+    with patch("bot.config", config, create=True), patch(
+        "bot.init_bot", AsyncMock(return_value=MagicMock())
+    ), patch("bot.start_app", AsyncMock()), patch("bot.ResourceMonitor") as mock_monitor, patch(
+        "bot.start_metrics_server", AsyncMock()
+    ) as mock_start_metrics_server:
+        mock_monitor.return_value.run = AsyncMock()
+        await bot.main("templates")
+
+    mock_start_metrics_server.assert_awaited_once()
+    metrics = REGISTRY.render()
+    for name in [
+        "sdlc_slackbot_resource_poll_lag_seconds",
+        "sdlc_slackbot_resource_checks_total",
+        "sdlc_slackbot_resource_check_duration_seconds",
+        "sdlc_slackbot_resource_content_fetches_total",
+        "sdlc_slackbot_resources_monitored",
+    ]:
+        assert f"# TYPE {name} " in metrics
@@ -0,0 +1,123 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import gdoc
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+from monitor import BatchFetcher
+
+
+def http_error(status=404):
+    return HttpError(httplib2.Response({"status": status}), b"error")
+
+
+def paragraph(text):
+    return [{"paragraph": {"elements": [{"textRun": {"content": text}}]}}]
+
+
+class FakeBatch:
+    """Answers each request added to the batch from `documents`, when executed."""
+
+    def __init__(self, service, callback):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, request_id):
+        self._requests.append(request_id)
+
+    def execute(self, http=None):
+        self._service.batches.append(self._requests)
+        for request_id in self._requests:
+            document = self._service.documents_by_id.get(request_id)
+            if isinstance(document, Exception):
+                self._callback(request_id, None, document)
+            else:
+                self._callback(request_id, document, None)
+
+
+@pytest.fixture
+def docs_client():
+    service = MagicMock()
+    service.batches = []
+    service.documents_by_id = {
+        "doc1": {"revisionId": "rev1", "body": {"content": paragraph("one")}},
+        "doc2": {"revisionId": "rev2", "body": {"content": paragraph("two")}},
+        "missing": http_error(),
+    }
+    service.new_batch_http_request.side_effect = lambda callback: FakeBatch(service, callback)
+
+    client = gdoc.DocsClient()
+    with patch.object(client, "service", return_value=service), patch.object(
+        client, "_http"
+    ), patch("gdoc.get_docs_client", return_value=client):
+        yield service
+
+
+def test_get_documents(docs_client):
+    with patch("gdoc.BATCH_SIZE", 2):
+        documents = gdoc.get_docs_client().get_documents(
+            ["doc1", "doc2", "doc1", "missing"], fields="revisionId"
+        )
+
+    assert documents["doc1"]["revisionId"] == "rev1"
+    assert documents["doc2"]["revisionId"] == "rev2"
+    assert isinstance(documents["missing"], HttpError)
+    # Repeated documents are only fetched once, in batches of up to BATCH_SIZE
+    assert docs_client.batches == [["doc1", "doc2"], ["missing"]]
+
+
+def test_gdoc_revisions(docs_client):
+    revisions = gdoc.gdoc_revisions(
+        [
+            "https://docs.google.com/document/d/doc1/edit",
+            "https://docs.google.com/document/d/missing/edit",
+            "https://example.com/doc2",
+        ]
+    )
+
+    assert revisions["https://docs.google.com/document/d/doc1/edit"] == "rev1"
+    assert isinstance(revisions["https://docs.google.com/document/d/missing/edit"], HttpError)
+    assert "https://example.com/doc2" not in revisions
+
+
+def test_gdoc_revisions_batch_failed(docs_client):
+    error = http_error(500)
+    docs_client.new_batch_http_request.side_effect = error
+
+    revisions = gdoc.gdoc_revisions(["https://docs.google.com/document/d/doc1/edit"])
+
+    assert revisions == {"https://docs.google.com/document/d/doc1/edit": error}
+
+
+async def test_batched_revision_fetches(docs_client):
+    fetcher = BatchFetcher(gdoc.gdoc_revisions)
+
+    results = await asyncio.gather(
+        fetcher.fetch("https://docs.google.com/document/d/doc1/edit"),
+        fetcher.fetch("https://docs.google.com/document/d/doc2/edit"),
+        fetcher.fetch("https://docs.google.com/document/d/missing/edit"),
+        return_exceptions=True,
+    )
+
+    # The concurrent fetches share a batch request, and only the missing document's fails
+    assert docs_client.batches == [["doc1", "doc2", "missing"]]
+    assert results[:2] == ["rev1", "rev2"]
+    assert isinstance(results[2], HttpError)
+
+
+async def test_batched_content_fetches(docs_client):
+    fetcher = BatchFetcher(gdoc.gdoc_get_many)
+
+    results = await asyncio.gather(
+        fetcher.fetch("https://docs.google.com/document/d/doc1/edit"),
+        fetcher.fetch("https://docs.google.com/document/d/missing/edit"),
+        fetcher.fetch("https://docs.google.com/document/d/doc2/edit"),
+        return_exceptions=True,
+    )
+
+    assert docs_client.batches == [["doc1", "missing", "doc2"]]
+    assert results[0] == "one"
+    assert isinstance(results[1], HttpError)
+    assert results[2] == "two"
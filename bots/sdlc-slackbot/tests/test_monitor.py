@@ -0,0 +1,210 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from monitor import RESOURCE_CHECKS, BatchFetcher, ResourceMonitor
+
+
+class FakeClock:
+    """Simulated time for the monitor, which only moves while the monitor sleeps."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep_for(self, monitor):
+        async def sleep(seconds):
+            # Let the running checks finish first, a check that reschedules its
+            # resource wakes the monitor up without the time moving.
+            monitor._rescheduled.clear()
+            for _ in range(5):
+                await asyncio.sleep(0)
+            if not monitor._rescheduled.is_set():
+                self.now += max(seconds, 0)
+
+        return sleep
+
+
+@pytest.fixture
+def clock():
+    clock = FakeClock()
+    # Check resources at the middle of their (jittered) interval
+    with patch("monitor.time", clock), patch("monitor.random.uniform", lambda a, b: (a + b) / 2):
+        yield clock
+
+
+async def run_monitor(clock, *, checks, load_resource_ids=None, results=None, **kwargs):
+    """
+    Runs a monitor of resource 1 until `checks` checks were made, and returns
+    the (time, resource id) of each check.
+    """
+    checked = []
+    done = asyncio.Event()
+    results = iter(results or [])
+
+    async def check_resource(resource_id):
+        checked.append((clock.now, resource_id))
+        if len(checked) == checks:
+            done.set()
+        result = next(results, False)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monitor = ResourceMonitor(
+        load_resource_ids=load_resource_ids or AsyncMock(return_value=[1]),
+        check_resource=check_resource,
+        **{
+            "min_interval": 10,
+            "max_interval": 40,
+            "backoff": 2,
+            "refresh_interval": 1000,
+            **kwargs,
+        },
+    )
+    monitor._sleep = clock.sleep_for(monitor)
+    task = asyncio.create_task(monitor.run())
+    try:
+        await asyncio.wait_for(done.wait(), timeout=5)
+    finally:
+        task.cancel()
+    return checked
+
+
+async def test_unchanged_resource_interval_grows(clock):
+    checked = await run_monitor(clock, checks=5)
+
+    # The first check is spread over min_interval, then the interval doubles up to max_interval
+    assert checked == [(5, 1), (25, 1), (65, 1), (105, 1), (145, 1)]
+
+
+async def test_changed_resource_interval_resets(clock):
+    checked = await run_monitor(clock, checks=5, results=[False, False, True, False])
+
+    assert checked == [(5, 1), (25, 1), (65, 1), (75, 1), (95, 1)]
+
+
+async def test_failed_checks_back_off(clock):
+    errors = RESOURCE_CHECKS.get(outcome="error")
+
+    checked = await run_monitor(
+        clock,
+        checks=5,
+        results=[False, Exception("error"), Exception("error"), False],
+        max_interval=80,
+    )
+
+    # Failures back off from the resource's interval, which is kept once checks succeed
+    assert checked == [(5, 1), (25, 1), (65, 1), (145, 1), (185, 1)]
+    assert RESOURCE_CHECKS.get(outcome="error") == errors + 2
+
+
+async def test_failed_checks_back_off_up_to_max_interval(clock):
+    checked = await run_monitor(clock, checks=4, results=[Exception("error")] * 4)
+
+    assert checked == [(5, 1), (25, 1), (65, 1), (105, 1)]
+
+
+async def test_resources_added_after_start(clock):
+    load_resource_ids = AsyncMock(side_effect=[[1], [1, 2], [2]])
+
+    checked = await run_monitor(
+        clock,
+        checks=11,
+        load_resource_ids=load_resource_ids,
+        results=[True] * 11,
+        refresh_interval=30,
+    )
+
+    # Resource 2 is added by the reload at 30 seconds, and resource 1 is removed by
+    # the one at 60 seconds.
+    assert checked == [
+        (5, 1),
+        (15, 1),
+        (25, 1),
+        (35, 1),
+        (35, 2),
+        (45, 1),
+        (45, 2),
+        (55, 1),
+        (55, 2),
+        (65, 2),
+        (75, 2),
+    ]
+
+
+async def test_max_concurrent_checks(clock):
+    running = 0
+    max_running = 0
+    release = asyncio.Event()
+    started = asyncio.Event()
+
+    async def check_resource(resource_id):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        if running == 2:
+            started.set()
+        await release.wait()
+        running -= 1
+        return False
+
+    monitor = ResourceMonitor(
+        load_resource_ids=AsyncMock(return_value=[1, 2, 3]),
+        check_resource=check_resource,
+        min_interval=10,
+        max_concurrent_checks=2,
+    )
+    monitor._sleep = clock.sleep_for(monitor)
+    task = asyncio.create_task(monitor.run())
+
+    await asyncio.wait_for(started.wait(), timeout=5)
+    for _ in range(10):
+        await asyncio.sleep(0)
+    # The third check waits for a free slot
+    assert running == 2
+
+    release.set()
+    for _ in range(10):
+        await asyncio.sleep(0)
+    task.cancel()
+    assert max_running == 2
+    assert running == 0
+
+
+async def test_batch_fetcher_batches_concurrent_fetches():
+    fetch_many = MagicMock(side_effect=lambda keys: {key: key.upper() for key in keys})
+    fetcher = BatchFetcher(fetch_many)
+
+    results = await asyncio.gather(fetcher.fetch("a"), fetcher.fetch("b"), fetcher.fetch("a"))
+
+    assert results == ["A", "B", "A"]
+    fetch_many.assert_called_once_with(["a", "b"])
+
+
+async def test_batch_fetcher_max_batch_size():
+    fetch_many = MagicMock(side_effect=lambda keys: {key: key.upper() for key in keys})
+    fetcher = BatchFetcher(fetch_many, max_batch_size=2)
+
+    results = await asyncio.gather(*(fetcher.fetch(key) for key in "abc"))
+
+    assert results == ["A", "B", "C"]
+    assert fetch_many.call_args_list == [((["a", "b"],),), ((["c"],),)]
+
+
+async def test_batch_fetcher_errors():
+    error = ValueError("b")
+    fetcher = BatchFetcher(MagicMock(return_value={"a": "A", "b": error}))
+
+    # An error only fails the fetches of its key, and missing keys resolve to None
+    results = await asyncio.gather(
+        fetcher.fetch("a"), fetcher.fetch("b"), fetcher.fetch("c"), return_exceptions=True
+    )
+    assert results == ["A", error, None]
+
+    # If the whole batch fails, all of its fetches fail
+    fetcher = BatchFetcher(MagicMock(side_effect=error))
+    results = await asyncio.gather(fetcher.fetch("a"), fetcher.fetch("b"), return_exceptions=True)
+    assert results == [error, error]
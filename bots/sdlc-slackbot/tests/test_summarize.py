@@ -0,0 +1,92 @@
+from unittest.mock import AsyncMock
+
+import pytest
+from summarize import allocate_budget, map_reduce_summarize, split_into_chunks
+
+TEXT = (
+    "First paragraph. It has two sentences.\n\n"
+    "Second paragraph, on one line.\nAnd a second line, "
+    "with a few more words than the others."
+)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 16, 40, 80, len(TEXT), len(TEXT) + 1])
+def test_split_into_chunks_round_trip(chunk_size):
+    chunks = split_into_chunks(TEXT, chunk_size)
+
+    assert "".join(chunks) == TEXT
+    assert all(0 < len(chunk) <= chunk_size for chunk in chunks)
+
+
+def test_split_into_chunks_prefers_coarse_boundaries():
+    assert split_into_chunks("one two.\n\nthree four.", 12) == ["one two.\n\n", "three four."]
+
+
+def test_split_into_chunks_long_word():
+    chunks = split_into_chunks("short " + "x" * 25 + " end", 10)
+
+    assert chunks == ["short ", "x" * 10, "x" * 10, "x" * 5 + " end"]
+
+
+@pytest.mark.parametrize(
+    "lengths, total, expected",
+    [
+        # Short fields keep their length, the rest is split evenly between long fields
+        ({"a": 10, "b": 100, "c": 200}, 150, {"a": 10, "b": 70, "c": 70}),
+        ({"a": 10, "b": 20}, 100, {"a": 10, "b": 20}),
+        ({"a": 40, "b": 60}, 60, {"a": 30, "b": 30}),
+        ({"a": 0, "b": 5}, 0, {"a": 0, "b": 0}),
+        ({"a": 10, "b": 20}, 0, {"a": 0, "b": 0}),
+        ({"a": 10, "b": 20}, -5, {"a": 0, "b": 0}),
+        ({}, 100, {}),
+    ],
+)
+def test_allocate_budget(lengths, total, expected):
+    assert allocate_budget(lengths, total) == expected
+
+
+async def test_map_reduce_summarize_fits():
+    summarize_chunk = AsyncMock()
+
+    summary = await map_reduce_summarize(
+        "short", 10, summarize_chunk=summarize_chunk, combine_summaries=AsyncMock(), chunk_size=4
+    )
+
+    assert summary == "short"
+    summarize_chunk.assert_not_awaited()
+
+
+async def test_map_reduce_summarize():
+    summarize_chunk = AsyncMock(side_effect=lambda chunk: chunk[:3])
+    combine_summaries = AsyncMock(return_value="sum")
+
+    summary = await map_reduce_summarize(
+        "x" * 100,
+        5,
+        summarize_chunk=summarize_chunk,
+        combine_summaries=combine_summaries,
+        chunk_size=50,
+    )
+
+    assert summary == "sum"
+    assert summarize_chunk.await_count == 2
+    combine_summaries.assert_awaited_once_with("xxx\n\nxxx", 5)
+
+
+async def test_map_reduce_summarize_max_levels():
+    # Summaries that never get shorter are combined max_levels times, then returned
+    summarize_chunk = AsyncMock(return_value="x" * 40)
+    combine_summaries = AsyncMock(return_value="y" * 40)
+
+    summary = await map_reduce_summarize(
+        "z" * 100,
+        10,
+        summarize_chunk=summarize_chunk,
+        combine_summaries=combine_summaries,
+        chunk_size=50,
+        max_levels=3,
+    )
+
+    assert summary == "y" * 40 + "\n\n" + "y" * 40
+    # Two groups per level
+    assert combine_summaries.await_count == 6
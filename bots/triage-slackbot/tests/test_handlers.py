@@ -1,5 +1,5 @@
 import json
-from unittest.mock import call, patch
+from unittest.mock import MagicMock, call
 
 import pytest
 from triage_slackbot.handlers import (
@@ -7,27 +7,19 @@ from triage_slackbot.handlers import (
     InboundRequestHandler,
     InboundRequestRecategorizeHandler,
 )
-from triage_slackbot.openai_utils import openai
 
 
 def get_mock_chat_completion_response(category: str):
     category_args = json.dumps({"category": category})
-    return {
-        "choices": [
-            {
-                "message": {
-                    "function_call": {
-                        "arguments": category_args,
-                    }
-                }
-            }
-        ]
-    }
+    response = MagicMock()
+    response.choices[0].message.function_call.arguments = category_args
+    return response
 
 
-def assert_chat_completion_called(mock_chat_completion, mock_config):
-    mock_chat_completion.create.assert_called_once_with(
-        model="gpt-4-32k-0613",
+def assert_chat_completion_called(mock_llm_client, mock_config):
+    mock_llm_client.chat_completion.assert_awaited_once_with(
+        call_site="get_predicted_category",
+        model="gpt-4-32k",
         messages=[
             {
                 "role": "system",
@@ -58,22 +50,21 @@ def assert_chat_completion_called(mock_chat_completion, mock_config):
     )
 
 
-@patch.object(openai, "ChatCompletion")
 async def test_inbound_request_handler_handle(
-    mock_chat_completion,
+    mock_llm_client,
     mock_config,
     mock_slack_client,
     mock_inbound_request,
 ):
     # Setup mocks
-    mock_chat_completion.create.return_value = get_mock_chat_completion_response("appsec")
+    mock_llm_client.chat_completion.return_value = get_mock_chat_completion_response("appsec")
 
     # Call handler
     handler = InboundRequestHandler(mock_slack_client)
     await handler.maybe_handle(mock_inbound_request)
 
     # Assert that handler calls OpenAI API
-    assert_chat_completion_called(mock_chat_completion, mock_config)
+    assert_chat_completion_called(mock_llm_client, mock_config)
 
     mock_slack_client._client.assert_has_calls(
         [
@@ -221,15 +212,14 @@ async def test_inbound_request_handler_handle(
     )
 
 
-@patch.object(openai, "ChatCompletion")
 async def test_inbound_request_handler_handle_autorespond(
-    mock_chat_completion,
+    mock_llm_client,
     mock_config,
     mock_slack_client,
     mock_inbound_request,
 ):
     # Setup mocks
-    mock_chat_completion.create.return_value = get_mock_chat_completion_response(
+    mock_llm_client.chat_completion.return_value = get_mock_chat_completion_response(
         "physical_security"
     )
 
@@ -238,7 +228,7 @@ async def test_inbound_request_handler_handle_autorespond(
     await handler.maybe_handle(mock_inbound_request)
 
     # Assert that handler calls OpenAI API
-    assert_chat_completion_called(mock_chat_completion, mock_config)
+    assert_chat_completion_called(mock_llm_client, mock_config)
 
     mock_slack_client._client.assert_has_calls(
         [
@@ -530,12 +520,11 @@ async def test_inbound_request_recategorize_to_other_category_handler(
         {"thread_ts": "t0"},
     ],
 )
-@patch.object(openai, "ChatCompletion")
 async def test_inbound_request_handler_skip_handle(
-    mock_chat_completion, event_args_override, mock_slack_client, mock_inbound_request
+    mock_llm_client, event_args_override, mock_slack_client, mock_inbound_request
 ):
     mock_inbound_request.event = {**mock_inbound_request.event, **event_args_override}
     handler = InboundRequestHandler(mock_slack_client)
 
     await handler.maybe_handle(mock_inbound_request)
-    mock_chat_completion.create.assert_not_called()
+    mock_llm_client.chat_completion.assert_not_called()
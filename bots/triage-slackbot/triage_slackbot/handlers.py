@@ -237,7 +237,7 @@ class InboundRequestHandlerMixin(BaseHandler):
             blocks=blocks,
         )
         message_link = await self._slack_client.get_message_link(
-            channel=message.channel, message_ts=message.ts
+            channel=message.channel, message_ts=message.ts, thread_ts=inbound_message_ts
         )
 
         # Post an update to the feed channel.
@@ -272,7 +272,9 @@ class InboundRequestHandler(BaseMessageHandler, InboundRequestHandlerMixin):
         predicted_category = await self._predict_category(text)
         logger.info(f"Predicted category: {predicted_category}", extra=logging_extra)
 
-        message_link = await self._slack_client.get_message_link(channel=channel, message_ts=ts)
+        message_link = await self._slack_client.get_message_link(
+            channel=channel, message_ts=ts, thread_ts=event.get("thread_ts")
+        )
         feed_message = await self._update_feed(
             predicted_category=predicted_category,
             message_channel=channel,
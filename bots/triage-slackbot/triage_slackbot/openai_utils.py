@@ -1,7 +1,7 @@
 import json
 from functools import cache
 
-import openai
+from openai_slackbot.clients.llm import get_llm_client
 from triage_slackbot.category import OTHER_KEY, RequestCategory
 from triage_slackbot.config import get_config
 
@@ -42,7 +42,8 @@ async def get_predicted_category(inbound_request_content: str) -> str:
     ]
 
     # Call the API
-    response = openai.chat.completions.create(
+    response = await get_llm_client().chat_completion(
+        call_site="get_predicted_category",
         model="gpt-4-32k",
         messages=messages,
         temperature=0,
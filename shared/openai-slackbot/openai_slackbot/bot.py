@@ -1,9 +1,15 @@
 import typing as t
 from logging import getLogger
 
-import openai
+from openai_slackbot.clients.llm import init_llm_client
 from openai_slackbot.clients.slack import SlackClient
-from openai_slackbot.handlers import BaseActionHandler, BaseMessageHandler
+from openai_slackbot.handlers import (
+    BaseActionHandler,
+    BaseMessageHandler,
+    Dispatcher,
+    EventDeduplicator,
+)
+from openai_slackbot.metrics import start_metrics_server
 from openai_slackbot.utils.envvars import string
 from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
 from slack_bolt.app.async_app import AsyncApp
@@ -17,13 +23,22 @@ async def register_app_handlers(
     message_handler: t.Type[BaseMessageHandler],
     action_handlers: t.List[t.Type[BaseActionHandler]],
     slack_client: SlackClient,
+    dispatcher: t.Optional[Dispatcher] = None,
+    deduplicator: t.Optional[EventDeduplicator] = None,
 ):
+    app.event("user_change")(slack_client.handle_user_change)
+
     if message_handler:
-        app.event("message")(message_handler(slack_client).maybe_handle)
+        handler = message_handler(slack_client)
+        handler.dispatcher = dispatcher
+        handler.deduplicator = deduplicator
+        app.event("message")(handler.maybe_handle)
 
     if action_handlers:
         for action_handler in action_handlers:
             handler = action_handler(slack_client)
+            handler.dispatcher = dispatcher
+            handler.deduplicator = deduplicator
             app.action(handler.action_id)(handler.maybe_handle)
 
 
@@ -33,24 +48,48 @@ async def init_bot(
     slack_message_handler: t.Type[BaseMessageHandler],
     slack_action_handlers: t.List[t.Type[BaseActionHandler]],
     slack_template_path: str,
+    slack_template_auto_reload: bool = False,
+    llm_max_concurrency: int = 8,
+    dispatcher_workers: int = 4,
+    dispatcher_max_queue_size: int = 100,
+    dedupe_db_path: t.Optional[str] = None,
+    on_startup: t.Optional[t.Callable[[SlackClient], t.Awaitable[None]]] = None,
 ):
     slack_bot_token = string("SLACK_BOT_TOKEN")
     openai_api_key = string("OPENAI_API_KEY")
 
-    # Init OpenAI API
-    openai.organization = openai_organization_id
-    openai.api_key = openai_api_key
+    # Init OpenAI API client shared by all handlers
+    init_llm_client(
+        api_key=openai_api_key,
+        organization=openai_organization_id,
+        max_concurrency=llm_max_concurrency,
+    )
 
     # Init slack bot
     app = AsyncApp(token=slack_bot_token)
-    slack_client = SlackClient(app.client, slack_template_path)
+    slack_client = SlackClient(
+        app.client, slack_template_path, template_auto_reload=slack_template_auto_reload
+    )
+    slack_client.load_templates()
+    await slack_client.initialize()
+
     await register_app_handlers(
         app=app,
         message_handler=slack_message_handler,
         action_handlers=slack_action_handlers,
         slack_client=slack_client,
+        dispatcher=Dispatcher(
+            num_workers=dispatcher_workers,
+            max_queue_size=dispatcher_max_queue_size,
+        ),
+        deduplicator=EventDeduplicator(sqlite_path=dedupe_db_path),
     )
 
+    # Let the bot start its own background work, e.g. job runners that post
+    # with the shared Slack client.
+    if on_startup is not None:
+        await on_startup(slack_client)
+
     return app
 
 
@@ -66,12 +105,30 @@ async def start_bot(
     slack_message_handler: t.Type[BaseMessageHandler],
     slack_action_handlers: t.List[t.Type[BaseActionHandler]],
     slack_template_path: str,
+    slack_template_auto_reload: bool = False,
+    llm_max_concurrency: int = 8,
+    dispatcher_workers: int = 4,
+    dispatcher_max_queue_size: int = 100,
+    dedupe_db_path: t.Optional[str] = None,
+    metrics_host: str = "127.0.0.1",
+    metrics_port: t.Optional[int] = 9464,
+    on_startup: t.Optional[t.Callable[[SlackClient], t.Awaitable[None]]] = None,
 ):
     app = await init_bot(
         openai_organization_id=openai_organization_id,
         slack_message_handler=slack_message_handler,
         slack_action_handlers=slack_action_handlers,
         slack_template_path=slack_template_path,
+        slack_template_auto_reload=slack_template_auto_reload,
+        llm_max_concurrency=llm_max_concurrency,
+        dispatcher_workers=dispatcher_workers,
+        dispatcher_max_queue_size=dispatcher_max_queue_size,
+        dedupe_db_path=dedupe_db_path,
+        on_startup=on_startup,
     )
 
+    # Serve Prometheus metrics, set metrics_port to None to disable it.
+    if metrics_port is not None:
+        await start_metrics_server(metrics_host, metrics_port)
+
     await start_app(app)
@@ -0,0 +1,83 @@
+import asyncio
+import typing as t
+from logging import getLogger
+
+import httpx
+import openai
+from openai_slackbot.metrics import LLM_ERRORS, LLM_LATENCY, LLM_TOKENS
+
+logger = getLogger(__name__)
+
+_LLM_CLIENT = None
+
+
+class LLMClient:
+    """
+    LLMClient wraps a single long-lived OpenAI AsyncOpenAI client that shares
+    a pooled keep-alive HTTP transport across all callers, and caps the number
+    of in-flight completions so a burst of events can't exhaust the pool.
+    """
+
+    def __init__(
+        self,
+        *,
+        api_key: str,
+        organization: t.Optional[str] = None,
+        max_concurrency: int = 8,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 60.0,
+        timeout: float = 120.0,
+    ) -> None:
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=timeout,
+        )
+        self._client = openai.AsyncOpenAI(
+            api_key=api_key,
+            organization=organization,
+            http_client=self._http_client,
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def chat_completion(self, call_site: str = "unknown", **kwargs) -> t.Any:
+        """
+        Creates a chat completion, waiting for a free slot if the concurrency cap
+        is reached. Latency, errors and token usage are recorded by call_site.
+        """
+        model = kwargs.get("model", "unknown")
+        async with self._semaphore:
+            try:
+                with LLM_LATENCY.time(call_site=call_site, model=model):
+                    response = await self._client.chat.completions.create(**kwargs)
+            except Exception:
+                LLM_ERRORS.inc(call_site=call_site, model=model)
+                raise
+
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            LLM_TOKENS.inc(usage.prompt_tokens, call_site=call_site, model=model, type="prompt")
+            LLM_TOKENS.inc(
+                usage.completion_tokens, call_site=call_site, model=model, type="completion"
+            )
+        return response
+
+    async def close(self) -> None:
+        await self._client.close()
+
+
+def init_llm_client(**kwargs) -> LLMClient:
+    global _LLM_CLIENT
+    _LLM_CLIENT = LLMClient(**kwargs)
+    return _LLM_CLIENT
+
+
+def get_llm_client() -> LLMClient:
+    global _LLM_CLIENT
+    if _LLM_CLIENT is None:
+        raise Exception("LLM client not initialized, call init_llm_client() first")
+    return _LLM_CLIENT
@@ -1,9 +1,20 @@
+import asyncio
+import contextlib
+import contextvars
+import copy
 import json
 import os
+import time
 import typing as t
+from collections import OrderedDict, defaultdict
 from logging import getLogger
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import ChainableUndefined, Environment, FileSystemLoader, meta
+from openai_slackbot.metrics import (
+    SLACK_API_ERRORS,
+    SLACK_API_LATENCY,
+    SLACK_RATE_LIMIT_WAIT,
+)
 from pydantic import BaseModel
 from slack_sdk.errors import SlackApiError
 from slack_sdk.web.async_client import AsyncWebClient
@@ -30,6 +41,275 @@ class CreateSlackMessageResponse(BaseModel):
     message: SlackMessage
 
 
+class UserDirectory:
+    """
+    UserDirectory is an in-memory cache of Slack user objects keyed by user ID,
+    with LRU eviction once it holds max_size users and a TTL after which
+    entries are considered stale and re-fetched.
+    """
+
+    def __init__(self, *, max_size: int = 10_000, ttl_seconds: float = 6 * 60 * 60) -> None:
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._users: t.OrderedDict[str, t.Tuple[float, t.Dict[str, t.Any]]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    @property
+    def full(self) -> bool:
+        return len(self._users) >= self._max_size
+
+    def get(self, user_id: str) -> t.Optional[t.Dict[str, t.Any]]:
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            del self._users[user_id]
+            return None
+
+        self._users.move_to_end(user_id)
+        return user
+
+    def put(self, user: t.Dict[str, t.Any]) -> None:
+        user_id = user["id"]
+        self._users[user_id] = (time.monotonic() + self._ttl_seconds, user)
+        self._users.move_to_end(user_id)
+        while len(self._users) > self._max_size:
+            self._users.popitem(last=False)
+
+
+# Requests per minute allowed for each Slack Web API rate limit tier,
+# see https://api.slack.com/apis/rate-limits.
+_TIER_REQUESTS_PER_MINUTE = {1: 1, 2: 20, 3: 50, 4: 100}
+
+_METHOD_TIERS = {
+    "auth_test": 4,
+    "chat_getPermalink": 4,
+    "chat_update": 3,
+    "conversations_history": 3,
+    "conversations_info": 3,
+    "conversations_replies": 3,
+    "reactions_add": 3,
+    "users_info": 4,
+    "users_list": 2,
+}
+
+# Number of channels whose Slack Connect status is cached.
+_SHARED_CHANNELS_MAX_SIZE = 1_000
+
+# Methods that are limited per channel rather than per workspace. chat.postMessage
+# allows about one message per second per channel, with short bursts.
+_PER_CHANNEL_METHODS = {"chat_postMessage": (1.0, 5)}
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    def reserve(self) -> float:
+        """Takes a token, and returns how long the caller has to wait before using it."""
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+        # Tokens can go negative, which queues callers in the order they reserved.
+        self._tokens -= 1
+        return max(0.0, -self._tokens / self._rate, self._paused_until - now)
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """
+    RateLimiter schedules Slack Web API calls using token buckets keyed by API
+    method, and by channel for methods that are limited per channel. Calls wait
+    for a token instead of failing, and a rate limited response pauses the
+    bucket for the Retry-After duration.
+    """
+
+    def __init__(self) -> None:
+        self._buckets: t.Dict[t.Tuple[str, t.Optional[str]], _TokenBucket] = {}
+
+        # Time spent waiting for a token and number of calls that had to wait, by method.
+        self.wait_seconds: t.DefaultDict[str, float] = defaultdict(float)
+        self.throttled_calls: t.DefaultDict[str, int] = defaultdict(int)
+
+        # Number of calls rejected by Slack with a 429, by method.
+        self.rate_limited_calls: t.DefaultDict[str, int] = defaultdict(int)
+
+    async def wait(self, method: str, channel: t.Optional[str] = None) -> None:
+        wait_seconds = self._bucket(method, channel).reserve()
+        if wait_seconds > 0:
+            self.wait_seconds[method] += wait_seconds
+            SLACK_RATE_LIMIT_WAIT.inc(wait_seconds, method=method)
+            self.throttled_calls[method] += 1
+            await asyncio.sleep(wait_seconds)
+
+    def pause(self, method: str, channel: t.Optional[str], retry_after: float) -> None:
+        self.rate_limited_calls[method] += 1
+        self._bucket(method, channel).pause(retry_after)
+
+    def _bucket(self, method: str, channel: t.Optional[str]) -> _TokenBucket:
+        if method in _PER_CHANNEL_METHODS:
+            key = (method, channel)
+            rate, capacity = _PER_CHANNEL_METHODS[method]
+        else:
+            key = (method, None)
+            requests_per_minute = _TIER_REQUESTS_PER_MINUTE[_METHOD_TIERS.get(method, 3)]
+            rate, capacity = requests_per_minute / 60, requests_per_minute
+
+        if key not in self._buckets:
+            self._buckets[key] = _TokenBucket(rate, capacity)
+        return self._buckets[key]
+
+
+# Read-only methods whose responses can be shared within a single event, and
+# methods that modify a channel, which invalidate its cached reads.
+_CACHEABLE_METHODS = {
+    "auth_test",
+    "chat_getPermalink",
+    "conversations_history",
+    "conversations_info",
+    "conversations_replies",
+    "users_info",
+}
+_WRITE_METHODS = {"chat_postMessage", "chat_update", "reactions_add"}
+
+_THREAD_PAGE_SIZE = 200
+
+
+class RequestCache:
+    """
+    RequestCache memoizes read-only Slack API calls for the lifetime of a single
+    event. Concurrent identical calls share a single in-flight request.
+    """
+
+    def __init__(self) -> None:
+        self._entries: t.Dict[t.Tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_call(
+        self, method: str, kwargs: t.Dict[str, t.Any], call: t.Callable[[], t.Awaitable[t.Any]]
+    ) -> t.Any:
+        key = (method, tuple(sorted(kwargs.items())))
+        future = self._entries.get(key)
+        if future is not None:
+            self.hits += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.ensure_future(call())
+        self._entries[key] = future
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            # Failed calls aren't cached, so that a later call can retry.
+            if self._entries.get(key) is future:
+                del self._entries[key]
+            raise
+
+    def invalidate(self, channel: t.Optional[str]) -> None:
+        for key in list(self._entries):
+            if dict(key[1]).get("channel") == channel:
+                del self._entries[key]
+
+
+_REQUEST_CACHE: contextvars.ContextVar[t.Optional[RequestCache]] = contextvars.ContextVar(
+    "slack_request_cache", default=None
+)
+
+
+@contextlib.contextmanager
+def request_cache_scope() -> t.Iterator[RequestCache]:
+    """Caches Slack reads made by the current context until the scope exits."""
+    cache = RequestCache()
+    token = _REQUEST_CACHE.set(cache)
+    try:
+        yield cache
+    finally:
+        _REQUEST_CACHE.reset(token)
+
+
+def _get_retry_after(e: SlackApiError) -> t.Optional[float]:
+    if getattr(e.response, "status_code", None) != 429:
+        return None
+    return float(e.response.headers.get("Retry-After", 1))
+
+
+class _ValidationUndefined(ChainableUndefined):
+    # Lets templates render without a context, so that their JSON can be validated.
+    def __call__(self, *args, **kwargs) -> "_ValidationUndefined":
+        return self
+
+
+class BlockTemplates:
+    """
+    BlockTemplates renders Slack blocks from the Jinja templates in template_path.
+    Templates are compiled once, and blocks rendered from templates that don't
+    reference any variables are parsed once and handed out as copies.
+    Partial templates, i.e. templates prefixed with "_", are only meant to be included.
+    """
+
+    def __init__(self, template_path: str, auto_reload: bool = False) -> None:
+        self._template_path = template_path
+        self._auto_reload = auto_reload
+        self._jinja = Environment(
+            loader=FileSystemLoader(template_path), auto_reload=auto_reload, cache_size=-1
+        )
+        self._constant: t.Dict[str, bool] = {}
+        self._constant_blocks: t.Dict[str, t.Any] = {}
+
+    def load(self) -> None:
+        """Compiles all templates, and raises if any of them doesn't render to valid JSON."""
+        validation_jinja = Environment(
+            loader=FileSystemLoader(self._template_path), undefined=_ValidationUndefined
+        )
+        for template_filename in self._jinja.list_templates(extensions=["j2"]):
+            self._jinja.get_template(template_filename)
+            if os.path.basename(template_filename).startswith("_"):
+                continue
+
+            rendered_template = validation_jinja.get_template(template_filename).render()
+            try:
+                json.loads(rendered_template)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Template {template_filename} is not valid JSON: {e}") from e
+
+    def render(self, template_filename: str, context: t.Dict) -> t.Any:
+        if not self._is_constant(template_filename):
+            return self._render(template_filename, context)
+
+        if template_filename not in self._constant_blocks:
+            self._constant_blocks[template_filename] = self._render(template_filename, {})
+        return copy.deepcopy(self._constant_blocks[template_filename])
+
+    def _render(self, template_filename: str, context: t.Dict) -> t.Any:
+        rendered_template = self._jinja.get_template(template_filename).render(context)
+        return json.loads(rendered_template)
+
+    def _is_constant(self, template_filename: str) -> bool:
+        # Templates may change on disk when auto reload is enabled, so don't memoize.
+        if self._auto_reload:
+            return False
+
+        if template_filename not in self._constant:
+            source, _, _ = self._jinja.loader.get_source(self._jinja, template_filename)
+            ast = self._jinja.parse(source)
+            variables = meta.find_undeclared_variables(ast)
+            includes = list(meta.find_referenced_templates(ast))
+            self._constant[template_filename] = not variables and not includes
+        return self._constant[template_filename]
+
+
 class SlackClient:
     """
     SlackClient wraps the Slack AsyncWebClient implementation and
@@ -37,19 +317,83 @@ class SlackClient:
     implementation.
     """
 
-    def __init__(self, client: AsyncWebClient, template_path: str) -> None:
+    def __init__(
+        self,
+        client: AsyncWebClient,
+        template_path: str,
+        user_directory: t.Optional[UserDirectory] = None,
+        template_auto_reload: bool = False,
+        rate_limiter: t.Optional[RateLimiter] = None,
+        max_rate_limited_retries: int = 5,
+    ) -> None:
         self._client = client
-        self._jinja = self._init_jinja(template_path)
+        self._rate_limiter = rate_limiter or RateLimiter()
+        self._max_rate_limited_retries = max_rate_limited_retries
+        self._templates = BlockTemplates(template_path, auto_reload=template_auto_reload)
+        self._user_directory = user_directory or UserDirectory()
+
+        # Learned once at startup, used to build message permalinks locally.
+        self._workspace_url: t.Optional[str] = None
+
+        # Whether a channel is shared with another workspace (Slack Connect),
+        # for the most recently used channels.
+        self._shared_channels: t.OrderedDict[str, bool] = OrderedDict()
 
-    async def get_message_link(self, **kwargs) -> str:
-        response = await self._client.chat_getPermalink(**kwargs)
+        # The startup user directory sync, kept so that the task isn't garbage collected.
+        self._user_sync_task: t.Optional[asyncio.Task] = None
+
+    async def initialize(self) -> None:
+        """
+        Warms up the client at startup. Failures are logged rather than raised,
+        since every lookup falls back to the Slack API.
+
+        The user directory is synced in the background, since paging through
+        users.list (a tier 2 method) can take a while in large workspaces.
+        """
+        try:
+            response = await self._call("auth_test")
+            self._workspace_url = response["url"]
+        except Exception as e:
+            logger.warning(f"Failed to get workspace URL: {e}")
+
+        self._user_sync_task = asyncio.create_task(self._sync_user_directory_at_startup())
+
+    async def _sync_user_directory_at_startup(self) -> None:
+        try:
+            synced = await self.sync_user_directory()
+            logger.info(f"Synced {synced} users to the user directory")
+        except Exception as e:
+            logger.warning(f"Failed to sync user directory: {e}")
+
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        return self._rate_limiter
+
+    async def get_message_link(
+        self, *, channel: str, message_ts: str, thread_ts: t.Optional[str] = None
+    ) -> str:
+        """
+        Builds the message permalink locally if the workspace URL is known. Thread replies
+        in Slack Connect channels fall back to chat.getPermalink, since the local format
+        isn't guaranteed to resolve for the other workspace.
+        """
+        is_reply = thread_ts is not None and thread_ts != message_ts
+        if self._workspace_url and not (is_reply and await self._is_shared_channel(channel)):
+            workspace_url = self._workspace_url.rstrip("/")
+            link = f"{workspace_url}/archives/{channel}/p{message_ts.replace('.', '')}"
+            if is_reply:
+                link += f"?thread_ts={thread_ts}&cid={channel}"
+            return link
+
+        response = await self._call("chat_getPermalink", channel=channel, message_ts=message_ts)
         if not response["ok"]:
             raise Exception(f"Failed to get Slack message link: {response['error']}")
         return response["permalink"]
 
     async def get_message(self, channel: str, ts: str) -> t.Optional[t.Dict[str, t.Any]]:
         """Follows: https://api.slack.com/messaging/retrieving."""
-        result = await self._client.conversations_history(
+        result = await self._call(
+            "conversations_history",
             channel=channel,
             inclusive=True,
             latest=ts,
@@ -58,7 +402,7 @@ class SlackClient:
         return result["messages"][0] if result["messages"] else None
 
     async def post_message(self, **kwargs) -> CreateSlackMessageResponse:
-        response = await self._client.chat_postMessage(**kwargs)
+        response = await self._call("chat_postMessage", **kwargs)
         if not response["ok"]:
             raise Exception(f"Failed to post Slack message: {response['error']}")
 
@@ -66,7 +410,7 @@ class SlackClient:
         return CreateSlackMessageResponse(**response.data)
 
     async def update_message(self, **kwargs) -> t.Dict[str, t.Any]:
-        response = await self._client.chat_update(**kwargs)
+        response = await self._call("chat_update", **kwargs)
         if not response["ok"]:
             raise Exception(f"Failed to update Slack message: {response['error']}")
 
@@ -75,7 +419,7 @@ class SlackClient:
 
     async def add_reaction(self, **kwargs) -> t.Dict[str, t.Any]:
         try:
-            response = await self._client.reactions_add(**kwargs)
+            response = await self._call("reactions_add", **kwargs)
         except SlackApiError as e:
             if e.response["error"] == "already_reacted":
                 return {}
@@ -84,28 +428,97 @@ class SlackClient:
         assert isinstance(response.data, dict)
         return response.data
 
-    async def get_thread_messages(self, channel: str, thread_ts: str) -> t.List[t.Dict[str, t.Any]]:
-        response = await self._client.conversations_replies(channel=channel, ts=thread_ts)
-        if not response["ok"]:
-            raise Exception(f"Failed to get thread messages: {response['error']}")
+    async def iter_thread_pages(
+        self,
+        channel: str,
+        thread_ts: str,
+        page_size: int = _THREAD_PAGE_SIZE,
+        max_pages: t.Optional[int] = None,
+    ) -> t.AsyncIterator[t.List[t.Dict[str, t.Any]]]:
+        """
+        Streams the messages in a thread one conversations.replies page at a
+        time, following next_cursor until the thread or max_pages runs out.
+        The first page starts with the thread's root message.
+        """
+        cursor = None
+        pages = 0
+        while max_pages is None or pages < max_pages:
+            response = await self._call(
+                "conversations_replies",
+                channel=channel,
+                ts=thread_ts,
+                limit=page_size,
+                cursor=cursor,
+            )
+            if not response["ok"]:
+                raise Exception(f"Failed to get thread messages: {response['error']}")
 
-        assert isinstance(response.data, dict)
-        return response.data["messages"]
+            pages += 1
+            yield response["messages"]
 
-    async def get_user_display_name(self, user_id: str) -> str:
-        response = await self._client.users_info(user=user_id)
+            cursor = (response.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                break
+
+    async def get_thread_messages(
+        self, channel: str, thread_ts: str, page_size: int = _THREAD_PAGE_SIZE
+    ) -> t.List[t.Dict[str, t.Any]]:
+        messages = []
+        async for page in self.iter_thread_pages(channel, thread_ts, page_size=page_size):
+            messages.extend(page)
+        return messages
+
+    async def get_user(self, user_id: str) -> t.Dict[str, t.Any]:
+        user = self._user_directory.get(user_id)
+        if user is not None:
+            return user
+
+        response = await self._call("users_info", user=user_id)
         if not response["ok"]:
             raise Exception(f"Failed to get user info: {response['error']}")
-        return response["user"]["profile"]["display_name"]
+
+        user = response["user"]
+        self._user_directory.put(user)
+        return user
+
+    async def get_user_display_name(self, user_id: str) -> str:
+        user = await self.get_user(user_id)
+        return user["profile"]["display_name"]
+
+    async def sync_user_directory(self, page_size: int = 200) -> int:
+        """Warms the user directory with a paginated users.list sync."""
+        synced = 0
+        cursor = None
+        while not self._user_directory.full:
+            response = await self._call("users_list", limit=page_size, cursor=cursor)
+            if not response["ok"]:
+                raise Exception(f"Failed to list users: {response['error']}")
+
+            for user in response["members"]:
+                self._user_directory.put(user)
+                synced += 1
+
+            cursor = response.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                break
+
+        return synced
+
+    async def handle_user_change(self, event: t.Dict[str, t.Any]) -> None:
+        """Keeps the user directory up to date, registered as the user_change event listener."""
+        self._user_directory.put(event["user"])
 
     async def get_original_blocks(self, thread_ts: str, channel: str) -> None:
         """Given a thread_ts, get original message block"""
-        response = await self._client.conversations_replies(
-            channel=channel,
-            ts=thread_ts,
-        )
+        # Within a request cache scope, read the first page of the full thread
+        # instead, so that it's shared with get_thread_messages.
+        page_size = 1 if _REQUEST_CACHE.get() is None else _THREAD_PAGE_SIZE
         try:
-            messages = response.get("messages", [])
+            messages = []
+            async for page in self.iter_thread_pages(
+                channel, thread_ts, page_size=page_size, max_pages=1
+            ):
+                messages = page
             if not messages:
                 raise ValueError(f"Error fetching original message for thread_ts {thread_ts}")
             blocks = messages[0].get("blocks")
@@ -115,10 +528,67 @@ class SlackClient:
         except Exception as e:
             logger.exception(f"Error fetching original message for thread_ts {thread_ts}: {e}")
 
-    def render_blocks_from_template(self, template_filename: str, context: t.Dict = {}) -> t.Any:
-        rendered_template = self._jinja.get_template(template_filename).render(context)
-        return json.loads(rendered_template)
+    async def _call(self, method: str, **kwargs) -> t.Any:
+        """
+        Calls a Slack Web API method, serving read-only methods from the
+        request cache when one is active.
+        """
+        cache = _REQUEST_CACHE.get()
+        if cache is None:
+            return await self._call_api(method, **kwargs)
+
+        if method in _CACHEABLE_METHODS:
+            return await cache.get_or_call(method, kwargs, lambda: self._call_api(method, **kwargs))
+
+        if method in _WRITE_METHODS:
+            cache.invalidate(kwargs.get("channel"))
+        return await self._call_api(method, **kwargs)
+
+    async def _call_api(self, method: str, **kwargs) -> t.Any:
+        """
+        Calls a Slack Web API method once the rate limiter allows it. Rate limited
+        calls are retried after Slack's Retry-After duration.
+        """
+        channel = kwargs.get("channel")
+        attempt = 0
+        while True:
+            await self._rate_limiter.wait(method, channel)
+            try:
+                with SLACK_API_LATENCY.time(method=method):
+                    return await getattr(self._client, method)(**kwargs)
+            except SlackApiError as e:
+                SLACK_API_ERRORS.inc(method=method, error=e.response.get("error", "unknown"))
+
+                retry_after = _get_retry_after(e)
+                if retry_after is None or attempt >= self._max_rate_limited_retries:
+                    raise e
+
+                logger.warning(f"Slack API method {method} rate limited, retry in {retry_after}s")
+                self._rate_limiter.pause(method, channel, retry_after)
+                attempt += 1
 
-    def _init_jinja(self, template_path: str):
-        templates_dir = os.path.join(template_path)
-        return Environment(loader=FileSystemLoader(templates_dir))
+    async def _is_shared_channel(self, channel: str) -> bool:
+        shared = self._shared_channels.get(channel)
+        if shared is not None:
+            self._shared_channels.move_to_end(channel)
+            return shared
+
+        try:
+            response = await self._call("conversations_info", channel=channel)
+        except Exception as e:
+            # Assume the worst so that links always resolve, and look it up again next time.
+            logger.warning(f"Failed to get channel info for {channel}: {e}")
+            return True
+
+        info = response["channel"]
+        shared = bool(info.get("is_ext_shared") or info.get("is_shared"))
+        self._shared_channels[channel] = shared
+        while len(self._shared_channels) > _SHARED_CHANNELS_MAX_SIZE:
+            self._shared_channels.popitem(last=False)
+        return shared
+
+    def load_templates(self) -> None:
+        self._templates.load()
+
+    def render_blocks_from_template(self, template_filename: str, context: t.Dict = {}) -> t.Any:
+        return self._templates.render(template_filename, context)
@@ -1,30 +1,222 @@
 import abc
+import asyncio
+import sqlite3
+import time
 import typing as t
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
 
-from openai_slackbot.clients.slack import SlackClient
+from openai_slackbot.clients.slack import SlackClient, request_cache_scope
+from openai_slackbot.metrics import (
+    DISPATCH_QUEUE_DEPTH,
+    HANDLER_EVENTS,
+    HANDLER_LATENCY,
+)
 
 logger = getLogger(__name__)
 
 
+class Dispatcher:
+    """
+    Dispatcher runs handler work on a fixed pool of workers fed by bounded
+    asyncio queues. Work is sharded by key (e.g. channel), so work items with
+    the same key are always processed in order by the same worker. Once the
+    total queue depth reaches the high-water mark, new work is shed.
+    """
+
+    def __init__(self, *, num_workers: int = 4, max_queue_size: int = 100) -> None:
+        self._num_workers = num_workers
+        self._max_queue_size = max_queue_size
+        self._queues: t.List[asyncio.Queue] = []
+        self._workers: t.List[asyncio.Task] = []
+        self._queue_depth = 0
+        self.shed_count = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue_depth
+
+    def submit(self, key: t.Optional[str], work: t.Callable[[], t.Awaitable[None]]) -> bool:
+        """Enqueues work, returns False if it was shed because the queue is full."""
+        self._maybe_start()
+
+        if self._queue_depth >= self._max_queue_size:
+            self.shed_count += 1
+            return False
+
+        self._queues[hash(key) % self._num_workers].put_nowait(work)
+        self._queue_depth += 1
+        DISPATCH_QUEUE_DEPTH.set(self._queue_depth)
+        return True
+
+    async def join(self) -> None:
+        """Waits until all submitted work has been processed."""
+        await asyncio.gather(*[queue.join() for queue in self._queues])
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._queues, self._workers = [], []
+
+    def _maybe_start(self) -> None:
+        # Workers are started lazily so that the dispatcher can be created
+        # outside of a running event loop.
+        if self._workers:
+            return
+
+        for _ in range(self._num_workers):
+            queue: asyncio.Queue = asyncio.Queue(maxsize=self._max_queue_size)
+            self._queues.append(queue)
+            self._workers.append(asyncio.get_running_loop().create_task(self._work(queue)))
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        while True:
+            work = await queue.get()
+            try:
+                await work()
+            except Exception:
+                logger.exception("Failed to run dispatched work")
+            finally:
+                self._queue_depth -= 1
+                DISPATCH_QUEUE_DEPTH.set(self._queue_depth)
+                queue.task_done()
+
+
+class EventDeduplicator:
+    """
+    EventDeduplicator remembers the ids of recently processed events, so that
+    events redelivered by Slack are dropped. Ids are kept in a bounded in-memory
+    TTL store, or in a SQLite file if a path is given so that they survive
+    restarts and can be shared between processes. SQLite queries run on a
+    dedicated thread, and expired ids are pruned every prune_interval_seconds.
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl_seconds: float = 60 * 60,
+        max_size: int = 10_000,
+        sqlite_path: t.Optional[str] = None,
+        prune_interval_seconds: float = 60,
+    ) -> None:
+        self._ttl_seconds = ttl_seconds
+        self._max_size = max_size
+        self._seen: t.OrderedDict[str, float] = OrderedDict()
+
+        self._db = None
+        self._executor = None
+        self._prune_interval_seconds = prune_interval_seconds
+        self._next_prune = 0.0
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, isolation_level=None, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS processed_events "
+                "(key TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+            )
+            self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def seen(self, key: str) -> bool:
+        """Records the key, returns True if it was already recorded and hasn't expired."""
+        if self._db is not None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._seen_sqlite, key)
+
+        now = time.monotonic()
+        expires_at = self._seen.get(key)
+        if expires_at is not None and expires_at > now:
+            return True
+
+        self._seen[key] = now + self._ttl_seconds
+        self._seen.move_to_end(key)
+        while len(self._seen) > self._max_size:
+            self._seen.popitem(last=False)
+        return False
+
+    def _seen_sqlite(self, key: str) -> bool:
+        # Wall clock time, since the file may be shared by other processes.
+        now = time.time()
+        if now >= self._next_prune:
+            self._db.execute("DELETE FROM processed_events WHERE expires_at <= ?", (now,))
+            self._next_prune = now + self._prune_interval_seconds
+
+        # Expired ids that weren't pruned yet are recorded again.
+        cursor = self._db.execute(
+            "INSERT INTO processed_events (key, expires_at) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at "
+            "WHERE processed_events.expires_at <= ?",
+            (key, now + self._ttl_seconds, now),
+        )
+        return cursor.rowcount == 0
+
+
 class BaseHandler(abc.ABC):
     def __init__(self, slack_client: SlackClient) -> None:
         self._slack_client = slack_client
 
+        # If set, events are acked right away and handled on the dispatcher's
+        # worker pool, otherwise they are handled inline.
+        self.dispatcher: t.Optional[Dispatcher] = None
+
+        # If set, events that were already processed are dropped.
+        self.deduplicator: t.Optional[EventDeduplicator] = None
+
     async def maybe_handle(self, args):
         await args.ack()
 
-        logging_extra = self.logging_extra(args)
-        try:
-            should_handle = await self.should_handle(args)
+        if await self._is_duplicate(args):
+            HANDLER_EVENTS.inc(handler=self.__class__.__name__, outcome="duplicate")
             logger.info(
-                f"Handler: {self.__class__.__name__}, should handle: {should_handle}",
-                extra=logging_extra,
+                f"Handler: {self.__class__.__name__}, dropping duplicate event",
+                extra=self.logging_extra(args),
+            )
+            return
+
+        if self.dispatcher is None:
+            await self._maybe_handle(args)
+            return
+
+        dispatched = self.dispatcher.submit(
+            self.dispatch_key(args), lambda: self._maybe_handle(args)
+        )
+        if not dispatched:
+            HANDLER_EVENTS.inc(handler=self.__class__.__name__, outcome="shed")
+            logger.warning(
+                f"Handler: {self.__class__.__name__}, dispatch queue is full, dropping event",
+                extra={**self.logging_extra(args), "queue_depth": self.dispatcher.queue_depth},
             )
-            if should_handle:
-                await self.handle(args)
-        except Exception:
-            logger.exception("Failed to handle event", extra=logging_extra)
+
+    async def _maybe_handle(self, args):
+        logging_extra = self.logging_extra(args)
+        handler_name = self.__class__.__name__
+
+        # Slack reads are cached for the lifetime of the event.
+        with request_cache_scope(), HANDLER_LATENCY.time(handler=handler_name):
+            try:
+                should_handle = await self.should_handle(args)
+                logger.info(
+                    f"Handler: {handler_name}, should handle: {should_handle}",
+                    extra=logging_extra,
+                )
+                if should_handle:
+                    await self.handle(args)
+                outcome = "handled" if should_handle else "skipped"
+            except Exception:
+                outcome = "error"
+                logger.exception("Failed to handle event", extra=logging_extra)
+
+        HANDLER_EVENTS.inc(handler=handler_name, outcome=outcome)
+
+    async def _is_duplicate(self, args) -> bool:
+        if self.deduplicator is None:
+            return False
+
+        key = self.dedupe_key(args)
+        if not isinstance(key, str):
+            return False
+
+        return await self.deduplicator.seen(f"{self.__class__.__name__}:{key}")
 
     @abc.abstractmethod
     async def should_handle(self, args) -> bool:
@@ -38,8 +230,24 @@ class BaseHandler(abc.ABC):
     def logging_extra(self, args) -> t.Dict[str, t.Any]:
         ...
 
+    @abc.abstractmethod
+    def dispatch_key(self, args) -> t.Optional[str]:
+        """Events with the same dispatch key are handled in order."""
+        ...
+
+    @abc.abstractmethod
+    def dedupe_key(self, args) -> t.Optional[str]:
+        """Identifies an event across Slack redeliveries."""
+        ...
+
 
 class BaseMessageHandler(BaseHandler):
+    def dispatch_key(self, args) -> t.Optional[str]:
+        return args.event.get("channel")
+
+    def dedupe_key(self, args) -> t.Optional[str]:
+        return args.body.get("event_id") or args.event.get("client_msg_id")
+
     def logging_extra(self, args) -> t.Dict[str, t.Any]:
         fields = {}
         for field in ["type", "subtype", "channel", "ts"]:
@@ -55,6 +263,12 @@ class BaseActionHandler(BaseHandler):
     async def should_handle(self, args) -> bool:
         return True
 
+    def dispatch_key(self, args) -> t.Optional[str]:
+        return (args.body.get("container") or {}).get("channel_id")
+
+    def dedupe_key(self, args) -> t.Optional[str]:
+        return args.body.get("trigger_id")
+
     def logging_extra(self, args) -> t.Dict[str, t.Any]:
         return {
             "action_type": args.body.get("type"),
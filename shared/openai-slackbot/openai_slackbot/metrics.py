@@ -0,0 +1,225 @@
+import abc
+import bisect
+import contextlib
+import threading
+import time
+import typing as t
+from logging import getLogger
+
+from aiohttp import web
+
+logger = getLogger(__name__)
+
+_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_LabelValues = t.Tuple[str, ...]
+
+
+class _Metric(abc.ABC):
+    type: str = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: t.Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: t.Dict[str, t.Any]) -> _LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {labels}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, values: _LabelValues, **extra: str) -> str:
+        pairs = list(zip(self.labelnames, values)) + list(extra.items())
+        if not pairs:
+            return ""
+        escaped = [
+            (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in pairs
+        ]
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    @abc.abstractmethod
+    def samples(self) -> t.List[str]:
+        pass
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: t.Dict[_LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def samples(self) -> t.List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in values]
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: t.Dict[_LabelValues, float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def samples(self) -> t.List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in values]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: t.Sequence[float] = _DEFAULT_BUCKETS, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._buckets = tuple(sorted(buckets))
+        # Per label set: non-cumulative bucket counts (the last one is +Inf), sum and count.
+        self._values: t.Dict[_LabelValues, t.Tuple[t.List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * (len(self._buckets) + 1), 0, 0)
+            counts[bisect.bisect_left(self._buckets, value)] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> t.Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def get_count(self, **labels) -> int:
+        value = self._values.get(self._label_values(labels))
+        return value[2] if value else 0
+
+    def samples(self) -> t.List[str]:
+        with self._lock:
+            values = [
+                (key, list(counts), total, count)
+                for key, (counts, total, count) in self._values.items()
+            ]
+
+        lines = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self._buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else str(bound)
+                lines.append(f"{self.name}_bucket{self._format_labels(key, le=le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """MetricsRegistry holds the bot's metrics and renders them in Prometheus text format."""
+
+    def __init__(self) -> None:
+        self._metrics: t.Dict[str, _Metric] = {}
+
+    def counter(self, name: str, documentation: str, labelnames: t.Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: t.Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: t.Sequence[str] = (),
+        buckets: t.Sequence[float] = _DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets=buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+    def _register(self, metric: _Metric) -> t.Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+
+REGISTRY = MetricsRegistry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    "slackbot_handler_duration_seconds", "Time spent handling an event.", ["handler"]
+)
+HANDLER_EVENTS = REGISTRY.counter(
+    "slackbot_handler_events_total",
+    "Events seen by a handler, by outcome (handled, skipped, error or shed).",
+    ["handler", "outcome"],
+)
+DISPATCH_QUEUE_DEPTH = REGISTRY.gauge(
+    "slackbot_dispatch_queue_depth", "Events waiting on the dispatcher's worker pool."
+)
+
+SLACK_API_LATENCY = REGISTRY.histogram(
+    "slackbot_slack_api_duration_seconds", "Slack Web API call latency.", ["method"]
+)
+SLACK_API_ERRORS = REGISTRY.counter(
+    "slackbot_slack_api_errors_total", "Failed Slack Web API calls.", ["method", "error"]
+)
+SLACK_RATE_LIMIT_WAIT = REGISTRY.counter(
+    "slackbot_slack_rate_limit_wait_seconds_total",
+    "Time Slack Web API calls spent waiting on the rate limiter.",
+    ["method"],
+)
+
+LLM_LATENCY = REGISTRY.histogram(
+    "slackbot_llm_duration_seconds", "Chat completion latency.", ["call_site", "model"]
+)
+LLM_ERRORS = REGISTRY.counter(
+    "slackbot_llm_errors_total", "Failed chat completions.", ["call_site", "model"]
+)
+LLM_TOKENS = REGISTRY.counter(
+    "slackbot_llm_tokens_total",
+    "Tokens used by chat completions, by type (prompt or completion).",
+    ["call_site", "model", "type"],
+)
+
+
+async def start_metrics_server(
+    host: str = "127.0.0.1", port: int = 9464, registry: MetricsRegistry = REGISTRY
+) -> web.AppRunner:
+    """Serves the registry's metrics at /metrics, returns the runner to clean it up."""
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
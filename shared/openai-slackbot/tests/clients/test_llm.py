@@ -0,0 +1,66 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from openai_slackbot.clients import llm
+from openai_slackbot.clients.llm import LLMClient, get_llm_client, init_llm_client
+from openai_slackbot.metrics import LLM_ERRORS, LLM_LATENCY, LLM_TOKENS
+
+
+async def test_chat_completion_concurrency_cap():
+    client = LLMClient(api_key="mock-key", max_concurrency=2)
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def create(**kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return kwargs["model"]
+
+    with patch.object(client._client.chat.completions, "create", side_effect=create):
+        results = await asyncio.gather(*[client.chat_completion(model=str(i)) for i in range(6)])
+
+    assert results == [str(i) for i in range(6)]
+    assert max_in_flight == 2
+    await client.close()
+
+
+async def test_get_llm_client_not_initialized():
+    with patch.object(llm, "_LLM_CLIENT", None):
+        with pytest.raises(Exception):
+            get_llm_client()
+
+
+async def test_init_llm_client():
+    with patch.object(llm, "_LLM_CLIENT", None):
+        client = init_llm_client(api_key="mock-key", organization="org-id")
+        assert get_llm_client() is client
+        await client.close()
+
+
+async def test_chat_completion_metrics():
+    client = LLMClient(api_key="mock-key")
+    usage = MagicMock(prompt_tokens=10, completion_tokens=5)
+    with patch.object(
+        client._client.chat.completions,
+        "create",
+        new=AsyncMock(return_value=MagicMock(usage=usage)),
+    ):
+        await client.chat_completion(call_site="mock_site", model="mock-model")
+
+    labels = {"call_site": "mock_site", "model": "mock-model"}
+    assert LLM_LATENCY.get_count(**labels) == 1
+    assert LLM_TOKENS.get(type="prompt", **labels) == 10
+    assert LLM_TOKENS.get(type="completion", **labels) == 5
+
+    with patch.object(
+        client._client.chat.completions, "create", new=AsyncMock(side_effect=Exception("failed"))
+    ):
+        with pytest.raises(Exception):
+            await client.chat_completion(call_site="mock_site", model="mock-model")
+    assert LLM_ERRORS.get(**labels) == 1
+    await client.close()
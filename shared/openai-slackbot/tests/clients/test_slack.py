@@ -1,7 +1,16 @@
-from unittest.mock import AsyncMock, MagicMock
+import asyncio
+import os
+import time
+from unittest.mock import AsyncMock, MagicMock, call, patch
 
 import pytest
-from openai_slackbot.clients.slack import CreateSlackMessageResponse
+from openai_slackbot.clients.slack import (
+    BlockTemplates,
+    CreateSlackMessageResponse,
+    RateLimiter,
+    UserDirectory,
+    request_cache_scope,
+)
 from slack_sdk.errors import SlackApiError
 
 
@@ -123,3 +132,330 @@ async def test_add_reaction_failed(mock_slack_client):
         await mock_slack_client.add_reaction(
             channel="channel", name="thumbsup", timestamp="timestamp"
         )
+
+
+async def test_get_user_display_name_cached(mock_slack_client):
+    mock_slack_client._client.users_info = AsyncMock(
+        return_value={"ok": True, "user": {"id": "U123", "profile": {"display_name": "name"}}}
+    )
+    assert await mock_slack_client.get_user_display_name("U123") == "name"
+    assert await mock_slack_client.get_user_display_name("U123") == "name"
+    mock_slack_client._client.users_info.assert_called_once_with(user="U123")
+
+
+async def test_sync_user_directory(mock_slack_client):
+    mock_slack_client._client.users_list = AsyncMock(
+        side_effect=[
+            {
+                "ok": True,
+                "members": [{"id": "U1", "profile": {"display_name": "one"}}],
+                "response_metadata": {"next_cursor": "cursor"},
+            },
+            {
+                "ok": True,
+                "members": [{"id": "U2", "profile": {"display_name": "two"}}],
+                "response_metadata": {"next_cursor": ""},
+            },
+        ]
+    )
+    mock_slack_client._client.users_info = AsyncMock()
+
+    assert await mock_slack_client.sync_user_directory(page_size=1) == 2
+    mock_slack_client._client.users_list.assert_has_calls(
+        [call(limit=1, cursor=None), call(limit=1, cursor="cursor")]
+    )
+
+    await mock_slack_client.handle_user_change(
+        {"type": "user_change", "user": {"id": "U2", "profile": {"display_name": "new"}}}
+    )
+    assert await mock_slack_client.get_user_display_name("U1") == "one"
+    assert await mock_slack_client.get_user_display_name("U2") == "new"
+    mock_slack_client._client.users_info.assert_not_called()
+
+
+async def test_initialize_syncs_user_directory_in_background(mock_slack_client, caplog):
+    mock_slack_client._client.auth_test = AsyncMock(
+        return_value={"ok": True, "url": "https://myorg.slack.com/"}
+    )
+    listed = asyncio.Event()
+
+    async def users_list(**kwargs):
+        await listed.wait()
+        return {"ok": False, "error": "ratelimited"}
+
+    mock_slack_client._client.users_list = users_list
+
+    # Startup doesn't wait for the sync
+    await mock_slack_client.initialize()
+    assert not mock_slack_client._user_sync_task.done()
+
+    # and its failure is logged
+    listed.set()
+    await mock_slack_client._user_sync_task
+    assert "Failed to sync user directory: Failed to list users: ratelimited" in caplog.text
+
+
+def test_user_directory_lru_and_ttl():
+    directory = UserDirectory(max_size=2, ttl_seconds=60)
+    directory.put({"id": "U1"})
+    directory.put({"id": "U2"})
+    assert directory.get("U1") == {"id": "U1"}
+
+    # U2 is the least recently used user, so it gets evicted.
+    directory.put({"id": "U3"})
+    assert directory.get("U2") is None
+    assert len(directory) == 2
+
+    with patch("openai_slackbot.clients.slack.time.monotonic", return_value=time.monotonic() + 61):
+        assert directory.get("U1") is None
+
+
+@pytest.mark.parametrize(
+    "thread_ts, expected_link",
+    [
+        (None, "https://myorg.slack.com/archives/C123456/p1234567890123456"),
+        (
+            "1234567890.000001",
+            "https://myorg.slack.com/archives/C123456/p1234567890123456"
+            "?thread_ts=1234567890.000001&cid=C123456",
+        ),
+    ],
+)
+async def test_get_message_link_local(mock_slack_client, thread_ts, expected_link):
+    mock_slack_client._client.auth_test = AsyncMock(
+        return_value={"ok": True, "url": "https://myorg.slack.com/"}
+    )
+    mock_slack_client._client.users_list = AsyncMock(return_value={"ok": True, "members": []})
+    mock_slack_client._client.conversations_info = AsyncMock(
+        return_value={"ok": True, "channel": {"id": "C123456", "is_ext_shared": False}}
+    )
+    mock_slack_client._client.chat_getPermalink = AsyncMock()
+    await mock_slack_client.initialize()
+
+    link = await mock_slack_client.get_message_link(
+        channel="C123456", message_ts="1234567890.123456", thread_ts=thread_ts
+    )
+    assert link == expected_link
+    mock_slack_client._client.chat_getPermalink.assert_not_called()
+
+
+async def test_get_message_link_shared_channel_thread_reply(mock_slack_client):
+    mock_slack_client._client.auth_test = AsyncMock(
+        return_value={"ok": True, "url": "https://myorg.slack.com/"}
+    )
+    mock_slack_client._client.users_list = AsyncMock(return_value={"ok": True, "members": []})
+    mock_slack_client._client.conversations_info = AsyncMock(
+        return_value={"ok": True, "channel": {"id": "C123456", "is_ext_shared": True}}
+    )
+    mock_slack_client._client.chat_getPermalink = AsyncMock(
+        return_value={"ok": True, "permalink": "https://myorg.slack.com/archives/C123456/p1"}
+    )
+    await mock_slack_client.initialize()
+
+    for _ in range(2):
+        link = await mock_slack_client.get_message_link(
+            channel="C123456", message_ts="1234567890.123456", thread_ts="1234567890.000001"
+        )
+        assert link == "https://myorg.slack.com/archives/C123456/p1"
+
+    mock_slack_client._client.conversations_info.assert_called_once_with(channel="C123456")
+    assert mock_slack_client._client.chat_getPermalink.call_count == 2
+
+
+async def test_shared_channel_lookups(mock_slack_client):
+    mock_slack_client._client.conversations_info = AsyncMock(
+        side_effect=[
+            Exception("error"),
+            {"ok": True, "channel": {"id": "C1", "is_ext_shared": False}},
+            {"ok": True, "channel": {"id": "C2", "is_ext_shared": True}},
+            {"ok": True, "channel": {"id": "C1", "is_ext_shared": False}},
+        ]
+    )
+
+    with patch("openai_slackbot.clients.slack._SHARED_CHANNELS_MAX_SIZE", 1):
+        # Failed lookups are assumed shared, but aren't cached.
+        assert await mock_slack_client._is_shared_channel("C1")
+        assert not await mock_slack_client._is_shared_channel("C1")
+        assert not await mock_slack_client._is_shared_channel("C1")
+
+        # "C1" is evicted once the cache is full.
+        assert await mock_slack_client._is_shared_channel("C2")
+        assert not await mock_slack_client._is_shared_channel("C1")
+
+    assert mock_slack_client._client.conversations_info.call_count == 4
+
+
+@pytest.fixture
+def template_path(tmp_path):
+    (tmp_path / "blocks").mkdir()
+    (tmp_path / "blocks" / "constant.j2").write_text('{"type": "divider"}')
+    (tmp_path / "blocks" / "_partial.j2").write_text('{"type": "{{ type }}"},')
+    (tmp_path / "blocks" / "message.j2").write_text(
+        '[{% include "blocks/_partial.j2" %}{"type": "section", "text": "{{ text }}"}]'
+    )
+    return str(tmp_path)
+
+
+def test_render_blocks_from_template(template_path):
+    templates = BlockTemplates(template_path)
+    templates.load()
+
+    assert templates.render("blocks/message.j2", {"type": "divider", "text": "text"}) == [
+        {"type": "divider"},
+        {"type": "section", "text": "text"},
+    ]
+
+    # Constant templates are rendered once, and callers get their own copy.
+    with patch.object(templates, "_render", wraps=templates._render) as mock_render:
+        block = templates.render("blocks/constant.j2", {})
+        block["block_id"] = "block_id"
+        assert templates.render("blocks/constant.j2", {}) == {"type": "divider"}
+        mock_render.assert_called_once_with("blocks/constant.j2", {})
+
+
+def test_load_templates_invalid_json(template_path):
+    with open(os.path.join(template_path, "blocks", "invalid.j2"), "w") as f:
+        f.write('{"type": "section", "text": "{{ text }}"')
+
+    with pytest.raises(ValueError, match="blocks/invalid.j2"):
+        BlockTemplates(template_path).load()
+
+
+async def test_rate_limiter_per_channel_bucket():
+    rate_limiter = RateLimiter()
+    with patch("openai_slackbot.clients.slack.asyncio.sleep", new=AsyncMock()) as mock_sleep:
+        for _ in range(5):
+            await rate_limiter.wait("chat_postMessage", "C1")
+        mock_sleep.assert_not_called()
+
+        # The burst for C1 is used up, but other channels have their own bucket.
+        await rate_limiter.wait("chat_postMessage", "C2")
+        mock_sleep.assert_not_called()
+        await rate_limiter.wait("chat_postMessage", "C1")
+        mock_sleep.assert_called_once()
+        assert mock_sleep.call_args.args[0] == pytest.approx(1.0, abs=0.1)
+
+    assert rate_limiter.throttled_calls["chat_postMessage"] == 1
+    assert rate_limiter.wait_seconds["chat_postMessage"] == pytest.approx(1.0, abs=0.1)
+
+
+async def test_post_message_retry_after(mock_slack_client):
+    rate_limited_response = MagicMock(status_code=429, headers={"Retry-After": "3"})
+    mock_message_data = {
+        "ok": True,
+        "channel": "C234567",
+        "ts": "ts",
+        "message": {
+            "bot_id": "bot_id",
+            "bot_profile": {"id": "bot_profile_id"},
+            "team": "team",
+            "text": "text",
+            "ts": "ts",
+            "type": "type",
+            "user": "user",
+        },
+    }
+    mock_response = MagicMock(data=mock_message_data)
+    mock_response.__getitem__.side_effect = mock_message_data.__getitem__
+    mock_slack_client._client.chat_postMessage = AsyncMock(
+        side_effect=[SlackApiError("ratelimited", rate_limited_response), mock_response]
+    )
+
+    with patch("openai_slackbot.clients.slack.asyncio.sleep", new=AsyncMock()) as mock_sleep:
+        response = await mock_slack_client.post_message(channel="C234567", text="text")
+
+    assert response.ts == "ts"
+    assert mock_slack_client._client.chat_postMessage.call_count == 2
+    assert mock_sleep.call_args.args[0] == pytest.approx(3.0, abs=0.1)
+    assert mock_slack_client.rate_limiter.rate_limited_calls["chat_postMessage"] == 1
+
+
+async def test_post_message_retry_after_exhausted(mock_slack_client):
+    rate_limited_response = MagicMock(status_code=429, headers={"Retry-After": "1"})
+    mock_slack_client._max_rate_limited_retries = 1
+    mock_slack_client._client.chat_postMessage = AsyncMock(
+        side_effect=SlackApiError("ratelimited", rate_limited_response)
+    )
+
+    with patch("openai_slackbot.clients.slack.asyncio.sleep", new=AsyncMock()):
+        with pytest.raises(Exception):
+            await mock_slack_client.post_message(channel="C234567", text="text")
+    assert mock_slack_client._client.chat_postMessage.call_count == 2
+
+
+async def test_get_thread_messages_paginated(mock_slack_client):
+    mock_slack_client._client.conversations_replies = AsyncMock(
+        side_effect=[
+            {
+                "ok": True,
+                "messages": [{"ts": "1"}, {"ts": "2"}],
+                "response_metadata": {"next_cursor": "cursor"},
+            },
+            {"ok": True, "messages": [{"ts": "3"}], "response_metadata": {"next_cursor": ""}},
+        ]
+    )
+
+    messages = await mock_slack_client.get_thread_messages("C123", "1", page_size=2)
+    assert [message["ts"] for message in messages] == ["1", "2", "3"]
+    mock_slack_client._client.conversations_replies.assert_has_calls(
+        [
+            call(channel="C123", ts="1", limit=2, cursor=None),
+            call(channel="C123", ts="1", limit=2, cursor="cursor"),
+        ]
+    )
+
+
+async def test_get_original_blocks_fetches_root_only(mock_slack_client):
+    mock_slack_client._client.conversations_replies = AsyncMock(
+        return_value={
+            "ok": True,
+            "messages": [{"ts": "1", "blocks": [{"type": "section"}]}],
+            "response_metadata": {"next_cursor": "cursor"},
+        }
+    )
+
+    assert await mock_slack_client.get_original_blocks("1", "C123") == [{"type": "section"}]
+    mock_slack_client._client.conversations_replies.assert_called_once_with(
+        channel="C123", ts="1", limit=1, cursor=None
+    )
+
+
+async def test_request_cache_coalesces_reads(mock_slack_client):
+    async def conversations_replies(**kwargs):
+        await asyncio.sleep(0.01)
+        return {"ok": True, "messages": [{"ts": "1", "blocks": [{"type": "section"}]}]}
+
+    mock_slack_client._client.conversations_replies = AsyncMock(side_effect=conversations_replies)
+
+    with request_cache_scope() as cache:
+        blocks, messages = await asyncio.gather(
+            mock_slack_client.get_original_blocks("1", "C123"),
+            mock_slack_client.get_thread_messages("C123", "1"),
+        )
+        assert blocks == [{"type": "section"}]
+        assert messages == [{"ts": "1", "blocks": [{"type": "section"}]}]
+        await mock_slack_client.get_thread_messages("C123", "1")
+
+    mock_slack_client._client.conversations_replies.assert_called_once()
+    assert cache.hits == 2
+
+    # Reads outside of the scope aren't cached.
+    await mock_slack_client.get_thread_messages("C123", "1")
+    assert mock_slack_client._client.conversations_replies.call_count == 2
+
+
+async def test_request_cache_invalidated_by_write(mock_slack_client):
+    mock_slack_client._client.conversations_replies = AsyncMock(
+        return_value={"ok": True, "messages": [{"ts": "1"}]}
+    )
+    mock_slack_client._client.reactions_add = AsyncMock(return_value=MagicMock(data={"ok": True}))
+
+    with request_cache_scope():
+        await mock_slack_client.get_thread_messages("C123", "1")
+        await mock_slack_client.add_reaction(channel="C456", name="eyes", timestamp="1")
+        await mock_slack_client.get_thread_messages("C123", "1")
+        assert mock_slack_client._client.conversations_replies.call_count == 1
+
+        await mock_slack_client.add_reaction(channel="C123", name="eyes", timestamp="1")
+        await mock_slack_client.get_thread_messages("C123", "1")
+        assert mock_slack_client._client.conversations_replies.call_count == 2
@@ -1,4 +1,7 @@
+from unittest.mock import AsyncMock, patch
+
 import pytest
+from openai_slackbot.clients.slack import SlackClient
 
 
 async def test_start_bot(
@@ -6,13 +9,36 @@ async def test_start_bot(
 ):
     from openai_slackbot.bot import start_bot
 
-    await start_bot(
-        openai_organization_id="org-id",
-        slack_message_handler=mock_message_handler.__class__,
-        slack_action_handlers=[mock_action_handler.__class__],
-        slack_template_path="/path/to/templates",
-    )
+    with patch("openai_slackbot.bot.start_metrics_server", new=AsyncMock()) as mock_metrics_server:
+        await start_bot(
+            openai_organization_id="org-id",
+            slack_message_handler=mock_message_handler.__class__,
+            slack_action_handlers=[mock_action_handler.__class__],
+            slack_template_path="/path/to/templates",
+        )
 
-    mock_slack_app.event.assert_called_once_with("message")
+    mock_slack_app.event.assert_any_call("user_change")
+    mock_slack_app.event.assert_any_call("message")
+    assert mock_slack_app.event.call_count == 2
     mock_slack_app.action.assert_called_once_with("mock_action")
     mock_socket_mode_handler.start_async.assert_called_once()
+    mock_metrics_server.assert_awaited_once_with("127.0.0.1", 9464)
+
+
+async def test_init_bot_on_startup(mock_message_handler, mock_action_handler):
+    from openai_slackbot.bot import init_bot
+
+    on_startup = AsyncMock()
+    with patch("openai_slackbot.bot.AsyncApp") as mock_app:
+        app = await init_bot(
+            openai_organization_id="org-id",
+            slack_message_handler=mock_message_handler.__class__,
+            slack_action_handlers=[mock_action_handler.__class__],
+            slack_template_path="/path/to/templates",
+            on_startup=on_startup,
+        )
+
+    assert app == mock_app.return_value
+    on_startup.assert_awaited_once()
+    (slack_client,) = on_startup.await_args.args
+    assert isinstance(slack_client, SlackClient)
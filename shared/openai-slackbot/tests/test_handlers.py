@@ -1,6 +1,9 @@
-from unittest.mock import AsyncMock, MagicMock
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
+from openai_slackbot.handlers import Dispatcher, EventDeduplicator
 
 
 @pytest.mark.parametrize("subtype, should_handle", [("message", True), ("bot_message", False)])
@@ -42,3 +45,126 @@ async def test_action_handler(mock_action_handler):
         "action_type": "type",
         "action": "action",
     }
+
+
+async def test_message_handler_dispatch(mock_message_handler):
+    mock_message_handler.dispatcher = Dispatcher(num_workers=2, max_queue_size=10)
+    args = MagicMock(
+        ack=AsyncMock(),
+        event={"type": "message", "subtype": "message", "channel": "channel", "ts": "ts"},
+    )
+
+    await mock_message_handler.maybe_handle(args)
+    args.ack.assert_awaited_once()
+    assert mock_message_handler.dispatcher.queue_depth == 1
+
+    await mock_message_handler.dispatcher.join()
+    mock_message_handler.mock_handler.assert_awaited_once_with(args)
+    assert mock_message_handler.dispatcher.queue_depth == 0
+    await mock_message_handler.dispatcher.stop()
+
+
+async def test_dispatcher_preserves_order_per_key():
+    dispatcher = Dispatcher(num_workers=4, max_queue_size=100)
+    handled = []
+
+    def work(key, i):
+        async def _work():
+            await asyncio.sleep(0.001 * (i % 3))
+            handled.append((key, i))
+
+        return _work
+
+    for i in range(10):
+        for key in ["C1", "C2", "C3"]:
+            assert dispatcher.submit(key, work(key, i))
+
+    await dispatcher.join()
+    for key in ["C1", "C2", "C3"]:
+        assert [i for k, i in handled if k == key] == list(range(10))
+    await dispatcher.stop()
+
+
+async def test_dispatcher_sheds_load_at_high_water_mark():
+    dispatcher = Dispatcher(num_workers=1, max_queue_size=2)
+    work = AsyncMock()
+
+    assert dispatcher.submit("C1", work)
+    assert dispatcher.submit("C1", work)
+    assert not dispatcher.submit("C1", work)
+    assert dispatcher.shed_count == 1
+
+    await dispatcher.join()
+    assert work.await_count == 2
+    await dispatcher.stop()
+
+
+async def test_message_handler_drops_duplicate_events(mock_message_handler):
+    mock_message_handler.deduplicator = EventDeduplicator()
+    args = MagicMock(
+        ack=AsyncMock(),
+        body={"event_id": "Ev123"},
+        event={"type": "message", "subtype": "message", "channel": "channel", "ts": "ts"},
+    )
+
+    await mock_message_handler.maybe_handle(args)
+    await mock_message_handler.maybe_handle(args)
+    assert args.ack.await_count == 2
+    mock_message_handler.mock_handler.assert_awaited_once_with(args)
+
+
+async def test_action_handler_drops_duplicate_actions(mock_action_handler):
+    mock_action_handler.deduplicator = EventDeduplicator()
+    body = {"type": "type", "actions": ["action"], "trigger_id": "trigger_id"}
+
+    await mock_action_handler.maybe_handle(MagicMock(ack=AsyncMock(), body=body))
+    await mock_action_handler.maybe_handle(MagicMock(ack=AsyncMock(), body=body))
+    await mock_action_handler.maybe_handle(
+        MagicMock(ack=AsyncMock(), body={**body, "trigger_id": "other_trigger_id"})
+    )
+    assert mock_action_handler.mock_handler.await_count == 2
+
+
+async def test_event_deduplicator_ttl_and_max_size():
+    deduplicator = EventDeduplicator(ttl_seconds=60, max_size=2)
+    assert not await deduplicator.seen("1")
+    assert await deduplicator.seen("1")
+
+    # "1" is evicted once the store is full.
+    assert not await deduplicator.seen("2")
+    assert not await deduplicator.seen("3")
+    assert not await deduplicator.seen("1")
+
+    with patch("openai_slackbot.handlers.time.monotonic", return_value=time.monotonic() + 61):
+        assert not await deduplicator.seen("3")
+
+
+async def test_event_deduplicator_sqlite(tmp_path):
+    path = str(tmp_path / "events.db")
+    assert not await EventDeduplicator(ttl_seconds=60, sqlite_path=path).seen("1")
+
+    # Processed events are shared through the file.
+    deduplicator = EventDeduplicator(ttl_seconds=60, sqlite_path=path)
+    assert await deduplicator.seen("1")
+    assert not await deduplicator.seen("2")
+
+    with patch("openai_slackbot.handlers.time.time", return_value=time.time() + 61):
+        assert not await deduplicator.seen("1")
+
+
+async def test_event_deduplicator_sqlite_prunes_periodically(tmp_path):
+    path = str(tmp_path / "events.db")
+    deduplicator = EventDeduplicator(ttl_seconds=60, sqlite_path=path, prune_interval_seconds=600)
+    assert not await deduplicator.seen("1")
+
+    def count():
+        return deduplicator._db.execute("SELECT COUNT(*) FROM processed_events").fetchone()[0]
+
+    # "1" has expired, but isn't pruned until the prune interval has passed.
+    with patch("openai_slackbot.handlers.time.time", return_value=time.time() + 61):
+        assert not await deduplicator.seen("2")
+    assert count() == 2
+
+    with patch("openai_slackbot.handlers.time.time", return_value=time.time() + 601):
+        assert not await deduplicator.seen("3")
+    assert count() == 1
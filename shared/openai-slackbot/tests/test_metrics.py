@@ -0,0 +1,62 @@
+import aiohttp
+import pytest
+from openai_slackbot.metrics import MetricsRegistry, start_metrics_server
+
+
+@pytest.fixture
+def registry():
+    return MetricsRegistry()
+
+
+def test_render_counter_and_gauge(registry):
+    counter = registry.counter("events_total", "Events.", ["handler"])
+    gauge = registry.gauge("queue_depth", "Queue depth.")
+    counter.inc(handler="Mock")
+    counter.inc(2, handler="Mock")
+    gauge.set(3)
+
+    assert registry.render() == (
+        "# HELP events_total Events.\n"
+        "# TYPE events_total counter\n"
+        'events_total{handler="Mock"} 3\n'
+        "# HELP queue_depth Queue depth.\n"
+        "# TYPE queue_depth gauge\n"
+        "queue_depth 3\n"
+    )
+
+
+def test_render_histogram(registry):
+    histogram = registry.histogram("latency_seconds", "Latency.", ["method"], buckets=[0.1, 1])
+    histogram.observe(0.05, method="chat_postMessage")
+    histogram.observe(0.5, method="chat_postMessage")
+    histogram.observe(5, method="chat_postMessage")
+
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'latency_seconds_bucket{method="chat_postMessage",le="0.1"} 1',
+        'latency_seconds_bucket{method="chat_postMessage",le="1"} 2',
+        'latency_seconds_bucket{method="chat_postMessage",le="+Inf"} 3',
+        'latency_seconds_sum{method="chat_postMessage"} 5.55',
+        'latency_seconds_count{method="chat_postMessage"} 3',
+    ]
+
+
+def test_invalid_labels(registry):
+    counter = registry.counter("events_total", "Events.", ["handler"])
+    with pytest.raises(ValueError):
+        counter.inc(method="chat_postMessage")
+    with pytest.raises(ValueError):
+        registry.counter("events_total", "Events.")
+
+
+async def test_metrics_server(registry):
+    registry.counter("events_total", "Events.").inc()
+    runner = await start_metrics_server(port=0, registry=registry)
+    port = runner.addresses[0][1]
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                assert response.status == 200
+                assert "events_total 1" in await response.text()
+    finally:
+        await runner.cleanup()